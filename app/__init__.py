@@ -1,6 +1,6 @@
 from datetime import timedelta
 import os
-from flask import Flask, session
+from flask import Flask, has_request_context, request, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
@@ -14,6 +14,15 @@ csrf = CSRFProtect()
 login_manager = LoginManager()
 mail = Mail()                 # <-- NOVO
 
+# endpoints JSON que nunca precisam da licença no contexto do template
+ENDPOINTS_SEM_LICENCA = {
+    "routes.fitcell_status_venda_peca",
+    "routes.fitcell_aguardar_status_venda_peca",
+    "routes.fitcell_relatorio_job_status",
+    "routes.fitcell_buscar_pecas",
+    "routes.fitcell_pecas_do_modelo",
+}
+
 def create_app():
 
     app = Flask(__name__)
@@ -27,6 +36,12 @@ def create_app():
 
     from app.utils_datetime import utc_to_br
     app.jinja_env.filters["utc_to_br"] = utc_to_br
+
+    from app.utils_imagens import imagem_variante
+    app.jinja_env.filters["imagem_variante"] = imagem_variante
+
+    from app.utils_uploads import url_upload
+    app.jinja_env.filters["url_upload"] = url_upload
     
 
     app.config.from_object(Config)  # Carrega as configurações do config.py
@@ -40,16 +55,29 @@ def create_app():
     # 🔹 INICIALIZAÇÃO DO E-MAIL
     mail.init_app(app)   # <-- NOVO
 
-    # 🔹 Injeta a licença em todos os templates (para usar {{ licenca... }} no Jinja)
+    # 🔹 Injeta a licença DA EMPRESA em todos os templates (para usar {{ licenca... }} no Jinja)
     @app.context_processor
     def inject_licenca_sistema():
-        try:
-            # import local para evitar import circular
-            from app.models import LicencaSistema
-            licenca = LicencaSistema.query.order_by(LicencaSistema.id.desc()).first()
-        except Exception:
-            # Se a tabela ainda não existe (antes de rodar as migrações), não quebra o template
-            licenca = None
+        # fora de requisição (ex.: tarefas em segundo plano) não há empresa logada
+        if not has_request_context():
+            return {}
+
+        # endpoints JSON / PDF não usam {{ licenca }}
+        endpoint = request.endpoint or ""
+
+        if (
+            endpoint in ENDPOINTS_SEM_LICENCA
+            or endpoint.endswith("_pdf")
+            or (request.path.startswith("/fitcell/bi/") and endpoint != "routes.fitcell_bi_dashboard")
+        ):
+            return {}
+
+        # import local para evitar import circular
+        from app.utils_principal import principal_atual
+
+        # 🔹 licença já carregada no principal (cache por empresa, sem query extra)
+        principal = principal_atual()
+        licenca = principal.licenca if principal else None
         return dict(licenca=licenca)
 
 
@@ -70,24 +98,20 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        """Carrega o usuário ao fazer login e garante que as permissões são carregadas corretamente."""
-        from app.models import Usuario  # Importação dentro da função para evitar problemas de importação circular
-        usuario = Usuario.query.get(int(user_id))
-        
-        if usuario:
-            _ = usuario.todas_permissoes  # 🔹 Garante que as permissões são carregadas corretamente
-        
-        return usuario
-
-    # 🔹 Antes de cada requisição, manter a sessão ativa e garantir permissões
+        """Carrega o usuário junto com empresa, licença e permissões (uma única consulta)."""
+        from app.utils_principal import carregar_principal  # Importação dentro da função para evitar problemas de importação circular
+
+        principal = carregar_principal(int(user_id))
+
+        return principal.usuario if principal else None
+
+    # 🔹 Antes de cada requisição, manter a sessão ativa
     @app.before_request
     def verificar_sessao():
         if current_user.is_authenticated:
             session.permanent = True
             session.modified = True
-            
-            # 🔹 Garante que as permissões estão carregadas corretamente no usuário
-            _ = current_user.todas_permissoes
+            # 🔹 Permissões já vieram no principal (g.principal) pelo user_loader
         else:
             logout_user()
 
@@ -101,6 +125,9 @@ def create_app():
     from app.routes_webhook_fitcell import bp_webhook_fitcell
     app.register_blueprint(bp_webhook_fitcell)
 
+    from app.routes_arquivos import bp_arquivos
+    app.register_blueprint(bp_arquivos)
+
     from app.routes import bp as routes_bp
     app.register_blueprint(routes_bp)
 
@@ -110,5 +137,14 @@ def create_app():
     from app.master.routes import bp as master_bp
     app.register_blueprint(master_bp, url_prefix='/master')
 
+    # 🔹 Comandos de manutenção (flask estoque | bi | relatorios | pecas | pagamentos | uploads)
+    from app.cli import bi_cli, estoque_cli, pagamentos_cli, pecas_cli, relatorios_cli, uploads_cli
+    app.cli.add_command(estoque_cli)
+    app.cli.add_command(bi_cli)
+    app.cli.add_command(relatorios_cli)
+    app.cli.add_command(pecas_cli)
+    app.cli.add_command(pagamentos_cli)
+    app.cli.add_command(uploads_cli)
+
 
     return app
@@ -0,0 +1,263 @@
+# app/cli.py
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+
+from app import db
+from app.models import Empresa
+from app.utils_datetime import utc_now, utc_to_br
+
+
+estoque_cli = AppGroup("estoque", help="Rotinas de estoque (snapshots de saldo).")
+
+
+def _data_arg(valor):
+    return datetime.strptime(valor, "%Y-%m-%d").date()
+
+
+def _empresas(empresa_id):
+    query = Empresa.query.filter_by(ativa=True)
+    if empresa_id:
+        query = query.filter_by(id=empresa_id)
+    return query.order_by(Empresa.id).all()
+
+
+@estoque_cli.command("snapshot")
+@click.option("--data", "data_str", help="Dia do snapshot (YYYY-MM-DD). Padrão: ontem.")
+@click.option("--desde", "desde_str", help="Gera um snapshot por dia de --desde até --data.")
+@click.option("--empresa-id", type=int, help="Apenas uma empresa.")
+def estoque_snapshot(data_str, desde_str, empresa_id):
+    """
+    Grava o saldo diário por peça (agendar 1x por dia, após a meia-noite).
+    """
+    from app.services.estoque.saldo_historico import gerar_snapshot
+
+    ontem = utc_to_br(utc_now()).date() - timedelta(days=1)
+    data_fim = _data_arg(data_str) if data_str else ontem
+    data_ini = _data_arg(desde_str) if desde_str else data_fim
+
+    for empresa in _empresas(empresa_id):
+        dia = data_ini
+        while dia <= data_fim:
+            qtd = gerar_snapshot(empresa.id, dia)
+            db.session.commit()
+            click.echo(f"empresa {empresa.id} | {dia:%d/%m/%Y} | {qtd} peças")
+            dia += timedelta(days=1)
+
+
+@estoque_cli.command("reconciliar")
+@click.option("--empresa-id", type=int, help="Confere apenas uma empresa.")
+@click.option("--corrigir", is_flag=True, help="Grava 'ajuste' no razão para cada divergência.")
+@click.option("--lote", type=int, default=200_000, show_default=True,
+              help="Faixa de ids de movimentação somada por transação.")
+def estoque_reconciliar(empresa_id, corrigir, lote):
+    """
+    Confere EstoquePeca.quantidade com a soma das movimentações.
+
+    Incremental: só as movimentações novas desde a última execução
+    são lidas. Sai com código 1 se houver divergência não corrigida.
+    """
+    from app.services.estoque.reconciliacao import (
+        atualizar_razao, buscar_divergencias, corrigir_divergencias
+    )
+
+    checkpoint, somadas = atualizar_razao(lote=lote)
+    click.echo(f"razão atualizado: {somadas} movimentações novas (checkpoint id {checkpoint})")
+
+    divergencias = list(buscar_divergencias(empresa_id))
+
+    for d in divergencias:
+        click.echo(
+            f"empresa {d.empresa_id} | peça {d.peca_id} | "
+            f"saldo={d.saldo} razão={d.razao} diferença={d.diferenca:+d}"
+        )
+
+    if not divergencias:
+        click.echo("✅ Nenhuma divergência.")
+        return
+
+    if not corrigir:
+        click.echo(f"❌ {len(divergencias)} peças divergentes (use --corrigir para ajustar o razão).")
+        raise SystemExit(1)
+
+    gravados = corrigir_divergencias(divergencias)
+    click.echo(f"🔧 {gravados} ajustes gravados.")
+
+
+bi_cli = AppGroup("bi", help="Rotinas do BI (resumo diário de vendas).")
+
+
+@bi_cli.command("reconstruir-resumo")
+@click.option("--empresa-id", type=int, help="Apenas uma empresa.")
+def bi_reconstruir_resumo(empresa_id):
+    """
+    Recalcula fitcell_venda_resumo_diario a partir das vendas (carga inicial / correção).
+    """
+    from app.services.bi.resumo_vendas import reconstruir_resumo
+
+    for empresa in _empresas(empresa_id):
+        qtd = reconstruir_resumo(empresa.id)
+        db.session.commit()
+        click.echo(f"empresa {empresa.id} | {qtd} linhas")
+
+
+relatorios_cli = AppGroup("relatorios", help="Fila de PDFs em segundo plano.")
+
+
+@relatorios_cli.command("worker")
+@click.option("--intervalo", type=float, default=1.0, show_default=True,
+              help="Segundos de espera quando a fila está vazia.")
+@click.option("--uma-vez", is_flag=True, help="Processa o que houver na fila e sai.")
+def relatorios_worker(intervalo, uma_vez):
+    """
+    Renderiza os PDFs pendentes (pode rodar mais de um worker ao mesmo tempo).
+    """
+    import time
+
+    from app.services.relatorios.pdf_jobs import liberar_travados, processar_job
+
+    liberados = liberar_travados()
+    if liberados:
+        click.echo(f"{liberados} jobs travados voltaram para a fila")
+
+    while True:
+        job_id = processar_job()
+
+        if job_id is not None:
+            click.echo(f"job {job_id} processado")
+            continue
+
+        if uma_vez:
+            return
+
+        db.session.remove()
+        time.sleep(intervalo)
+
+
+@relatorios_cli.command("limpar")
+@click.option("--dias", type=int, default=7, show_default=True,
+              help="Apaga PDFs gerados há mais que isso.")
+def relatorios_limpar(dias):
+    """
+    Apaga jobs terminados e seus PDFs (agendar no cron, ex.: diário).
+    """
+    from datetime import timedelta
+
+    from app.services.relatorios.pdf_jobs import limpar_antigos
+
+    apagados = limpar_antigos(timedelta(days=dias))
+    click.echo(f"{apagados} jobs de relatório apagados")
+
+
+pecas_cli = AppGroup("pecas", help="Rotinas do catálogo de peças.")
+
+
+@pecas_cli.command("indexar-busca")
+def pecas_indexar_busca():
+    """
+    Cria a extensão pg_trgm / índice GIN e recalcula o texto de busca de todas as peças.
+    """
+    from app.services.pecas.busca import indexar_busca
+
+    qtd = indexar_busca()
+    db.session.commit()
+    click.echo(f"{qtd} peças indexadas")
+
+
+@pecas_cli.command("otimizar-imagens")
+def pecas_otimizar_imagens():
+    """
+    Gera WebP + miniaturas das fotos enviadas antes do pipeline de imagens.
+    """
+    from app.services.pecas.imagens import otimizar_imagens
+
+    convertidas, falhas = otimizar_imagens()
+    click.echo(f"{convertidas} imagens convertidas, {falhas} com falha")
+
+
+pagamentos_cli = AppGroup("pagamentos", help="Rotinas de pagamento (Mercado Pago).")
+
+
+@pagamentos_cli.command("processar-webhooks")
+@click.option("--lote", type=int, default=20, show_default=True, help="Avisos reservados por vez.")
+@click.option("--intervalo", type=float, default=2.0, show_default=True,
+              help="Segundos de espera quando a caixa de entrada está vazia.")
+@click.option("--uma-vez", is_flag=True, help="Processa o que houver na caixa de entrada e sai.")
+def pagamentos_processar_webhooks(lote, intervalo, uma_vez):
+    """
+    Confirma as vendas a partir dos webhooks recebidos (pode rodar mais de um worker).
+    """
+    import time
+
+    from app.services.pagamento.webhook_inbox import liberar_travados, processar_avisos
+
+    liberados = liberar_travados()
+    if liberados:
+        click.echo(f"{liberados} avisos travados voltaram para a fila")
+
+    while True:
+        qtd = processar_avisos(lote)
+
+        if qtd:
+            click.echo(f"{qtd} avisos processados")
+
+        if uma_vez:
+            return
+
+        db.session.remove()
+        time.sleep(intervalo)
+
+
+@pagamentos_cli.command("varrer-pendentes")
+@click.option("--empresa-id", type=int, help="Apenas uma empresa.")
+@click.option("--concorrencia", type=int, default=4, show_default=True,
+              help="Consultas simultâneas ao Mercado Pago.")
+@click.option("--idade-minutos", type=int, default=5, show_default=True,
+              help="Ignora vendas mais novas que isso (o webhook ainda pode chegar).")
+def pagamentos_varrer_pendentes(empresa_id, concorrencia, idade_minutos):
+    """
+    Confirma Pix pagos cujo webhook se perdeu, gera de novo cobranças Pix
+    travadas e drena a caixa de entrada dos webhooks (agendar no cron,
+    ex.: a cada 5 min).
+    """
+    from datetime import timedelta
+
+    from app.services.pagamento.varredura import varrer_pendentes
+    from app.services.pagamento.webhook_inbox import liberar_travados, processar_avisos
+
+    # caixa de entrada dos webhooks: travados (processo morto) e retentativas
+    liberados = liberar_travados()
+    if liberados:
+        click.echo(f"{liberados} avisos travados voltaram para a fila")
+
+    avisos = processar_avisos()
+    if avisos:
+        click.echo(f"{avisos} avisos de webhook processados")
+
+    resultados = varrer_pendentes(
+        empresa_id,
+        concorrencia=concorrencia,
+        idade_minima=timedelta(minutes=idade_minutos)
+    )
+
+    if not resultados:
+        click.echo("nenhuma venda Pix pendente")
+        return
+
+    for resultado, qtd in sorted(resultados.items()):
+        click.echo(f"{resultado}: {qtd}")
+
+
+uploads_cli = AppGroup("uploads", help="Arquivos enviados (endereçados pelo conteúdo).")
+
+
+@uploads_cli.command("limpar")
+def uploads_limpar():
+    """
+    Apaga do disco os arquivos que nenhum registro usa mais.
+    """
+    from app.utils_uploads import limpar_orfaos
+
+    qtd = limpar_orfaos()
+    click.echo(f"{qtd} arquivos apagados")
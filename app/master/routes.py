@@ -7,6 +7,8 @@ from app.utils_master import requer_master
 from app.master.forms import NovaEmpresaForm
 from app import db
 from app.models import Empresa, Usuario, LicencaSistema, Permissao
+from app.utils_licenca import invalidar_licenca
+from app.utils_principal import invalidar_permissoes
 
 
 
@@ -107,6 +109,8 @@ def nova_empresa():
                         )
                     )
 
+            invalidar_permissoes(admin.id)
+
             # =====================================================
             # 4️⃣ LICENÇA
             # =====================================================
@@ -118,6 +122,7 @@ def nova_empresa():
             db.session.add(licenca)
 
             db.session.commit()
+            invalidar_licenca(empresa.id)
 
             flash("Empresa criada com sucesso!", "success")
             return redirect(url_for("master.listar_empresas"))
@@ -215,6 +220,7 @@ def renovar_licenca(empresa_id):
         licenca.dias_acesso += 30
 
     db.session.commit()
+    invalidar_licenca(empresa.id)
 
     flash("Licença renovada por mais 30 dias.", "success")
     return redirect(url_for("master.listar_empresas"))
@@ -1,12 +1,14 @@
 from decimal import Decimal
 from flask_login import UserMixin
+from sqlalchemy import DDL, bindparam, event, inspect, select, update
 from sqlalchemy.orm import relationship
 from app import db
 from decimal import Decimal, ROUND_HALF_UP, ROUND_CEILING
 from datetime import datetime
 from sqlalchemy.orm import backref
 from app.mixins import EmpresaQueryMixin
-from app.utils_datetime import utc_now
+from app.utils_busca import montar_busca_texto
+from app.utils_datetime import utc_now, utc_now_exato
 
 from datetime import date, timedelta
 
@@ -27,6 +29,14 @@ class Empresa(db.Model):
     ativa = db.Column(db.Boolean, default=True)
     criada_em = db.Column(db.DateTime, default=utc_now)
 
+    # incrementada a cada alteração de CompatibilidadePeca (chave do índice em memória)
+    compat_versao = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+
 
 class Usuario(UserMixin, EmpresaQueryMixin,db.Model):
     __tablename__ = "usuario"
@@ -59,6 +69,14 @@ class Usuario(UserMixin, EmpresaQueryMixin,db.Model):
     versao_termos = db.Column(db.String(20))
     ip_aceite = db.Column(db.String(45))
 
+    # incrementada a cada alteração de Permissao (chave do cache de permissões)
+    permissoes_versao = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+
     permissoes = db.relationship(
         "Permissao",
         backref="usuario",
@@ -74,7 +92,14 @@ class Usuario(UserMixin, EmpresaQueryMixin,db.Model):
 
     @property
     def todas_permissoes(self):
-        return {(p.categoria, p.acao) for p in self.permissoes.all()}
+        # 🔹 cache por instância (preenchido pelo principal da requisição)
+        cache = getattr(self, "_permissoes_cache", None)
+
+        if cache is None:
+            cache = {(p.categoria, p.acao) for p in self.permissoes.all()}
+            self._permissoes_cache = cache
+
+        return cache
 
     def tem_permissao(self, categoria, acao):
         return (categoria, acao) in self.todas_permissoes
@@ -363,6 +388,83 @@ class Peca(EmpresaQueryMixin, db.Model):
 
     ativo = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=utc_now)
+    atualizado_em = db.Column(db.DateTime, default=utc_now_exato, onupdate=utc_now_exato)
+
+    # código + nome + marca + qualidade + tipo, normalizado (utils_busca).
+    # Mantido pelos eventos abaixo; índice GIN pg_trgm para ILIKE / similaridade.
+    busca_texto = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index(
+            "ix_fitcell_peca_busca_trgm",
+            "busca_texto",
+            postgresql_using="gin",
+            postgresql_ops={"busca_texto": "gin_trgm_ops"}
+        ),
+    )
+
+
+# =====================================================
+# 🔎 TEXTO DE BUSCA DA PEÇA
+# =====================================================
+def _busca_texto_peca(connection, peca):
+    tipo_nome = None
+
+    if peca.tipo_peca_id:
+        tipo_nome = connection.execute(
+            select(TipoPeca.nome).where(TipoPeca.id == peca.tipo_peca_id)
+        ).scalar()
+
+    return montar_busca_texto(
+        peca.codigo_interno,
+        peca.nome,
+        peca.marca_peca,
+        (peca.qualidade or "").replace("_", " "),
+        tipo_nome
+    )
+
+
+@event.listens_for(Peca, "before_insert")
+@event.listens_for(Peca, "before_update")
+def _atualizar_busca_texto_peca(mapper, connection, peca):
+    peca.busca_texto = _busca_texto_peca(connection, peca)
+
+
+@event.listens_for(TipoPeca, "after_update")
+def _reindexar_pecas_do_tipo(mapper, connection, tipo):
+    if not inspect(tipo).attrs.nome.history.has_changes():
+        return
+
+    pecas = connection.execute(
+        select(
+            Peca.id, Peca.codigo_interno, Peca.nome, Peca.marca_peca, Peca.qualidade
+        ).where(Peca.tipo_peca_id == tipo.id)
+    ).all()
+
+    if pecas:
+        connection.execute(
+            update(Peca.__table__)
+            .where(Peca.__table__.c.id == bindparam("b_id"))
+            .values(busca_texto=bindparam("b_texto")),
+            [
+                {
+                    "b_id": p.id,
+                    "b_texto": montar_busca_texto(
+                        p.codigo_interno, p.nome, p.marca_peca,
+                        (p.qualidade or "").replace("_", " "), tipo.nome
+                    )
+                }
+                for p in pecas
+            ]
+        )
+
+
+# pg_trgm precisa existir antes do índice GIN (db.create_all em banco novo)
+event.listen(
+    Peca.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
 
 
 class CompatibilidadePeca(db.Model):
@@ -390,6 +492,7 @@ class CompatibilidadePeca(db.Model):
             "modelo_celular_id",
             name="uq_fitcell_peca_modelo"
         ),
+        db.Index("ix_fitcell_compat_modelo", "modelo_celular_id"),
     )
 
 class EstoquePeca(EmpresaQueryMixin, db.Model):
@@ -463,15 +566,34 @@ class VendaPeca(EmpresaQueryMixin, db.Model):
     )
     # manual | link
 
-    criado_em = db.Column(db.DateTime, default=utc_now)
+    criado_em = db.Column(db.DateTime, nullable=False, default=utc_now)
     pago_em = db.Column(db.DateTime)
 
+    # muda a cada alteração da venda (versão dos relatórios em cache)
+    atualizado_em = db.Column(db.DateTime, default=utc_now_exato, onupdate=utc_now_exato)
+
     # PIX (já preparado)
     pix_qr_code = db.Column(db.Text)
     pix_qr_code_base64 = db.Column(db.Text)
     pagamento_id = db.Column(db.String(100))
     pagamento_status = db.Column(db.String(30))
 
+    __table_args__ = (
+        # listagens paginadas por cursor (criado_em, id)
+        db.Index(
+            "ix_fitcell_venda_empresa_criado",
+            "empresa_id",
+            "criado_em",
+            "id"
+        ),
+        # varredura de Pix sem confirmação (flask pagamentos varrer-pendentes)
+        db.Index(
+            "ix_fitcell_venda_aguardando_pagamento",
+            "criado_em",
+            postgresql_where=db.text("status = 'AGUARDANDO_PAGAMENTO' AND pagamento_id IS NOT NULL")
+        ),
+    )
+
     itens = db.relationship(
         "VendaPecaItem",
         back_populates="venda",
@@ -591,9 +713,19 @@ class CompraEstoque(EmpresaQueryMixin, db.Model):
     )
     # ATIVA | ESTORNADA
 
-    criado_em = db.Column(db.DateTime, default=utc_now)
+    criado_em = db.Column(db.DateTime, nullable=False, default=utc_now)
     estornada_em = db.Column(db.DateTime)
 
+    __table_args__ = (
+        # listagens paginadas por cursor (criado_em, id)
+        db.Index(
+            "ix_fitcell_compra_empresa_criado",
+            "empresa_id",
+            "criado_em",
+            "id"
+        ),
+    )
+
 
 class CompraEstoqueItem(db.Model):
     __tablename__ = "fitcell_compra_estoque_item"
@@ -664,4 +796,233 @@ class EstoqueMovimentacao(EmpresaQueryMixin, db.Model):
 
     quantidade = db.Column(db.Integer, nullable=False)
     observacao = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=utc_now)
+
+    __table_args__ = (
+        # consultas por período (saldo em data, relatórios) e paginação por cursor
+        db.Index(
+            "ix_fitcell_mov_empresa_criado",
+            "empresa_id",
+            "criado_em",
+            "id"
+        ),
+    )
+
+
+class EstoqueSaldoDiario(EmpresaQueryMixin, db.Model):
+    """
+    Snapshot do saldo de cada peça ao fim do dia (horário de Brasília).
+    Base para "quanto eu tinha da peça X na data D" sem varrer o razão inteiro.
+    """
+    __tablename__ = "fitcell_estoque_saldo_diario"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    empresa_id = db.Column(
+        db.Integer,
+        db.ForeignKey("empresa.id"),
+        nullable=False
+    )
+
+    peca_id = db.Column(
+        db.Integer,
+        db.ForeignKey("fitcell_peca.id"),
+        nullable=False
+    )
+    peca = db.relationship("Peca")
+
+    data = db.Column(db.Date, nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False)
+
+    criado_em = db.Column(db.DateTime, default=utc_now)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "empresa_id",
+            "data",
+            "peca_id",
+            name="uq_fitcell_saldo_diario_empresa_data_peca"
+        ),
+    )
+
+
+class EstoqueRazaoSaldo(EmpresaQueryMixin, db.Model):
+    """
+    Soma das movimentações (razão) por peça, até o checkpoint da reconciliação.
+    Mantida pelo `flask estoque reconciliar`; não é usada pelas telas.
+    """
+    __tablename__ = "fitcell_estoque_razao_saldo"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    empresa_id = db.Column(
+        db.Integer,
+        db.ForeignKey("empresa.id"),
+        nullable=False,
+        index=True
+    )
+
+    peca_id = db.Column(
+        db.Integer,
+        db.ForeignKey("fitcell_peca.id"),
+        nullable=False,
+        unique=True
+    )
+
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+
+class EstoqueReconciliacao(db.Model):
+    """
+    Checkpoint da reconciliação: último EstoqueMovimentacao.id já somado
+    em EstoqueRazaoSaldo. Uma linha só (todas as empresas).
+    """
+    __tablename__ = "fitcell_estoque_reconciliacao"
+
+    id = db.Column(db.Integer, primary_key=True)
+    ultimo_movimento_id = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+
+class VendaResumoDiario(EmpresaQueryMixin, db.Model):
+    """
+    Vendas válidas (STATUS_FINANCEIRO_VALIDO) agregadas por dia (horário de
+    Brasília, pela data de criação da venda) e peça. Fonte dos endpoints de BI.
+
+    Mantida na mesma transação da venda por app.services.bi.resumo_vendas.
+    """
+    __tablename__ = "fitcell_venda_resumo_diario"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    empresa_id = db.Column(
+        db.Integer,
+        db.ForeignKey("empresa.id"),
+        nullable=False
+    )
+
+    data = db.Column(db.Date, nullable=False)
+
+    peca_id = db.Column(
+        db.Integer,
+        db.ForeignKey("fitcell_peca.id"),
+        nullable=False
+    )
+    peca = db.relationship("Peca")
+
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor_bruto = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    desconto = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    valor_liquido = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    atualizado_em = db.Column(db.DateTime, default=utc_now_exato, onupdate=utc_now_exato)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "empresa_id",
+            "data",
+            "peca_id",
+            name="uq_fitcell_venda_resumo_empresa_data_peca"
+        ),
+    )
+
+
+class RelatorioJob(EmpresaQueryMixin, db.Model):
+    """
+    Renderização de PDF em segundo plano.
+
+    chave = HMAC(empresa, relatório, parâmetros, versão dos dados): o mesmo
+    pedido com os mesmos dados reaproveita o arquivo já gerado.
+    """
+    __tablename__ = "fitcell_relatorio_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    empresa_id = db.Column(
+        db.Integer,
+        db.ForeignKey("empresa.id"),
+        nullable=False,
+        index=True
+    )
+
+    relatorio = db.Column(db.String(60), nullable=False)
+    chave = db.Column(db.String(64), nullable=False, unique=True)
+
+    # HMAC(empresa, relatório, parâmetros) sem a versão: as versões
+    # antigas do mesmo pedido são apagadas quando a nova fica pronta
+    grupo = db.Column(db.String(64), index=True)
+
+    # registro de origem dos recibos ("venda:<id>"), para descartar no cancelamento
+    referencia = db.Column(db.String(40), index=True)
+    nome_arquivo = db.Column(db.String(120), nullable=False)
+
+    # entrada do worker (apagada depois de renderizar)
+    html = db.Column(db.Text)
+    base_url = db.Column(db.String(255))
+
+    status = db.Column(db.String(20), nullable=False, default="PENDENTE", index=True)
+    # PENDENTE | PROCESSANDO | PRONTO | ERRO
+
+    arquivo = db.Column(db.String(255))   # caminho relativo a UPLOAD_ROOT
+    erro = db.Column(db.Text)
+
+    criado_em = db.Column(db.DateTime, default=utc_now)
+    iniciado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+
+
+class WebhookPagamento(db.Model):
+    """
+    Caixa de entrada dos webhooks do Mercado Pago: uma linha por pagamento.
+
+    O webhook só grava/reabre a linha e responde 200; o worker consulta o
+    gateway e confirma a venda depois. Avisos repetidos do mesmo
+    pagamento somam em `recebimentos` em vez de criar outra linha.
+    """
+    __tablename__ = "fitcell_webhook_pagamento"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    pagamento_id = db.Column(db.String(64), nullable=False, unique=True)
+
+    status = db.Column(db.String(20), nullable=False, default="PENDENTE", index=True)
+    # PENDENTE | PROCESSANDO | PROCESSADO | ERRO
+
+    # incrementado a cada aviso: se mudou durante o processamento, reprocessa
+    recebimentos = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    tentativas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    resultado = db.Column(db.String(40))
+    erro = db.Column(db.Text)
+
+    recebido_em = db.Column(db.DateTime, default=utc_now)
+    disponivel_em = db.Column(db.DateTime, default=utc_now, index=True)   # backoff entre tentativas
+    iniciado_em = db.Column(db.DateTime)
+    processado_em = db.Column(db.DateTime)
+
+
+class ArquivoUpload(db.Model):
+    """
+    Arquivo enviado, endereçado pelo conteúdo (sha256 no nome): o mesmo
+    arquivo enviado de novo reaproveita o que já está no disco.
+
+    referencias = quantos registros apontam para `caminho`. Zerado, o
+    `flask uploads limpar` apaga o arquivo (e as miniaturas).
+    """
+    __tablename__ = "fitcell_arquivo_upload"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    empresa_id = db.Column(
+        db.Integer,
+        db.ForeignKey("empresa.id"),
+        nullable=False,
+        index=True
+    )
+
+    caminho = db.Column(db.String(255), nullable=False, unique=True)   # como gravado no registro
+    hash = db.Column(db.String(64), nullable=False)
+    tamanho = db.Column(db.Integer)   # bytes do arquivo enviado
+
+    referencias = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)
+
     criado_em = db.Column(db.DateTime, default=utc_now)
@@ -11,7 +11,8 @@ from app import db, csrf
 
 from app.models import LicencaSistema, LogAcao, Usuario, Permissao 
 from app.forms import UsuarioForm
-from app.utils_licenca import requer_licenca_ativa
+from app.utils_licenca import invalidar_licenca, requer_licenca_ativa
+from app.utils_principal import invalidar_permissoes, principal_atual
 
 
 
@@ -50,8 +51,10 @@ def verificar_termos_aceitos():
 @bp.before_request
 def carregar_permissoes():
     """Garante que as permissões do usuário estejam disponíveis em todas as páginas."""
-    if current_user.is_authenticated:
-        g.permissoes = current_user.todas_permissoes
+    principal = principal_atual()
+
+    if principal:
+        g.permissoes = principal.permissoes  # 🔹 sem nova query
     else:
         g.permissoes = set()  # Usuário sem permissões
 
@@ -186,6 +189,8 @@ def editar_usuario(id):
         if form.senha.data:
             usuario.set_password(form.senha.data)
 
+        invalidar_permissoes(usuario.id)
+
         db.session.commit()
         flash("Usuário atualizado com sucesso!", "success")
         return redirect(url_for('routes.listar_usuarios'))
@@ -332,6 +337,9 @@ def gerenciar_permissoes(id):
                 acao=acao
             ).delete()
 
+        # 🔹 invalida o cache de permissões na mesma transação
+        invalidar_permissoes(usuario.id)
+
         db.session.commit()
 
         flash("Permissões atualizadas com sucesso!", "success")
@@ -412,6 +420,7 @@ def editar_licenca(id):
     licenca.data_inicio = date.today()
     licenca.dias_acesso = 30
     db.session.commit()
+    invalidar_licenca(licenca.empresa_id)
     flash('Licença atualizada com sucesso!', 'success')
     return redirect(url_for('routes.listar_licencas'))
 
@@ -421,8 +430,10 @@ def editar_licenca(id):
 @somente_admin
 def excluir_licenca(id):
     licenca = LicencaSistema.query.get_or_404(id)
+    empresa_id = licenca.empresa_id
     db.session.delete(licenca)
     db.session.commit()
+    invalidar_licenca(empresa_id)
     flash("Licença excluída com sucesso!", "success")
     return redirect(url_for('routes.listar_licencas'))
 
@@ -0,0 +1,30 @@
+import os
+
+from flask import Blueprint, abort, current_app, send_from_directory
+from app.utils_uploads import arquivo_enderecado
+
+bp_arquivos = Blueprint("arquivos", __name__)
+
+# o nome é o hash do conteúdo: o arquivo de uma URL nunca muda
+CACHE_IMUTAVEL = "public, max-age=31536000, immutable"
+
+
+@bp_arquivos.route("/arquivos/<path:caminho>")
+def servir_arquivo(caminho):
+    """
+    Uploads endereçados pelo conteúdo (utils_uploads), com cache permanente.
+    Qualquer outro arquivo de UPLOAD_ROOT (ex.: PDFs) não passa por aqui.
+    """
+
+    if not arquivo_enderecado(caminho):
+        abort(404)
+
+    resposta = send_from_directory(
+        current_app.config["UPLOAD_ROOT"],
+        caminho,
+        conditional=True,
+        etag=os.path.splitext(os.path.basename(caminho))[0],
+        max_age=31536000
+    )
+    resposta.headers["Cache-Control"] = CACHE_IMUTAVEL
+    return resposta
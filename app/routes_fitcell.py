@@ -1,14 +1,30 @@
 from decimal import Decimal
 import os
-from flask import current_app, jsonify, make_response, render_template, redirect, url_for, request, flash
+from flask import abort, current_app, jsonify, make_response, render_template, redirect, url_for, request, flash
 from flask_login import current_user, login_required
-from weasyprint import HTML
 from werkzeug.utils import secure_filename  # 🔹 Para salvar o nome do arquivo corretamente
 
 from app import db
-from app.models import CompatibilidadePeca, CompraEstoque, CompraEstoqueItem, EstoqueMovimentacao, EstoquePeca, Fornecedor, MarcaCelular, ModeloCelular, Peca, TipoPeca, VendaPeca, VendaPecaItem
+from app.models import CompatibilidadePeca, CompraEstoque, CompraEstoqueItem, EstoqueMovimentacao, EstoquePeca, Fornecedor, MarcaCelular, ModeloCelular, Peca, RelatorioJob, TipoPeca, VendaPeca, VendaPecaItem
 from app.forms import CompraEstoqueForm, FornecedorForm, MarcaCelularForm, ModeloCelularForm, PecaForm, TipoPecaForm, VendaPecaForm
-from app.services.pagamento.mercadopago_client import MercadoPagoClient
+from app.services.bi.resumo_vendas import registrar_venda, status_conta_no_bi
+from app.services.estoque.estoque_service import EstoqueService, MovimentoEstoque
+from app.services.pecas.compatibilidade import invalidar_compatibilidade, pecas_compativeis
+from app.services.pecas.busca import filtrar_pecas, sugerir_pecas
+from app.services.estoque.saldo_historico import saldo_em
+from app.services.pagamento.exceptions import PagamentoConfigNotFound
+from app.services.pagamento.mercadopago_client import carregar_config
+from app.services.pagamento.notificacoes import aguardar_venda, liberar_espera, notificar_venda, reservar_espera
+from app.services.pagamento.pix import (
+    PIX_FALHOU,
+    PIX_GERANDO,
+    agendar_cobranca_pix,
+    enviar_cobranca_pix,
+    pix_travado
+)
+from app.services.relatorios.pdf_jobs import PERMISSOES_RELATORIO, enviar_pdf, obter_pdf, pdf_disponivel, versao_dados_empresa
+from app.services.relatorios.exportacao import FORMATOS as FORMATOS_EXPORTACAO, linhas_compras, linhas_movimentacoes, linhas_vendas, resposta_exportacao
+from app.services.relatorios.recibos import descartar_recibos, responder_recibo
 from app.utils import formatar_data, formatar_data_hora, formatar_moeda, requer_permissao
 
 from sqlalchemy.exc import IntegrityError
@@ -19,7 +35,9 @@ from app import csrf
 from app.routes import bp
 from app.utils_datetime import utc_now
 from app.utils_licenca import requer_licenca_ativa  # ← IMPORTA O MESMO BLUEPRINT DO routes.py
-from app.utils_uploads import salvar_upload
+from app.utils_paginacao import args_cursor, paginar_por_cursor
+from app.utils_imagens import ImagemInvalida, imagem_variante
+from app.utils_uploads import liberar_upload, salvar_imagem
 
 
 ##helpers  de DATAS PARA AS ROTAS ##
@@ -48,6 +66,21 @@ def periodo_datetime(data_ini, data_fim):
     return dt_ini, dt_fim
 
 
+def qtd_itens_venda():
+    """
+    Quantidade de itens da venda (subconsulta correlacionada): a listagem
+    pagina as vendas sem agrupar a tabela inteira.
+    """
+
+    return (
+        db.select(func.coalesce(func.sum(VendaPecaItem.quantidade), 0))
+        .where(VendaPecaItem.venda_id == VendaPeca.id)
+        .correlate(VendaPeca)
+        .scalar_subquery()
+        .label("qtd_itens")
+    )
+
+
 @bp.route('/teste_fitcell')
 @login_required
 @requer_permissao("administrativo", "ver")
@@ -410,7 +443,7 @@ def fitcell_editar_tipo_peca(id):
         titulo="Editar Tipo de Peça"
     )
 
-from sqlalchemy import func, or_
+from sqlalchemy import func
 
 @bp.route("/fitcell/pecas")
 @login_required
@@ -433,18 +466,11 @@ def fitcell_listar_pecas():
         .filter(Peca.empresa_id == current_user.empresa_id)
     )
 
-    if busca:
-        query = query.filter(
-            or_(
-                Peca.codigo_interno.ilike(f"%{busca}%"),
-                Peca.nome.ilike(f"%{busca}%"),
-                Peca.marca_peca.ilike(f"%{busca}%"),
-                Peca.qualidade.ilike(f"%{busca}%"),
-                Peca.tipo.has(TipoPeca.nome.ilike(f"%{busca}%"))
-            )
-        )
+    # busca indexada (pg_trgm), já ordenada por relevância
+    query, ordenada = filtrar_pecas(query, busca)
 
-    query = query.order_by(Peca.id.desc())
+    if not ordenada:
+        query = query.order_by(Peca.id.desc())
 
     pecas = query.paginate(page=page, per_page=20)
 
@@ -456,6 +482,67 @@ def fitcell_listar_pecas():
 
 
 
+@bp.route("/fitcell/pecas/buscar")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("venda", "ver")
+def fitcell_buscar_pecas():
+    """
+    Typeahead: peças mais parecidas com ?q= (JSON).
+    """
+
+    limite = min(request.args.get("limite", 10, type=int), 50)
+
+    pecas = sugerir_pecas(current_user.empresa_id, request.args.get("q", ""), limite)
+
+    estoque = dict(
+        db.session.query(EstoquePeca.peca_id, EstoquePeca.quantidade)
+        .filter(EstoquePeca.peca_id.in_([p.id for p in pecas]))
+        .all()
+    ) if pecas else {}
+
+    return jsonify([
+        {
+            "id": p.id,
+            "codigo": p.codigo_interno,
+            "nome": p.nome,
+            "tipo": p.tipo.nome if p.tipo else None,
+            "qualidade": p.qualidade,
+            "marca": p.marca_peca,
+            "preco_venda": float(p.preco_venda or 0),
+            "quantidade": int(estoque.get(p.id) or 0),
+            "imagem": imagem_variante(p.imagem, "p")
+        }
+        for p in pecas
+    ])
+
+
+@bp.route("/fitcell/modelos/<int:modelo_id>/pecas")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("venda", "ver")
+def fitcell_pecas_do_modelo(modelo_id):
+    """
+    Peças ativas compatíveis com o modelo (formulários de venda/orçamento).
+    """
+
+    ModeloCelular.query_empresa().filter_by(id=modelo_id).first_or_404()
+
+    pecas = pecas_compativeis(current_user.empresa_id, modelo_id)
+
+    return jsonify([
+        {
+            "id": p.id,
+            "codigo": p.codigo_interno,
+            "nome": p.nome,
+            "qualidade": p.qualidade,
+            "preco_venda": float(p.preco_venda or 0),
+            "preco_minimo": float(p.preco_minimo or 0)
+        }
+        for p in pecas
+    ])
+
+
 @bp.route("/fitcell/pecas/nova", methods=["GET", "POST"])
 @login_required
 @requer_licenca_ativa
@@ -471,6 +558,17 @@ def fitcell_nova_peca():
 
     if form.validate_on_submit():
 
+        # imagem primeiro: arquivo inválido volta para o formulário
+        try:
+            imagem = salvar_imagem(form.imagem.data, subpasta="pecas")
+        except ImagemInvalida as e:
+            flash(str(e), "danger")
+            return render_template(
+                "fitcell/peca_form.html",
+                form=form,
+                titulo="Nova Peça"
+            )
+
         peca = Peca(
             empresa_id=current_user.empresa_id,
             nome=form.nome.data,
@@ -481,18 +579,10 @@ def fitcell_nova_peca():
             codigo_interno=form.codigo_interno.data,
             marca_peca=form.marca_peca.data,
             observacoes=form.observacoes.data,
+            imagem=imagem,
             ativo=True
         )
 
-        # Salvar imagem se houver
-        if form.imagem.data:
-            caminho_relativo = salvar_upload(
-                form.imagem.data,
-                subpasta="pecas"
-            )
-            peca.imagem = caminho_relativo
-
-
         db.session.add(peca)
         db.session.commit()
 
@@ -536,6 +626,17 @@ def fitcell_editar_peca(id):
     # --------------------------------------------------
     if form.validate_on_submit():
 
+        # imagem primeiro: arquivo inválido volta para o formulário sem alterar nada
+        try:
+            imagem = salvar_imagem(form.imagem.data, subpasta="pecas")
+        except ImagemInvalida as e:
+            flash(str(e), "danger")
+            return render_template(
+                "fitcell/peca_form.html",
+                form=form,
+                peca=peca
+            )
+
         # 🔹 dados básicos
         peca.nome = form.nome.data
         peca.tipo_peca_id = form.tipo_peca_id.data
@@ -576,13 +677,14 @@ def fitcell_editar_peca(id):
                     )
                 )
 
-        # Salvar imagem se houver
-        if form.imagem.data:
-            caminho_relativo = salvar_upload(
-                form.imagem.data,
-                subpasta="pecas"
-            )
-            peca.imagem = caminho_relativo
+        # 🔹 índice de compatibilidade em memória (vale após o commit)
+        if selecionados != set(existentes):
+            invalidar_compatibilidade(current_user.empresa_id)
+
+        if imagem:
+            # a anterior perde uma referência (mesma foto de novo: +1 -1)
+            liberar_upload(peca.imagem)
+            peca.imagem = imagem
 
         db.session.commit()
 
@@ -708,7 +810,6 @@ from datetime import datetime
 @requer_permissao("estoque", "ver")
 def fitcell_listar_compras_estoque():
 
-    page = request.args.get("page", 1, type=int)
     per_page = 15
 
     fornecedor_id = request.args.get("fornecedor_id")
@@ -738,10 +839,14 @@ def fitcell_listar_compras_estoque():
     if dt_fim:
         query = query.filter(CompraEstoque.criado_em <= dt_fim)
 
-    compras = (
-        query
-        .order_by(CompraEstoque.criado_em.desc())
-        .paginate(page=page, per_page=per_page, error_out=False)
+    depois, antes = args_cursor()
+    compras = paginar_por_cursor(
+        query,
+        CompraEstoque.criado_em,
+        CompraEstoque.id,
+        por_pagina=per_page,
+        depois=depois,
+        antes=antes
     )
 
     fornecedores = (
@@ -803,6 +908,7 @@ def fitcell_estornar_compra_estoque(compra_id):
     compra = (
         CompraEstoque.query_empresa()
         .filter_by(id=compra_id)
+        .with_for_update()   # evita estorno duplo simultâneo
         .first_or_404()
     )
 
@@ -824,53 +930,41 @@ def fitcell_estornar_compra_estoque(compra_id):
         return redirect(url_for("routes.fitcell_listar_compras_estoque"))
 
     # =========================
-    # 🔴 VALIDAÇÃO CRÍTICA
+    # 🔴 VALIDAÇÃO CRÍTICA (com lock no estoque)
     # =========================
-    for mov in movimentacoes:
+    estoque_service = EstoqueService(compra.empresa_id)
+    saldos = estoque_service.travar(mov.peca_id for mov in movimentacoes)
 
-        estoque = (
-            EstoquePeca.query_empresa()
-            .filter_by(peca_id=mov.peca_id)
-            .first()
-        )
+    a_estornar = {}
+    for mov in movimentacoes:
+        a_estornar[mov.peca_id] = a_estornar.get(mov.peca_id, 0) + mov.quantidade
 
-        qtd_estoque = estoque.quantidade if estoque else 0
+    for mov in movimentacoes:
 
-        if qtd_estoque < mov.quantidade:
+        if saldos.get(mov.peca_id, 0) < a_estornar[mov.peca_id]:
             flash(
                 f"Não é possível estornar a compra. "
                 f"A peça ID {mov.peca_id} - {mov.peca.nome} já possui vendas associadas.",
                 "danger"
             )
+            db.session.rollback()
             return redirect(url_for("routes.fitcell_listar_compras_estoque"))
 
     # =========================
     # ✅ ESTORNO SEGURO
     # =========================
-    for mov in movimentacoes:
-
-        db.session.add(
-            EstoqueMovimentacao(
-                empresa_id=compra.empresa_id,
-                peca_id=mov.peca_id,
-                fornecedor_id=mov.fornecedor_id,
-                compra_id=compra.id,
-                tipo="estorno",
-                quantidade=-mov.quantidade,
-                movimentacao_origem_id=mov.id,
-                observacao=f"Estorno da compra #{compra.id}",
-                criado_em=utc_now()
-            )
-        )
-
-        estoque = (
-            EstoquePeca.query_empresa()
-            .filter_by(peca_id=mov.peca_id)
-            .first()
+    estoque_service.aplicar(
+        MovimentoEstoque(
+            peca_id=mov.peca_id,
+            tipo="estorno",
+            quantidade=-mov.quantidade,
+            fornecedor_id=mov.fornecedor_id,
+            compra_id=compra.id,
+            movimentacao_origem_id=mov.id,
+            observacao=f"Estorno da compra #{compra.id}"
         )
-
-        if estoque:
-            estoque.quantidade -= mov.quantidade
+        for mov in movimentacoes
+    )
 
     compra.status = "ESTORNADA"
     compra.estornada_em = utc_now()
@@ -887,10 +981,10 @@ def fitcell_estornar_compra_estoque(compra_id):
 @requer_permissao("estoque", "ver")
 def fitcell_listar_movimentacoes_estoque():
 
-    page = request.args.get("page", 1, type=int)
     per_page = 20
     busca = request.args.get("busca", "").strip()
     tipo = request.args.get("tipo")
+    data_ref = request.args.get("data_ref")
 
     query = (
         EstoqueMovimentacao.query_empresa()
@@ -901,6 +995,13 @@ def fitcell_listar_movimentacoes_estoque():
     if tipo:
         query = query.filter(EstoqueMovimentacao.tipo == tipo)
 
+    # =========================
+    # POSIÇÃO EM UMA DATA (movimentações até o fim do dia)
+    # =========================
+    if data_ref:
+        _, dt_ref = periodo_datetime(None, data_ref)
+        query = query.filter(EstoqueMovimentacao.criado_em <= dt_ref)
+
     if busca:
         b = f"%{busca}%"
         query = query.filter(
@@ -911,18 +1012,74 @@ def fitcell_listar_movimentacoes_estoque():
             )
         )
 
-    pagination = (
-        query
-        .order_by(EstoqueMovimentacao.criado_em.desc())
-        .paginate(page=page, per_page=per_page, error_out=False)
-    )
+    depois, antes = args_cursor()
+    pagination = paginar_por_cursor(
+        query,
+        EstoqueMovimentacao.criado_em,
+        EstoqueMovimentacao.id,
+        por_pagina=per_page,
+        depois=depois,
+        antes=antes,
+        com_total=True
+    )
+
+    # saldo de cada peça da página na data (snapshot + movimentações do intervalo)
+    saldos = {}
+    if data_ref:
+        saldos = saldo_em(
+            current_user.empresa_id,
+            datetime.strptime(data_ref, "%Y-%m-%d").date(),
+            {m.peca_id for m in pagination.items}
+        )
 
     return render_template(
         "fitcell/estoque_movimentacoes_listar.html",
         movimentacoes=pagination.items,
         pagination=pagination,
         busca=busca,
-        tipo=tipo
+        tipo=tipo,
+        data_ref=data_ref,
+        saldos=saldos
+    )
+
+
+@bp.route("/fitcell/estoque/inventario")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("estoque", "ver")
+def fitcell_inventario_estoque():
+    """
+    Inventário na data: saldo de todas as peças ao fim do dia informado.
+    """
+
+    data_ref = request.args.get("data") or date.today().strftime("%Y-%m-%d")
+    data = datetime.strptime(data_ref, "%Y-%m-%d").date()
+
+    saldos = saldo_em(current_user.empresa_id, data)
+
+    pecas = (
+        Peca.query_empresa()
+        .filter(Peca.id.in_(list(saldos)))
+        .order_by(Peca.codigo_interno, Peca.nome)
+        .all()
+        if saldos else []
+    )
+
+    linhas = [
+        {
+            "peca": p,
+            "quantidade": saldos[p.id],
+            "valor": saldos[p.id] * (p.preco_venda or 0)
+        }
+        for p in pecas
+    ]
+
+    return render_template(
+        "fitcell/estoque_inventario.html",
+        linhas=linhas,
+        data_ref=data_ref,
+        total_quantidade=sum(l["quantidade"] for l in linhas),
+        total_valor=sum(l["valor"] for l in linhas)
     )
 
 
@@ -973,6 +1130,8 @@ def fitcell_nova_compra_estoque():
         db.session.add(compra)
         db.session.flush()
 
+        movimentos = []
+
         for peca_id, qtd, custo in zip(pecas_ids, quantidades, custos):
 
             peca_id = int(peca_id)
@@ -991,34 +1150,19 @@ def fitcell_nova_compra_estoque():
                 )
             )
 
-            db.session.add(
-                EstoqueMovimentacao(
-                    empresa_id=current_user.empresa_id,
+            movimentos.append(
+                MovimentoEstoque(
                     peca_id=peca_id,
-                    fornecedor_id=compra.fornecedor_id,
-                    compra_id=compra.id,   # 👈 ESSENCIAL
                     tipo="entrada",
                     quantidade=quantidade,
-                    observacao=f"Compra #{compra.id}",
-                    criado_em=utc_now()
+                    fornecedor_id=compra.fornecedor_id,
+                    compra_id=compra.id,   # 👈 ESSENCIAL
+                    observacao=f"Compra #{compra.id}"
                 )
             )
 
-            estoque = (
-                EstoquePeca.query_empresa()
-                .filter_by(peca_id=peca_id)
-                .first()
-            )
-
-            if not estoque:
-                estoque = EstoquePeca(
-                    empresa_id=current_user.empresa_id,
-                    peca_id=peca_id,
-                    quantidade=0
-                )
-                db.session.add(estoque)
-
-            estoque.quantidade += quantidade
+        # ENTRADA NO ESTOQUE (lote único, com lock)
+        EstoqueService(current_user.empresa_id).aplicar(movimentos)
 
         db.session.commit()
 
@@ -1035,7 +1179,6 @@ def fitcell_nova_compra_estoque():
 
 from datetime import datetime
 from flask import request, make_response, render_template
-from weasyprint import HTML
 from sqlalchemy import func
 
 @bp.route("/fitcell/relatorios/compras-estoque/pdf")
@@ -1048,6 +1191,17 @@ def fitcell_relatorio_compras_estoque_pdf():
     data_fim = request.args.get("data_fim")
     fornecedor_id = request.args.get("fornecedor_id")
 
+    return obter_pdf(
+        "compras_estoque",
+        {"data_ini": data_ini, "data_fim": data_fim, "fornecedor_id": fornecedor_id},
+        versao_dados_empresa(current_user.empresa_id),
+        lambda: _html_relatorio_compras_estoque(data_ini, data_fim, fornecedor_id),
+        "compras_estoque.pdf"
+    )
+
+
+def _html_relatorio_compras_estoque(data_ini, data_fim, fornecedor_id):
+
     query = (
         db.session.query(
             CompraEstoque.id,
@@ -1100,7 +1254,7 @@ def fitcell_relatorio_compras_estoque_pdf():
         if c.status == "ESTORNADA"
     )
 
-    html = render_template(
+    return render_template(
         "fitcell/relatorios/compras_estoque_pdf.html",
         compras=compras,
         total_ativo=total_ativo,
@@ -1109,19 +1263,6 @@ def fitcell_relatorio_compras_estoque_pdf():
         data_fim=data_fim
     )
 
-    pdf = HTML(
-        string=html,
-        base_url=request.url_root
-    ).write_pdf()
-
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        "inline; filename=compras_estoque.pdf"
-    )
-
-    return response
-
 ### VENDA PEÇA MANUAL ####
 
 from datetime import datetime
@@ -1133,23 +1274,15 @@ from sqlalchemy import func
 @requer_permissao("venda", "ver")
 def fitcell_listar_vendas_pecas():
 
-    page = request.args.get("page", 1, type=int)
     busca = request.args.get("busca", "")
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
     query = (
-        db.session.query(
-            VendaPeca,
-            func.coalesce(func.sum(VendaPecaItem.quantidade), 0).label("qtd_itens")
-        )
-        .outerjoin(VendaPecaItem, VendaPecaItem.venda_id == VendaPeca.id)
+        db.session.query(VendaPeca, qtd_itens_venda())
         .filter(VendaPeca.empresa_id == current_user.empresa_id,
                 VendaPeca.status != "ORCAMENTO"   # 👈 ESSENCIAL
                 )
-        
-        .group_by(VendaPeca.id)
-        .order_by(VendaPeca.criado_em.desc())
     )
 
 
@@ -1174,7 +1307,15 @@ def fitcell_listar_vendas_pecas():
     if dt_fim:
         query = query.filter(VendaPeca.criado_em <= dt_fim)
 
-    pagination = query.paginate(page=page, per_page=20)
+    depois, antes = args_cursor()
+    pagination = paginar_por_cursor(
+        query,
+        VendaPeca.criado_em,
+        VendaPeca.id,
+        depois=depois,
+        antes=antes,
+        com_total=True
+    )
 
     return render_template(
         "fitcell/vendas_peca_listar.html",
@@ -1214,6 +1355,13 @@ def fitcell_receber_via_pix():
         flash("Adicione pelo menos uma peça.", "danger")
         return redirect(request.referrer)
 
+    # sem gateway configurado a venda nem é criada (config em cache)
+    try:
+        carregar_config(current_user.empresa_id)
+    except PagamentoConfigNotFound:
+        flash("Empresa sem configuração ativa do Mercado Pago.", "danger")
+        return redirect(request.referrer)
+
     # ========= CRIA VENDA (SEM BAIXAR ESTOQUE) =========
     venda = VendaPeca(
         empresa_id=current_user.empresa_id,
@@ -1256,68 +1404,153 @@ def fitcell_receber_via_pix():
     total_venda -= Decimal(venda.desconto or 0)
     venda.valor_total = total_venda
 
-    # ========= MERCADO PAGO =========
-    mp = MercadoPagoClient(current_user.empresa_id)
+    # ========= MERCADO PAGO (EM SEGUNDO PLANO) =========
+    # a venda é gravada primeiro; a cobrança sai no pool de tarefas
+    agendar_cobranca_pix(venda)
+    db.session.commit()
 
-    telefone = venda.cliente_telefone or venda.id
-    telefone = ''.join(filter(str.isdigit, str(telefone)))
+    enviar_cobranca_pix(venda.id)
 
-    email_cliente = f"cliente{telefone}@fitcell.com.br"
+    return redirect(
+        url_for("routes.fitcell_ver_venda_peca", id=venda.id)
+    )
 
 
+@bp.route("/fitcell/vendas/pecas/<int:id>/status")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("venda", "ver")
+def fitcell_status_venda_peca(id):
 
-    pagamento = mp.criar_pagamento(
-        valor=venda.valor_total,
-        descricao=f"Venda FITCELL #{venda.id}",
-        email=email_cliente
+    venda = (
+        VendaPeca.query_empresa()
+        .filter_by(id=id)
+        .first_or_404()
     )
 
-    venda.pagamento_id = str(pagamento["id"])
-    venda.pagamento_status = pagamento["status"]
+    return {
+        "status": venda.status,
+        "pagamento_status": venda.pagamento_status,
+        "tipo_pagamento": venda.tipo_pagamento,
+        "pix_qr_code_base64": venda.pix_qr_code_base64,
+        "pix_qr_code": venda.pix_qr_code,
+        "pix_gerando": venda.pagamento_status == PIX_GERANDO,
+        "pix_falhou": venda.pagamento_status == PIX_FALHOU,
+        "pix_travado": pix_travado(venda.pagamento_status, venda.atualizado_em)
+    }
 
-    poi = pagamento.get("point_of_interaction", {})
-    tx = poi.get("transaction_data")
 
-    if not tx:
-        current_app.logger.error(f"PIX não gerado: {pagamento}")
+def _estado_venda(venda_id, empresa_id):
+    """
+    (status, pagamento_status, tem_qr, atualizado_em) sem carregar o QR Code.
+    Fecha a sessão: a conexão volta ao pool enquanto o long-poll espera.
+    """
 
-        flash(
-            "Não foi possível gerar o QR Code Pix. Verifique os dados e tente novamente.",
-            "danger"
+    linha = (
+        db.session.query(
+            VendaPeca.status,
+            VendaPeca.pagamento_status,
+            VendaPeca.pix_qr_code.isnot(None),
+            VendaPeca.atualizado_em
         )
-        db.session.rollback()
-        return redirect(request.referrer)
+        .filter(VendaPeca.id == venda_id, VendaPeca.empresa_id == empresa_id)
+        .first()
+    )
+    db.session.close()
 
-    venda.pix_qr_code = tx.get("qr_code")
-    venda.pix_qr_code_base64 = tx.get("qr_code_base64")
+    return tuple(linha) if linha else None
 
 
-    db.session.commit()
+@bp.route("/fitcell/vendas/pecas/<int:id>/status/aguardar")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("venda", "ver")
+def fitcell_aguardar_status_venda_peca(id):
+    """
+    Long-poll do status da venda: responde assim que status, pagamento
+    ou QR Code diferem do que o navegador informou (status,
+    pagamento_status, qr=1 se já tem o QR) ou no fim da espera.
+    O QR Code só vai na resposta enquanto o navegador ainda não o tem.
+    """
 
-    return redirect(
-        url_for("routes.fitcell_ver_venda_peca", id=venda.id)
+    empresa_id = current_user.empresa_id
+    visto = (
+        request.args.get("status") or None,
+        request.args.get("pagamento_status") or None,
+        request.args.get("qr") == "1"
     )
 
+    atual = [None]
 
-@bp.route("/fitcell/vendas/pecas/<int:id>/status")
+    def mudou():
+        atual[0] = _estado_venda(id, empresa_id)
+        return atual[0] is None or atual[0][:3] != visto
+
+    ocupado = not reservar_espera(current_app.config.get("PAGAMENTO_STATUS_ESPERAS_MAX", 2))
+
+    if ocupado:
+        # todas as vagas de espera em uso: responde na hora
+        mudou()
+    else:
+        try:
+            aguardar_venda(id, current_app.config.get("PAGAMENTO_STATUS_ESPERA_SEGUNDOS", 25), mudou)
+        finally:
+            liberar_espera()
+
+    if atual[0] is None:
+        abort(404)
+
+    status, pagamento_status, tem_qr, atualizado_em = atual[0]
+
+    resposta = {
+        "status": status,
+        "pagamento_status": pagamento_status,
+        "pix_gerando": pagamento_status == PIX_GERANDO,
+        "pix_falhou": pagamento_status == PIX_FALHOU,
+        "pix_travado": pix_travado(pagamento_status, atualizado_em),
+        "qr": tem_qr
+    }
+
+    if tem_qr and not visto[2]:
+        resposta["pix_qr_code"], resposta["pix_qr_code_base64"] = (
+            db.session.query(VendaPeca.pix_qr_code, VendaPeca.pix_qr_code_base64)
+            .filter(VendaPeca.id == id, VendaPeca.empresa_id == empresa_id)
+            .one()
+        )
+
+    if ocupado:
+        resposta["tentar_em"] = 5
+
+    return jsonify(resposta)
+
+
+@bp.route("/fitcell/vendas/pecas/<int:id>/pix/gerar", methods=["POST"])
 @login_required
 @requer_licenca_ativa
-@requer_permissao("venda", "ver")
-def fitcell_status_venda_peca(id):
+@requer_permissao("venda", "criar")
+def fitcell_gerar_pix_venda_peca(id):
+    """
+    Tenta de novo a cobrança Pix de uma venda aguardando pagamento
+    (mesma chave de idempotência: não duplica a cobrança).
+    """
 
     venda = (
         VendaPeca.query_empresa()
         .filter_by(id=id)
+        .with_for_update()
         .first_or_404()
     )
 
-    return {
-        "status": venda.status,
-        "pagamento_status": venda.pagamento_status,
-        "tipo_pagamento": venda.tipo_pagamento,
-        "pix_qr_code_base64": venda.pix_qr_code_base64,
-        "pix_qr_code": venda.pix_qr_code
-    }
+    if venda.status != "AGUARDANDO_PAGAMENTO" or venda.pix_qr_code:
+        db.session.rollback()
+        flash("Essa venda não está aguardando um QR Code Pix.", "warning")
+    else:
+        agendar_cobranca_pix(venda)
+        db.session.commit()
+        notificar_venda(venda.id)
+        enviar_cobranca_pix(venda.id)
+
+    return redirect(request.referrer or url_for("routes.fitcell_ver_venda_peca", id=id))
 
 
 @bp.route("/fitcell/vendas/pecas/<int:id>")
@@ -1334,7 +1567,8 @@ def fitcell_ver_venda_peca(id):
 
     return render_template(
         "fitcell/vendas_peca_detalhe.html",
-        venda=venda
+        venda=venda,
+        pix_travado=pix_travado(venda.pagamento_status, venda.atualizado_em)
     )
 
 
@@ -1371,16 +1605,7 @@ def fitcell_nova_venda_peca():
     if modelo_id:
         form.modelo_celular_id.data = modelo_id
 
-        pecas = (
-            Peca.query_empresa()
-            .join(CompatibilidadePeca)
-            .filter(
-                CompatibilidadePeca.modelo_celular_id == modelo_id,
-                Peca.ativo == True
-            )
-            .order_by(Peca.id.desc())
-            .all()
-        )
+        pecas = pecas_compativeis(current_user.empresa_id, modelo_id)
 
     # ==========================
     # SUBMIT DA VENDA
@@ -1412,6 +1637,7 @@ def fitcell_nova_venda_peca():
         db.session.flush()  # gera venda.id
 
         total_venda = 0
+        movimentos = []
 
         for peca_id, qtd, valor in zip(pecas_ids, quantidades, valores):
 
@@ -1437,38 +1663,25 @@ def fitcell_nova_venda_peca():
             )
 
             # MOVIMENTAÇÃO DE ESTOQUE (SAÍDA)
-            db.session.add(
-                EstoqueMovimentacao(
-                    empresa_id=current_user.empresa_id,
+            movimentos.append(
+                MovimentoEstoque(
                     peca_id=peca_id,
                     tipo="saida",
                     quantidade=quantidade,
-                    observacao=f"Venda #{venda.id}",
-                    criado_em=utc_now()
+                    observacao=f"Venda #{venda.id}"
                 )
             )
 
-            # ATUALIZA ESTOQUE
-            estoque = (
-                EstoquePeca.query_empresa()
-                .filter_by(peca_id=peca_id)
-                .first()
-            )
-
-            if not estoque:
-                estoque = EstoquePeca(
-                    empresa_id=current_user.empresa_id,
-                    peca_id=peca_id,
-                    quantidade=0
-                )
-                db.session.add(estoque)
-
-            estoque.quantidade -= quantidade
+        # ATUALIZA ESTOQUE (lote único, com lock)
+        EstoqueService(current_user.empresa_id).aplicar(movimentos)
 
         # DESCONTO GERAL
         total_venda -= float(venda.desconto or 0)
         venda.valor_total = total_venda
 
+        # RESUMO DO BI (mesma transação)
+        registrar_venda(venda)
+
         db.session.commit()
 
         flash("Venda registrada com sucesso!", "success")
@@ -1495,6 +1708,7 @@ def fitcell_cancelar_venda_peca(id):
     venda = (
         VendaPeca.query_empresa()
         .filter_by(id=id)
+        .with_for_update()   # evita cancelamento duplo simultâneo
         .first_or_404()
     )
 
@@ -1507,43 +1721,29 @@ def fitcell_cancelar_venda_peca(id):
     # ==========================
     # ESTORNO DE ESTOQUE
     # ==========================
-    for item in venda.itens:
-
-        # movimentação de devolução
-        db.session.add(
-            EstoqueMovimentacao(
-                empresa_id=current_user.empresa_id,
-                peca_id=item.peca_id,
-                tipo="devolucao",
-                quantidade=item.quantidade,
-                observacao=f"Estorno venda #{venda.id}",
-                criado_em=utc_now()
-            )
-        )
-
-        # atualiza estoque
-        estoque = (
-            EstoquePeca.query_empresa()
-            .filter_by(peca_id=item.peca_id)
-            .first()
+    EstoqueService(current_user.empresa_id).aplicar(
+        MovimentoEstoque(
+            peca_id=item.peca_id,
+            tipo="devolucao",
+            quantidade=item.quantidade,
+            observacao=f"Estorno venda #{venda.id}"
         )
-
-        if not estoque:
-            estoque = EstoquePeca(
-                empresa_id=current_user.empresa_id,
-                peca_id=item.peca_id,
-                quantidade=0
-            )
-            db.session.add(estoque)
-
-        estoque.quantidade += item.quantidade
+        for item in venda.itens
+    )
 
     # ==========================
     # STATUS DA VENDA
     # ==========================
+    if status_conta_no_bi(venda.status):
+        registrar_venda(venda, -1)
+
     venda.status = "CANCELADA"
 
+    # recibos gerados antes do cancelamento não valem mais
+    descartar_recibos(venda)
+
     db.session.commit()
+    notificar_venda(venda.id)
 
     flash("Venda cancelada e estoque estornado com sucesso.", "success")
     return redirect(
@@ -1552,7 +1752,6 @@ def fitcell_cancelar_venda_peca(id):
 
 
 from flask import make_response, render_template, request
-from weasyprint import HTML
 
 @bp.route("/fitcell/vendas/pecas/<int:venda_id>/pdf")
 @login_required
@@ -1566,28 +1765,16 @@ def fitcell_venda_peca_pdf(venda_id):
         .first_or_404()
     )
 
-    html = render_template(
+    return responder_recibo(
+        "recibo_venda",
+        venda,
         "fitcell/relatorios/venda_peca_recibo_pdf.html",
-        venda=venda
-    )
-
-    pdf = HTML(
-        string=html,
-        base_url=request.url_root
-    ).write_pdf()
-
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        f"inline; filename=recibo_venda_{venda.id}.pdf"
+        f"recibo_venda_{venda.id}.pdf"
     )
 
-    return response
-
 
 from datetime import datetime, date, timedelta
 from flask import request, make_response, render_template
-from weasyprint import HTML
 
 @bp.route("/fitcell/relatorios/vendas-pecas/pdf")
 @login_required
@@ -1598,8 +1785,41 @@ def fitcell_relatorio_vendas_pecas_pdf():
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
+    return obter_pdf(
+        "vendas_pecas",
+        {"data_ini": data_ini, "data_fim": data_fim},
+        versao_dados_empresa(current_user.empresa_id),
+        lambda: _html_relatorio_vendas_pecas(data_ini, data_fim),
+        "vendas_pecas.pdf"
+    )
+
+
+def _html_relatorio_vendas_pecas(data_ini, data_fim):
+
+    # =========================================
+    # SUBTOTAL POR VENDA EM SQL (sem carregar itens venda a venda)
+    # =========================================
+    subtotal = func.coalesce(
+        func.sum(VendaPecaItem.valor_unitario * VendaPecaItem.quantidade),
+        0
+    )
+    desconto = func.coalesce(VendaPeca.desconto, 0)
+
     query = (
-        VendaPeca.query_empresa()
+        db.session.query(
+            VendaPeca.id,
+            VendaPeca.criado_em,
+            VendaPeca.cliente_nome,
+            VendaPeca.tipo_pagamento,
+            VendaPeca.status,
+            VendaPeca.valor_total,
+            subtotal.label("subtotal"),
+            desconto.label("valor_desconto"),
+            (subtotal - desconto).label("total_com_desconto")
+        )
+        .outerjoin(VendaPecaItem, VendaPecaItem.venda_id == VendaPeca.id)
+        .filter(VendaPeca.empresa_id == current_user.empresa_id)
+        .group_by(VendaPeca.id)
         .order_by(VendaPeca.criado_em.desc())
     )
 
@@ -1618,11 +1838,11 @@ def fitcell_relatorio_vendas_pecas_pdf():
     # ===============================
     # TOTAIS
     # ===============================
-    total_bruto = sum(v.valor_total + v.desconto for v in vendas)
-    total_descontos = sum(v.desconto for v in vendas)
+    total_bruto = sum(v.valor_total + v.valor_desconto for v in vendas)
+    total_descontos = sum(v.valor_desconto for v in vendas)
     total_liquido = sum(v.valor_total for v in vendas)
 
-    html = render_template(
+    return render_template(
         "fitcell/relatorios/vendas_pecas_pdf.html",
         vendas=vendas,
         total_bruto=total_bruto,
@@ -1632,23 +1852,9 @@ def fitcell_relatorio_vendas_pecas_pdf():
         data_fim=data_fim
     )
 
-    pdf = HTML(
-        string=html,
-        base_url=request.url_root
-    ).write_pdf()
-
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        "inline; filename=vendas_pecas.pdf"
-    )
-
-    return response
-
 
 from datetime import datetime
 from flask import request, make_response, render_template
-from weasyprint import HTML
 from sqlalchemy import func
 
 @bp.route("/fitcell/relatorios/compra-venda/pdf")
@@ -1660,6 +1866,17 @@ def fitcell_relatorio_compra_venda_pdf():
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
+    return obter_pdf(
+        "compra_venda",
+        {"data_ini": data_ini, "data_fim": data_fim},
+        versao_dados_empresa(current_user.empresa_id),
+        lambda: _html_relatorio_compra_venda(data_ini, data_fim),
+        "lucro_bruto_compra_venda.pdf"
+    )
+
+
+def _html_relatorio_compra_venda(data_ini, data_fim):
+
     dt_ini, dt_fim = periodo_datetime(data_ini, data_fim)
 
     # =========================
@@ -1718,10 +1935,7 @@ def fitcell_relatorio_compra_venda_pdf():
     if total_vendas > 0:
         margem = (lucro_bruto / total_vendas) * 100
 
-    # =========================
-    # RENDER PDF
-    # =========================
-    html = render_template(
+    return render_template(
         "fitcell/relatorios/compra_venda_pdf.html",
         total_vendas=total_vendas,
         total_compras=total_compras,
@@ -1731,18 +1945,112 @@ def fitcell_relatorio_compra_venda_pdf():
         data_fim=data_fim
     )
 
-    pdf = HTML(
-        string=html,
-        base_url=request.url_root
-    ).write_pdf()
 
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        "inline; filename=lucro_bruto_compra_venda.pdf"
+# ==========================
+# 📤 EXPORTAÇÃO CSV / XLSX (STREAMING)
+# ==========================
+def _formato_exportacao():
+    formato = request.args.get("formato", "csv")
+    return formato if formato in FORMATOS_EXPORTACAO else "csv"
+
+
+@bp.route("/fitcell/relatorios/vendas-pecas/exportar")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("venda", "ver")
+def fitcell_exportar_vendas_pecas():
+
+    dt_ini, dt_fim = periodo_datetime(request.args.get("data_ini"), request.args.get("data_fim"))
+
+    return resposta_exportacao(
+        _formato_exportacao(),
+        "vendas_pecas",
+        linhas_vendas(current_user.empresa_id, dt_ini, dt_fim)
     )
 
-    return response
+
+@bp.route("/fitcell/relatorios/compras-estoque/exportar")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("estoque", "ver")
+def fitcell_exportar_compras_estoque():
+
+    dt_ini, dt_fim = periodo_datetime(request.args.get("data_ini"), request.args.get("data_fim"))
+
+    return resposta_exportacao(
+        _formato_exportacao(),
+        "compras_estoque",
+        linhas_compras(
+            current_user.empresa_id,
+            dt_ini,
+            dt_fim,
+            request.args.get("fornecedor_id", type=int)
+        )
+    )
+
+
+@bp.route("/fitcell/estoque/movimentacoes/exportar")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("estoque", "ver")
+def fitcell_exportar_movimentacoes_estoque():
+
+    dt_ini, dt_fim = periodo_datetime(request.args.get("data_ini"), request.args.get("data_fim"))
+
+    return resposta_exportacao(
+        _formato_exportacao(),
+        "movimentacoes_estoque",
+        linhas_movimentacoes(
+            current_user.empresa_id,
+            dt_ini,
+            dt_fim,
+            request.args.get("tipo") or None,
+            request.args.get("busca", "").strip() or None
+        )
+    )
+
+
+# ==========================
+# 📄 PDF EM SEGUNDO PLANO (ESPERA / DOWNLOAD)
+# ==========================
+def _job_relatorio_ou_404(job_id):
+    job = RelatorioJob.query_empresa().filter_by(id=job_id).first_or_404()
+
+    categoria, acao = PERMISSOES_RELATORIO.get(job.relatorio, ("administrativo", "ver"))
+    if not current_user.tem_permissao(categoria, acao):
+        abort(403)
+
+    return job
+
+
+@bp.route("/fitcell/relatorios/jobs/<int:job_id>/status")
+@login_required
+@requer_licenca_ativa
+def fitcell_relatorio_job_status(job_id):
+
+    job = _job_relatorio_ou_404(job_id)
+
+    return jsonify({
+        "status": job.status,
+        "erro": job.erro if job.status == "ERRO" else None,
+        "url": (
+            url_for("routes.fitcell_relatorio_job", job_id=job.id)
+            if pdf_disponivel(job) else None
+        )
+    })
+
+
+@bp.route("/fitcell/relatorios/jobs/<int:job_id>")
+@login_required
+@requer_licenca_ativa
+def fitcell_relatorio_job(job_id):
+
+    job = _job_relatorio_ou_404(job_id)
+
+    if pdf_disponivel(job):
+        return enviar_pdf(job)
+
+    return render_template("fitcell/relatorios/aguardando.html", job=job)
 
 
 #### DASHBOARD FITCELL   ###
@@ -1779,194 +2087,215 @@ def fitcell_bi_dashboard():
 from sqlalchemy import func
 from flask import jsonify
 
+import hashlib
 from sqlalchemy import func
 from app.constants import STATUS_FINANCEIRO_VALIDO
+from app.models import VendaResumoDiario
 
-@bp.route("/fitcell/bi/kpis")
-@login_required
-@requer_licenca_ativa
-@requer_permissao("administrativo", "ver")
-def fitcell_bi_kpis():
 
-    data_ini = request.args.get("data_ini")
-    data_fim = request.args.get("data_fim")
+def resumo_vendas_periodo(data_ini, data_fim):
+    """
+    Linhas do resumo diário de vendas da empresa no período (datas BR, "YYYY-MM-DD").
+    """
 
-    dt_ini, dt_fim = periodo_datetime(data_ini, data_fim)
+    q = VendaResumoDiario.query_empresa()
 
-    # ==========================
-    # 🔹 QUANTIDADE VENDIDA (ITENS)
-    # ==========================
-    q_qtd = (
-        db.session.query(
-            func.coalesce(func.sum(VendaPecaItem.quantidade), 0)
-        )
-        .join(VendaPeca, VendaPeca.id == VendaPecaItem.venda_id)
-        .filter(
-            VendaPeca.empresa_id == current_user.empresa_id,
-            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO)
-        )
-    )
-
-    if dt_ini:
-        q_qtd = q_qtd.filter(VendaPeca.criado_em >= dt_ini)
-    if dt_fim:
-        q_qtd = q_qtd.filter(VendaPeca.criado_em <= dt_fim)
+    if data_ini:
+        q = q.filter(VendaResumoDiario.data >= datetime.strptime(data_ini, "%Y-%m-%d").date())
+    if data_fim:
+        q = q.filter(VendaResumoDiario.data <= datetime.strptime(data_fim, "%Y-%m-%d").date())
 
-    qtd_vendida = q_qtd.scalar() or 0
+    return q
 
-    # ==========================
-    # 🔹 VALOR VENDIDO (JÁ COM DESCONTO)
-    # ==========================
-    q_valor = (
-        VendaPeca.query_empresa()
-        .filter(VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO))
-    )
 
-    if dt_ini:
-        q_valor = q_valor.filter(VendaPeca.criado_em >= dt_ini)
-    if dt_fim:
-        q_valor = q_valor.filter(VendaPeca.criado_em <= dt_fim)
+# ==========================
+# 🔹 CONSULTAS DO BI (compartilhadas pelos endpoints e pelo /summary)
+# ==========================
+def _bi_vendas_por_dia(data_ini, data_fim):
+    """
+    [(dia, quantidade, valor_liquido)] do período, uma linha por dia com venda.
+    """
 
-    valor_vendido = (
-        q_valor.with_entities(
-            func.coalesce(func.sum(VendaPeca.valor_total), 0)
+    return (
+        resumo_vendas_periodo(data_ini, data_fim)
+        .with_entities(
+            VendaResumoDiario.data,
+            func.sum(VendaResumoDiario.quantidade),
+            func.sum(VendaResumoDiario.valor_liquido)
         )
-        .scalar()
+        .group_by(VendaResumoDiario.data)
+        .having(func.sum(VendaResumoDiario.quantidade) > 0)
+        .order_by(VendaResumoDiario.data)
+        .all()
     )
 
-    # ==========================
-    # 🔹 ESTOQUE ATUAL
-    # ==========================
-    qtd_estoque = (
-        EstoquePeca.query_empresa()
-        .with_entities(func.coalesce(func.sum(EstoquePeca.quantidade), 0))
-        .scalar()
-    )
 
-    valor_estoque = (
+def _bi_estoque():
+    """
+    (quantidade, valor a preço de venda) do estoque atual, em uma consulta.
+    """
+
+    return (
         db.session.query(
-            func.coalesce(
-                func.sum(EstoquePeca.quantidade * Peca.preco_venda),
-                0
-            )
+            func.coalesce(func.sum(EstoquePeca.quantidade), 0),
+            func.coalesce(func.sum(EstoquePeca.quantidade * Peca.preco_venda), 0)
         )
-        .join(Peca, Peca.id == EstoquePeca.peca_id)
+        .outerjoin(Peca, Peca.id == EstoquePeca.peca_id)
         .filter(EstoquePeca.empresa_id == current_user.empresa_id)
-        .scalar()
+        .one()
     )
 
-    return jsonify({
-        "qtd_vendida": int(qtd_vendida),
-        "valor_vendido": formatar_moeda(valor_vendido),
+
+def _bi_kpis(dias, estoque):
+    qtd_estoque, valor_estoque = estoque
+
+    return {
+        "qtd_vendida": int(sum(qtd or 0 for _, qtd, _ in dias)),
+        "valor_vendido": formatar_moeda(sum((total or 0 for _, _, total in dias), Decimal("0"))),
         "qtd_estoque": int(qtd_estoque or 0),
         "valor_estoque": formatar_moeda(valor_estoque),
-    })
+    }
 
 
+def _bi_vendido_por_dia(dias):
+    return [
+        {
+            "dia": formatar_data(dia),
+            "total": float(total or 0)
+        }
+        for dia, _, total in dias
+    ]
 
-from sqlalchemy import func
-from flask import jsonify
-from sqlalchemy.sql import text
 
-from sqlalchemy import func, text
-from app.utils import formatar_data
+def _bi_top_pecas(data_ini, data_fim):
+    quantidade = func.sum(VendaResumoDiario.quantidade)
 
-@bp.route("/fitcell/bi/vendido-por-dia")
+    q = (
+        resumo_vendas_periodo(data_ini, data_fim)
+        .join(Peca, Peca.id == VendaResumoDiario.peca_id)
+        .filter(Peca.codigo_interno.isnot(None))
+        .with_entities(
+            Peca.codigo_interno,
+            Peca.nome,
+            Peca.imagem,
+            quantidade
+        )
+        .group_by(Peca.codigo_interno, Peca.nome, Peca.imagem)
+        .having(quantidade > 0)
+        .order_by(quantidade.desc())
+        .limit(5)
+    )
+
+    return [
+        {
+            "codigo": codigo,
+            "nome": nome,
+            "imagem": imagem_variante(imagem, "p"),
+            "quantidade": int(qtd)
+        }
+        for codigo, nome, imagem, qtd in q.all()
+    ]
+
+
+def _bi_etag(data_ini, data_fim):
+    """
+    Versão dos dados do dashboard da empresa: muda a cada venda
+    (resumo diário), movimentação de estoque ou edição de peça.
+
+    Os carimbos usados aqui são gravados com microssegundos (utc_now_exato):
+    com segundos inteiros, duas alterações no mesmo segundo davam 304 antigo.
+    """
+
+    empresa_id = current_user.empresa_id
+
+    ultima_venda, ultima_mov, ultima_peca = db.session.query(
+        db.session.query(func.max(VendaResumoDiario.atualizado_em))
+        .filter(VendaResumoDiario.empresa_id == empresa_id)
+        .scalar_subquery(),
+        db.session.query(func.max(EstoqueMovimentacao.id))
+        .filter(EstoqueMovimentacao.empresa_id == empresa_id)
+        .scalar_subquery(),
+        db.session.query(func.max(Peca.atualizado_em))
+        .filter(Peca.empresa_id == empresa_id)
+        .scalar_subquery()
+    ).one()
+
+    chave = f"{empresa_id}|{data_ini}|{data_fim}|{ultima_venda}|{ultima_mov}|{ultima_peca}"
+    return hashlib.sha1(chave.encode()).hexdigest()
+
+
+@bp.route("/fitcell/bi/summary")
 @login_required
 @requer_licenca_ativa
 @requer_permissao("administrativo", "ver")
-def fitcell_bi_vendido_por_dia():
+def fitcell_bi_summary():
+    """
+    Todos os dados do dashboard em uma resposta (kpis, vendido por dia,
+    top peças). Responde 304 se nada mudou desde o último ETag.
+    """
 
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
-    dt_ini, dt_fim = periodo_datetime(data_ini, data_fim)
+    etag = _bi_etag(data_ini, data_fim)
 
-    # convertendo UTC para America/SP
-    
-    dia_br = func.date(
-        VendaPeca.criado_em
-            .op("AT TIME ZONE")("UTC")
-            .op("AT TIME ZONE")("America/Sao_Paulo")
-    )
+    if etag in request.if_none_match:
+        resposta = make_response("", 304)
+    else:
+        dias = _bi_vendas_por_dia(data_ini, data_fim)
 
-    q = (
-        db.session.query(
-            dia_br.label("dia"),
-            func.sum(VendaPeca.valor_total).label("total")
-        )
-        .filter(
-            VendaPeca.empresa_id == current_user.empresa_id,
-            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO)
-        )
-    )
+        resposta = jsonify({
+            "kpis": _bi_kpis(dias, _bi_estoque()),
+            "vendido_por_dia": _bi_vendido_por_dia(dias),
+            "top_pecas": _bi_top_pecas(data_ini, data_fim),
+        })
 
-    if dt_ini:
-        q = q.filter(VendaPeca.criado_em >= dt_ini)
-    if dt_fim:
-        q = q.filter(VendaPeca.criado_em <= dt_fim)
+    resposta.set_etag(etag)
+    # sempre revalida (o ETag já é barato); nunca em cache compartilhado
+    resposta.headers["Cache-Control"] = "private, no-cache"
 
-    q = q.group_by(dia_br).order_by(dia_br)
+    return resposta
 
-    return jsonify([
-        {
-            "dia": formatar_data(dia),
-            "total": float(total or 0)
-        }
-        for dia, total in q.all()
-    ])
 
+@bp.route("/fitcell/bi/kpis")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("administrativo", "ver")
+def fitcell_bi_kpis():
 
-from sqlalchemy import func
-from flask import jsonify, request
+    data_ini = request.args.get("data_ini")
+    data_fim = request.args.get("data_fim")
 
-@bp.route("/fitcell/bi/top-pecas")
+    return jsonify(_bi_kpis(
+        _bi_vendas_por_dia(data_ini, data_fim),
+        _bi_estoque()
+    ))
+
+
+from app.utils import formatar_data
+
+@bp.route("/fitcell/bi/vendido-por-dia")
 @login_required
 @requer_licenca_ativa
 @requer_permissao("administrativo", "ver")
-def fitcell_bi_top_pecas():
+def fitcell_bi_vendido_por_dia():
 
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
-    dt_ini, dt_fim = periodo_datetime(data_ini, data_fim)
+    return jsonify(_bi_vendido_por_dia(_bi_vendas_por_dia(data_ini, data_fim)))
 
-    q = (
-        db.session.query(
-            Peca.codigo_interno,
-            Peca.nome,
-            Peca.imagem,
-            func.sum(VendaPecaItem.quantidade).label("quantidade")
-        )
-        .join(VendaPecaItem, VendaPecaItem.peca_id == Peca.id)
-        .join(VendaPeca, VendaPeca.id == VendaPecaItem.venda_id)
-        .filter(
-            VendaPeca.empresa_id == current_user.empresa_id,
-            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO),
-            Peca.codigo_interno.isnot(None)
-        )
-    )
 
-    if dt_ini:
-        q = q.filter(VendaPeca.criado_em >= dt_ini)
-    if dt_fim:
-        q = q.filter(VendaPeca.criado_em <= dt_fim)
+@bp.route("/fitcell/bi/top-pecas")
+@login_required
+@requer_licenca_ativa
+@requer_permissao("administrativo", "ver")
+def fitcell_bi_top_pecas():
 
-    q = (
-        q.group_by(Peca.codigo_interno, Peca.nome, Peca.imagem)
-        .order_by(func.sum(VendaPecaItem.quantidade).desc())
-        .limit(5)
-    )
+    data_ini = request.args.get("data_ini")
+    data_fim = request.args.get("data_fim")
 
-    return jsonify([
-        {
-            "codigo": codigo,
-            "nome": nome,
-            "imagem": imagem,
-            "quantidade": int(qtd)
-        }
-        for codigo, nome, imagem, qtd in q.all()
-    ])
+    return jsonify(_bi_top_pecas(data_ini, data_fim))
 
 
 from datetime import datetime, date, time
@@ -1982,46 +2311,18 @@ def fitcell_bi_home_kpis():
     if not current_user.is_admin_empresa:
         return jsonify({})
 
-    hoje = date.today()
-
-    dt_ini_br = datetime.combine(hoje, time.min)
-    dt_fim_br = datetime.combine(hoje, time.max)
-
-    dt_ini = br_to_utc(dt_ini_br)
-    dt_fim = br_to_utc(dt_fim_br)
-
+    hoje = date.today().strftime("%Y-%m-%d")
 
     # =================================================
-    # 🔹 VENDAS HOJE
+    # 🔹 VENDAS HOJE (RESUMO DIÁRIO)
     # =================================================
-
-    # Quantidade vendida (soma dos itens)
-    qtd_vendida = (
-        db.session.query(
-            func.coalesce(func.sum(VendaPecaItem.quantidade), 0)
-        )
-        .join(VendaPeca, VendaPeca.id == VendaPecaItem.venda_id)
-        .filter(
-            VendaPeca.empresa_id == current_user.empresa_id,
-            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO),
-            VendaPeca.criado_em >= dt_ini,
-            VendaPeca.criado_em <= dt_fim
-        )
-        .scalar()
-    )
-
-    # Valor vendido (já com desconto, valor_final)
-    valor_vendido = (
-        db.session.query(
-            func.coalesce(func.sum(VendaPeca.valor_total), 0)
+    qtd_vendida, valor_vendido = (
+        resumo_vendas_periodo(hoje, hoje)
+        .with_entities(
+            func.coalesce(func.sum(VendaResumoDiario.quantidade), 0),
+            func.coalesce(func.sum(VendaResumoDiario.valor_liquido), 0)
         )
-        .filter(
-            VendaPeca.empresa_id == current_user.empresa_id,
-            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO),
-            VendaPeca.criado_em >= dt_ini,
-            VendaPeca.criado_em <= dt_fim
-        )
-        .scalar()
+        .one()
     )
 
     # =================================================
@@ -2067,7 +2368,6 @@ from sqlalchemy import func
 @requer_permissao("venda", "ver")
 def fitcell_listar_orcamentos():
 
-    page = request.args.get("page", 1, type=int)
     busca = request.args.get("busca", "")
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
@@ -2076,17 +2376,11 @@ def fitcell_listar_orcamentos():
     # QUERY BASE
     # =========================
     query = (
-        db.session.query(
-            VendaPeca,
-            func.coalesce(func.sum(VendaPecaItem.quantidade), 0).label("qtd_itens")
-        )
-        .outerjoin(VendaPecaItem, VendaPecaItem.venda_id == VendaPeca.id)
+        db.session.query(VendaPeca, qtd_itens_venda())
         .filter(
             VendaPeca.empresa_id == current_user.empresa_id,
             VendaPeca.status == "ORCAMENTO"
         )
-        .group_by(VendaPeca.id)
-        .order_by(VendaPeca.criado_em.desc())
     )
 
     # =========================
@@ -2114,7 +2408,15 @@ def fitcell_listar_orcamentos():
     # =========================
     # PAGINAÇÃO
     # =========================
-    pagination = query.paginate(page=page, per_page=20)
+    depois, antes = args_cursor()
+    pagination = paginar_por_cursor(
+        query,
+        VendaPeca.criado_em,
+        VendaPeca.id,
+        depois=depois,
+        antes=antes,
+        com_total=True
+    )
 
     return render_template(
         "fitcell/orcamentos_listar.html",
@@ -2165,15 +2467,7 @@ def fitcell_novo_orcamento():
 
     if modelo_id:
         form.modelo_celular_id.data = modelo_id
-        pecas = (
-            Peca.query_empresa()
-            .join(CompatibilidadePeca)
-            .filter(
-                CompatibilidadePeca.modelo_celular_id == modelo_id,
-                Peca.ativo == True
-            )
-            .all()
-        )
+        pecas = pecas_compativeis(current_user.empresa_id, modelo_id)
 
     if request.method == "POST" and form.validate():
 
@@ -2240,7 +2534,6 @@ def fitcell_novo_orcamento():
 
 
 from flask import make_response, render_template, request
-from weasyprint import HTML
 
 @bp.route("/fitcell/orcamentos/<int:orcamento_id>/pdf")
 @login_required
@@ -2257,24 +2550,13 @@ def fitcell_orcamento_pdf(orcamento_id):
         .first_or_404()
     )
 
-    html = render_template(
+    return responder_recibo(
+        "recibo_orcamento",
+        orcamento,
         "fitcell/relatorios/orcamento_recibo_pdf.html",
-        venda=orcamento
-    )
-
-    pdf = HTML(
-        string=html,
-        base_url=request.url_root
-    ).write_pdf()
-
-    response = make_response(pdf)
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = (
-        f"inline; filename=orcamento_{orcamento.id}.pdf"
+        f"orcamento_{orcamento.id}.pdf"
     )
 
-    return response
-
 
 
 from urllib.parse import quote_plus
@@ -2318,6 +2600,7 @@ def fitcell_converter_orcamento(id):
     venda = (
         VendaPeca.query_empresa()
         .filter_by(id=id, status="ORCAMENTO")
+        .with_for_update()   # evita conversão dupla (resumo do BI somado 2x)
         .first_or_404()
     )
 
@@ -2325,6 +2608,11 @@ def fitcell_converter_orcamento(id):
     venda.pago_em = utc_now()
     venda.tipo_pagamento = "dinheiro"
 
+    registrar_venda(venda)
+
+    # o recibo do orçamento deixa de valer
+    descartar_recibos(venda)
+
     # aqui você faz a movimentação de estoque
     # exatamente como na venda manual
 
@@ -1,15 +1,21 @@
 from decimal import Decimal
 import os
-from flask import current_app, jsonify, make_response, render_template, redirect, url_for, request, flash
+from flask import jsonify, make_response, render_template, redirect, url_for, request, flash
 from flask_login import current_user, login_required
-from sqlalchemy import func, or_
+from sqlalchemy import func
 from weasyprint import HTML
 from werkzeug.utils import secure_filename  # 🔹 Para salvar o nome do arquivo corretamente
 
 from app import db
-from app.models import CompatibilidadePeca, CompraEstoque, CompraEstoqueItem, EstoqueMovimentacao, EstoquePeca, Fornecedor, MarcaCelular, ModeloCelular, Peca, TipoPeca, VendaPeca, VendaPecaItem
+from app.models import CompatibilidadePeca, CompraEstoque, CompraEstoqueItem, EstoqueMovimentacao, EstoquePeca, Fornecedor, MarcaCelular, ModeloCelular, Peca, VendaPeca, VendaPecaItem
 from app.forms import CompraEstoqueForm, FornecedorForm, MarcaCelularForm, ModeloCelularForm, PecaForm, TipoPecaForm, VendaPecaForm
-from app.services.pagamento.mercadopago_client import MercadoPagoClient
+from app.services.bi.resumo_vendas import registrar_venda
+from app.services.estoque.estoque_service import EstoqueService, MovimentoEstoque
+from app.services.pecas.compatibilidade import invalidar_compatibilidade, pecas_compativeis
+from app.services.pecas.busca import filtrar_pecas
+from app.services.pagamento.exceptions import PagamentoConfigNotFound
+from app.services.pagamento.mercadopago_client import carregar_config
+from app.services.pagamento.pix import agendar_cobranca_pix, enviar_cobranca_pix, pix_travado
 from app.utils import formatar_data, formatar_data_hora, formatar_moeda, requer_permissao
 
 from sqlalchemy.exc import IntegrityError
@@ -20,7 +26,9 @@ from app import csrf
 from app.routes import bp
 from app.utils_datetime import utc_now
 from app.utils_licenca import requer_licenca_ativa  # ← IMPORTA O MESMO BLUEPRINT DO routes.py
-from app.utils_uploads import salvar_upload
+from app.utils_paginacao import args_cursor, paginar_por_cursor
+from app.utils_imagens import ImagemInvalida
+from app.utils_uploads import liberar_upload, salvar_imagem
 
 
 ##helpers  de DATAS PARA AS ROTAS ##
@@ -49,6 +57,21 @@ def periodo_datetime(data_ini, data_fim):
     return dt_ini, dt_fim
 
 
+def qtd_itens_venda():
+    """
+    Quantidade de itens da venda (subconsulta correlacionada): a listagem
+    pagina as vendas sem agrupar a tabela inteira.
+    """
+
+    return (
+        db.select(func.coalesce(func.sum(VendaPecaItem.quantidade), 0))
+        .where(VendaPecaItem.venda_id == VendaPeca.id)
+        .correlate(VendaPeca)
+        .scalar_subquery()
+        .label("qtd_itens")
+    )
+
+
 @bp.route('/teste_fitcell_mobile')
 @login_required
 @requer_permissao("administrativo", "ver")
@@ -349,18 +372,13 @@ def fitcell_listar_pecas_mobile():
         .filter(Peca.empresa_id == current_user.empresa_id)
     )
 
-    if busca:
-        query = query.filter(
-            or_(
-                Peca.codigo_interno.ilike(f"%{busca}%"),
-                Peca.nome.ilike(f"%{busca}%"),
-                Peca.marca_peca.ilike(f"%{busca}%"),
-                Peca.qualidade.ilike(f"%{busca}%"),
-                Peca.tipo.has(TipoPeca.nome.ilike(f"%{busca}%"))
-            )
-        )
+    # busca indexada (pg_trgm), já ordenada por relevância
+    query, ordenada = filtrar_pecas(query, busca)
+
+    if not ordenada:
+        query = query.order_by(Peca.id.desc())
 
-    pecas = query.order_by(Peca.id.desc()).paginate(page=page, per_page=20)
+    pecas = query.paginate(page=page, per_page=20)
 
     return render_template(
         "fitcell/mobile/pecas_listar_mobile.html",
@@ -379,6 +397,16 @@ def fitcell_nova_peca_mobile():
 
     if form.validate_on_submit():
 
+        # imagem primeiro: arquivo inválido volta para o formulário
+        try:
+            imagem = salvar_imagem(form.imagem.data, subpasta="pecas")
+        except ImagemInvalida as e:
+            flash(str(e), "danger")
+            return render_template(
+                "fitcell/mobile/peca_form_mobile.html",
+                form=form
+            )
+
         peca = Peca(
             empresa_id=current_user.empresa_id,
             nome=form.nome.data,
@@ -389,12 +417,10 @@ def fitcell_nova_peca_mobile():
             codigo_interno=form.codigo_interno.data,
             marca_peca=form.marca_peca.data,
             observacoes=form.observacoes.data,
+            imagem=imagem,
             ativo=True
         )
 
-        if form.imagem.data:
-            peca.imagem = salvar_upload(form.imagem.data, subpasta="pecas")
-
         db.session.add(peca)
         db.session.commit()
 
@@ -432,6 +458,17 @@ def fitcell_editar_peca_mobile(id):
 
     if form.validate_on_submit():
 
+        # imagem primeiro: arquivo inválido volta para o formulário sem alterar nada
+        try:
+            imagem = salvar_imagem(form.imagem.data, subpasta="pecas")
+        except ImagemInvalida as e:
+            flash(str(e), "danger")
+            return render_template(
+                "fitcell/mobile/peca_form_mobile.html",
+                form=form,
+                peca=peca
+            )
+
         peca.nome = form.nome.data
         peca.tipo_peca_id = form.tipo_peca_id.data
         peca.qualidade = form.qualidade.data
@@ -464,8 +501,13 @@ def fitcell_editar_peca_mobile(id):
                     )
                 )
 
-        if form.imagem.data:
-            peca.imagem = salvar_upload(form.imagem.data, subpasta="pecas")
+        if selecionados != set(existentes):
+            invalidar_compatibilidade(current_user.empresa_id)
+
+        if imagem:
+            # a anterior perde uma referência (mesma foto de novo: +1 -1)
+            liberar_upload(peca.imagem)
+            peca.imagem = imagem
 
         db.session.commit()
 
@@ -497,7 +539,9 @@ def fitcell_excluir_peca_mobile(id):
         return redirect(url_for("routes.fitcell_listar_pecas_mobile"))
 
     try:
+        liberar_upload(peca.imagem)
         db.session.delete(peca)
+        invalidar_compatibilidade(current_user.empresa_id)
         db.session.commit()
         flash("Peça excluída com sucesso!", "success")
     except:
@@ -643,7 +687,6 @@ def fitcell_excluir_fornecedor_mobile(id):
 @requer_permissao("estoque", "ver")
 def fitcell_listar_compras_estoque_mobile():
 
-    page = request.args.get("page", 1, type=int)
     per_page = 15
 
     fornecedor_id = request.args.get("fornecedor_id")
@@ -669,10 +712,14 @@ def fitcell_listar_compras_estoque_mobile():
     if dt_fim:
         query = query.filter(CompraEstoque.criado_em <= dt_fim)
 
-    compras = (
-        query
-        .order_by(CompraEstoque.criado_em.desc())
-        .paginate(page=page, per_page=per_page, error_out=False)
+    depois, antes = args_cursor()
+    compras = paginar_por_cursor(
+        query,
+        CompraEstoque.criado_em,
+        CompraEstoque.id,
+        por_pagina=per_page,
+        depois=depois,
+        antes=antes
     )
 
     fornecedores = (
@@ -770,6 +817,8 @@ def fitcell_nova_compra_estoque_mobile():
         db.session.add(compra)
         db.session.flush()
 
+        movimentos = []
+
         for peca_id, qtd, custo in zip(pecas_ids, quantidades, custos):
 
             peca_id = int(peca_id)
@@ -788,30 +837,18 @@ def fitcell_nova_compra_estoque_mobile():
                 )
             )
 
-            db.session.add(
-                EstoqueMovimentacao(
-                    empresa_id=current_user.empresa_id,
+            movimentos.append(
+                MovimentoEstoque(
                     peca_id=peca_id,
-                    fornecedor_id=compra.fornecedor_id,
-                    compra_id=compra.id,
                     tipo="entrada",
                     quantidade=quantidade,
-                    observacao=f"Compra #{compra.id}",
-                    criado_em=utc_now()
+                    fornecedor_id=compra.fornecedor_id,
+                    compra_id=compra.id,
+                    observacao=f"Compra #{compra.id}"
                 )
             )
 
-            estoque = EstoquePeca.query_empresa().filter_by(peca_id=peca_id).first()
-
-            if not estoque:
-                estoque = EstoquePeca(
-                    empresa_id=current_user.empresa_id,
-                    peca_id=peca_id,
-                    quantidade=0
-                )
-                db.session.add(estoque)
-
-            estoque.quantidade += quantidade
+        EstoqueService(current_user.empresa_id).aplicar(movimentos)
 
         db.session.commit()
 
@@ -833,6 +870,7 @@ def fitcell_estornar_compra_estoque_mobile(compra_id):
     compra = (
         CompraEstoque.query_empresa()
         .filter_by(id=compra_id)
+        .with_for_update()   # evita estorno duplo simultâneo
         .first_or_404()
     )
 
@@ -853,48 +891,36 @@ def fitcell_estornar_compra_estoque_mobile(compra_id):
         flash("Nenhuma movimentação encontrada para estorno.", "danger")
         return redirect(url_for("routes.fitcell_listar_compras_estoque_mobile"))
 
-    for mov in movimentacoes:
+    estoque_service = EstoqueService(compra.empresa_id)
+    saldos = estoque_service.travar(mov.peca_id for mov in movimentacoes)
 
-        estoque = (
-            EstoquePeca.query_empresa()
-            .filter_by(peca_id=mov.peca_id)
-            .first()
-        )
+    a_estornar = {}
+    for mov in movimentacoes:
+        a_estornar[mov.peca_id] = a_estornar.get(mov.peca_id, 0) + mov.quantidade
 
-        qtd_estoque = estoque.quantidade if estoque else 0
+    for mov in movimentacoes:
 
-        if qtd_estoque < mov.quantidade:
+        if saldos.get(mov.peca_id, 0) < a_estornar[mov.peca_id]:
             flash(
                 f"Não é possível estornar. "
                 f"A peça {mov.peca.nome} já possui vendas associadas.",
                 "danger"
             )
+            db.session.rollback()
             return redirect(url_for("routes.fitcell_listar_compras_estoque_mobile"))
 
-    for mov in movimentacoes:
-
-        db.session.add(
-            EstoqueMovimentacao(
-                empresa_id=compra.empresa_id,
-                peca_id=mov.peca_id,
-                fornecedor_id=mov.fornecedor_id,
-                compra_id=compra.id,
-                tipo="estorno",
-                quantidade=-mov.quantidade,
-                movimentacao_origem_id=mov.id,
-                observacao=f"Estorno da compra #{compra.id}",
-                criado_em=utc_now()
-            )
-        )
-
-        estoque = (
-            EstoquePeca.query_empresa()
-            .filter_by(peca_id=mov.peca_id)
-            .first()
+    estoque_service.aplicar(
+        MovimentoEstoque(
+            peca_id=mov.peca_id,
+            tipo="estorno",
+            quantidade=-mov.quantidade,
+            fornecedor_id=mov.fornecedor_id,
+            compra_id=compra.id,
+            movimentacao_origem_id=mov.id,
+            observacao=f"Estorno da compra #{compra.id}"
         )
-
-        if estoque:
-            estoque.quantidade -= mov.quantidade
+        for mov in movimentacoes
+    )
 
     compra.status = "ESTORNADA"
     compra.estornada_em = utc_now()
@@ -911,7 +937,6 @@ def fitcell_estornar_compra_estoque_mobile(compra_id):
 @requer_permissao("estoque", "ver")
 def fitcell_listar_movimentacoes_estoque_mobile():
 
-    page = request.args.get("page", 1, type=int)
     per_page = 20
     busca = request.args.get("busca", "").strip()
     tipo = request.args.get("tipo")
@@ -935,10 +960,14 @@ def fitcell_listar_movimentacoes_estoque_mobile():
             )
         )
 
-    pagination = (
-        query
-        .order_by(EstoqueMovimentacao.criado_em.desc())
-        .paginate(page=page, per_page=per_page, error_out=False)
+    depois, antes = args_cursor()
+    pagination = paginar_por_cursor(
+        query,
+        EstoqueMovimentacao.criado_em,
+        EstoqueMovimentacao.id,
+        por_pagina=per_page,
+        depois=depois,
+        antes=antes
     )
 
     return render_template(
@@ -958,23 +987,15 @@ def fitcell_listar_movimentacoes_estoque_mobile():
 @requer_permissao("venda", "ver")
 def fitcell_listar_vendas_pecas_mobile():
 
-    page = request.args.get("page", 1, type=int)
     busca = request.args.get("busca", "")
     data_ini = request.args.get("data_ini")
     data_fim = request.args.get("data_fim")
 
     query = (
-        db.session.query(
-            VendaPeca,
-            func.coalesce(func.sum(VendaPecaItem.quantidade), 0).label("qtd_itens")
-        )
-        .outerjoin(VendaPecaItem, VendaPecaItem.venda_id == VendaPeca.id)
+        db.session.query(VendaPeca, qtd_itens_venda())
         .filter(VendaPeca.empresa_id == current_user.empresa_id,
                 VendaPeca.status != "ORCAMENTO"   # 👈 ESSENCIAL
                 )
-        
-        .group_by(VendaPeca.id)
-        .order_by(VendaPeca.criado_em.desc())
     )
 
 
@@ -999,7 +1020,14 @@ def fitcell_listar_vendas_pecas_mobile():
     if dt_fim:
         query = query.filter(VendaPeca.criado_em <= dt_fim)
 
-    pagination = query.paginate(page=page, per_page=20)
+    depois, antes = args_cursor()
+    pagination = paginar_por_cursor(
+        query,
+        VendaPeca.criado_em,
+        VendaPeca.id,
+        depois=depois,
+        antes=antes
+    )
 
     return render_template(
         "fitcell/mobile/vendas_peca_listar_mobile.html",
@@ -1040,6 +1068,13 @@ def fitcell_receber_via_pix_mobile():
         flash("Adicione pelo menos uma peça.", "danger")
         return redirect(request.referrer)
 
+    # sem gateway configurado a venda nem é criada (config em cache)
+    try:
+        carregar_config(current_user.empresa_id)
+    except PagamentoConfigNotFound:
+        flash("Empresa sem configuração ativa do Mercado Pago.", "danger")
+        return redirect(request.referrer)
+
     # ========= CRIA VENDA (SEM BAIXAR ESTOQUE) =========
     venda = VendaPeca(
         empresa_id=current_user.empresa_id,
@@ -1082,44 +1117,13 @@ def fitcell_receber_via_pix_mobile():
     total_venda -= Decimal(venda.desconto or 0)
     venda.valor_total = total_venda
 
-    # ========= MERCADO PAGO =========
-    mp = MercadoPagoClient(current_user.empresa_id)
-
-    telefone = venda.cliente_telefone or venda.id
-    telefone = ''.join(filter(str.isdigit, str(telefone)))
-
-    email_cliente = f"cliente{telefone}@fitcell.com.br"
-
-
-
-    pagamento = mp.criar_pagamento(
-        valor=venda.valor_total,
-        descricao=f"Venda FITCELL #{venda.id}",
-        email=email_cliente
-    )
-
-    venda.pagamento_id = str(pagamento["id"])
-    venda.pagamento_status = pagamento["status"]
-
-    poi = pagamento.get("point_of_interaction", {})
-    tx = poi.get("transaction_data")
-
-    if not tx:
-        current_app.logger.error(f"PIX não gerado: {pagamento}")
-
-        flash(
-            "Não foi possível gerar o QR Code Pix. Verifique os dados e tente novamente.",
-            "danger"
-        )
-        db.session.rollback()
-        return redirect(request.referrer)
-
-    venda.pix_qr_code = tx.get("qr_code")
-    venda.pix_qr_code_base64 = tx.get("qr_code_base64")
-
-
+    # ========= MERCADO PAGO (EM SEGUNDO PLANO) =========
+    # a venda é gravada primeiro; a cobrança sai no pool de tarefas
+    agendar_cobranca_pix(venda)
     db.session.commit()
 
+    enviar_cobranca_pix(venda.id)
+
     return redirect(
         url_for("routes.fitcell_ver_venda_peca_mobile", id=venda.id)
     )
@@ -1138,7 +1142,8 @@ def fitcell_ver_venda_peca_mobile(id):
 
     return render_template(
         "fitcell/mobile/vendas_peca_detalhe_mobile.html",
-        venda=venda
+        venda=venda,
+        pix_travado=pix_travado(venda.pagamento_status, venda.atualizado_em)
     )
 
 @bp.route("/fitcell_mobile/vendas/pecas/nova", methods=["GET", "POST"])
@@ -1172,16 +1177,7 @@ def fitcell_nova_venda_peca_mobile():
     if modelo_id:
         form.modelo_celular_id.data = modelo_id
 
-        pecas = (
-            Peca.query_empresa()
-            .join(CompatibilidadePeca)
-            .filter(
-                CompatibilidadePeca.modelo_celular_id == modelo_id,
-                Peca.ativo == True
-            )
-            .order_by(Peca.id.desc())
-            .all()
-        )
+        pecas = pecas_compativeis(current_user.empresa_id, modelo_id)
 
     # ==========================
     # SUBMIT DA VENDA
@@ -1213,6 +1209,7 @@ def fitcell_nova_venda_peca_mobile():
         db.session.flush()  # gera venda.id
 
         total_venda = 0
+        movimentos = []
 
         for peca_id, qtd, valor in zip(pecas_ids, quantidades, valores):
 
@@ -1238,38 +1235,25 @@ def fitcell_nova_venda_peca_mobile():
             )
 
             # MOVIMENTAÇÃO DE ESTOQUE (SAÍDA)
-            db.session.add(
-                EstoqueMovimentacao(
-                    empresa_id=current_user.empresa_id,
+            movimentos.append(
+                MovimentoEstoque(
                     peca_id=peca_id,
                     tipo="saida",
                     quantidade=quantidade,
-                    observacao=f"Venda #{venda.id}",
-                    criado_em=utc_now()
+                    observacao=f"Venda #{venda.id}"
                 )
             )
 
-            # ATUALIZA ESTOQUE
-            estoque = (
-                EstoquePeca.query_empresa()
-                .filter_by(peca_id=peca_id)
-                .first()
-            )
-
-            if not estoque:
-                estoque = EstoquePeca(
-                    empresa_id=current_user.empresa_id,
-                    peca_id=peca_id,
-                    quantidade=0
-                )
-                db.session.add(estoque)
-
-            estoque.quantidade -= quantidade
+        # ATUALIZA ESTOQUE (lote único, com lock)
+        EstoqueService(current_user.empresa_id).aplicar(movimentos)
 
         # DESCONTO GERAL
         total_venda -= float(venda.desconto or 0)
         venda.valor_total = total_venda
 
+        # RESUMO DO BI (mesma transação)
+        registrar_venda(venda)
+
         db.session.commit()
 
         flash("Venda registrada com sucesso!", "success")
@@ -4,6 +4,7 @@ from flask_login import login_required, current_user
 from app import db
 from app.models import EmpresaPagamentoConfig
 from app.forms import EmpresaPagamentoConfigForm
+from app.services.pagamento.mercadopago_client import invalidar_config_pagamento
 from app.utils_licenca import requer_licenca_ativa
 from app.utils import requer_permissao
 from app.utils_datetime import utc_now
@@ -45,6 +46,9 @@ def configurar_pagamento():
 
         db.session.commit()
 
+        # clientes Mercado Pago deste processo passam a usar a nova config
+        invalidar_config_pagamento(empresa_id)
+
         flash("Configuração de pagamento salva com sucesso!", "success")
         return redirect(url_for("pagamento.configurar_pagamento"))
 
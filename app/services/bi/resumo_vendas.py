@@ -0,0 +1,168 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.constants import STATUS_FINANCEIRO_VALIDO
+from app.models import VendaPeca, VendaResumoDiario
+from app.utils_datetime import utc_now, utc_now_exato, utc_to_br
+
+
+# =====================================================
+# RESUMO DIÁRIO DE VENDAS (BI)
+# =====================================================
+# Uma linha por (empresa, dia BR, peça). Toda mudança de uma venda
+# para dentro ou para fora de STATUS_FINANCEIRO_VALIDO chama
+# registrar_venda(venda, +1 / -1) ANTES do commit da própria venda.
+#
+# O desconto da venda é rateado entre as peças proporcionalmente ao
+# valor bruto de cada uma (a sobra de centavos fica na última), então
+# soma(valor_liquido) == VendaPeca.valor_total.
+CENTAVOS = Decimal("0.01")
+
+
+def _dec(valor):
+    return Decimal(str(valor or 0))
+
+
+def status_conta_no_bi(status):
+    return status in STATUS_FINANCEIRO_VALIDO
+
+
+def linhas_da_venda(venda):
+    """
+    {peca_id: [quantidade, bruto, desconto]} da venda, com desconto rateado.
+    """
+
+    linhas = {}
+    for item in venda.itens:
+        linha = linhas.setdefault(item.peca_id, [0, Decimal("0"), Decimal("0")])
+        linha[0] += item.quantidade
+        linha[1] += _dec(item.valor_total)
+
+    bruto_total = sum((l[1] for l in linhas.values()), Decimal("0"))
+    desconto = _dec(venda.desconto)
+
+    if desconto and bruto_total:
+        restante = desconto
+        pecas = sorted(linhas)
+
+        for peca_id in pecas[:-1]:
+            parte = (desconto * linhas[peca_id][1] / bruto_total).quantize(
+                CENTAVOS, rounding=ROUND_HALF_UP
+            )
+            linhas[peca_id][2] = parte
+            restante -= parte
+
+        linhas[pecas[-1]][2] = restante
+
+    return linhas
+
+
+def data_da_venda(venda):
+    return utc_to_br(venda.criado_em or utc_now()).date()
+
+
+def registrar_venda(venda, sinal=1):
+    """
+    Soma (sinal=1) ou retira (sinal=-1) a venda do resumo diário.
+    Não faz commit: roda na transação de quem alterou a venda.
+    """
+
+    linhas = linhas_da_venda(venda)
+
+    if not linhas:
+        return
+
+    data = data_da_venda(venda)
+    agora = utc_now_exato()
+
+    valores = [
+        {
+            "empresa_id": venda.empresa_id,
+            "data": data,
+            "peca_id": peca_id,
+            "quantidade": sinal * quantidade,
+            "valor_bruto": sinal * bruto,
+            "desconto": sinal * desconto,
+            "valor_liquido": sinal * (bruto - desconto),
+            "atualizado_em": agora
+        }
+        # ordem fixa de peca_id: vendas simultâneas travam as linhas na mesma ordem
+        for peca_id, (quantidade, bruto, desconto) in sorted(linhas.items())
+    ]
+
+    _somar(valores)
+
+
+def _somar(valores):
+    stmt = pg_insert(VendaResumoDiario).values(valores)
+    tabela = VendaResumoDiario
+
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            constraint="uq_fitcell_venda_resumo_empresa_data_peca",
+            set_={
+                "quantidade": tabela.quantidade + stmt.excluded.quantidade,
+                "valor_bruto": tabela.valor_bruto + stmt.excluded.valor_bruto,
+                "desconto": tabela.desconto + stmt.excluded.desconto,
+                "valor_liquido": tabela.valor_liquido + stmt.excluded.valor_liquido,
+                "atualizado_em": stmt.excluded.atualizado_em
+            }
+        )
+    )
+
+
+def reconstruir_resumo(empresa_id, lote=1000):
+    """
+    Recalcula do zero o resumo da empresa a partir das vendas.
+    Para carga inicial / correção. Não faz commit.
+    Retorna a quantidade de linhas gravadas.
+    """
+
+    db.session.query(VendaResumoDiario).filter_by(
+        empresa_id=empresa_id
+    ).delete(synchronize_session=False)
+
+    totais = defaultdict(lambda: [0, Decimal("0"), Decimal("0")])
+
+    vendas = (
+        VendaPeca.query
+        .filter(
+            VendaPeca.empresa_id == empresa_id,
+            VendaPeca.status.in_(STATUS_FINANCEIRO_VALIDO)
+        )
+        .options(selectinload(VendaPeca.itens))
+        .order_by(VendaPeca.id)
+        .yield_per(lote)
+    )
+
+    for venda in vendas:
+        data = data_da_venda(venda)
+        for peca_id, (quantidade, bruto, desconto) in linhas_da_venda(venda).items():
+            total = totais[(data, peca_id)]
+            total[0] += quantidade
+            total[1] += bruto
+            total[2] += desconto
+
+    agora = utc_now_exato()
+    valores = [
+        {
+            "empresa_id": empresa_id,
+            "data": data,
+            "peca_id": peca_id,
+            "quantidade": quantidade,
+            "valor_bruto": bruto,
+            "desconto": desconto,
+            "valor_liquido": bruto - desconto,
+            "atualizado_em": agora
+        }
+        for (data, peca_id), (quantidade, bruto, desconto) in sorted(totais.items())
+    ]
+
+    for i in range(0, len(valores), lote):
+        _somar(valores[i:i + lote])
+
+    return len(valores)
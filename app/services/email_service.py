@@ -1,8 +1,48 @@
 # app/services/email_service.py
 
+import atexit
+import logging
+import queue
+import smtplib
+import threading
 from email.message import EmailMessage
+from email.utils import formataddr
+
 from flask import current_app
-import smtplib
+
+
+# =====================================================
+# ✉️ FILA DE ENVIO (SMTP FORA DA REQUISIÇÃO)
+# =====================================================
+# send_email só monta a mensagem e põe na fila: quem chama não espera
+# handshake TLS nem login. Um remetente (thread) por conta SMTP mantém
+# a conexão autenticada aberta e manda em lote o que estiver na fila;
+# depois de OCIOSO_SEGUNDOS sem mensagem, fecha a conexão.
+#
+# A configuração SMTP é lida no send_email (com app_context) e vai junto
+# com a mensagem: a thread não precisa do app.
+#
+# Falha temporária (conexão caiu, timeout, resposta 4xx) volta para a
+# fila com espera crescente, até TENTATIVAS_MAX. Resposta 5xx descarta.
+#
+# A fila é do processo: o que estiver nela some se o processo morrer
+# (na saída normal, atexit espera até SAIDA_ESPERA_SEGUNDOS).
+FILA_MAX = 1000
+LOTE_POR_CONEXAO = 50
+OCIOSO_SEGUNDOS = 30
+TIMEOUT_SEGUNDOS = 20
+TENTATIVAS_MAX = 4
+ESPERA_BASE_SEGUNDOS = 2      # 2s, 4s, 8s...
+SAIDA_ESPERA_SEGUNDOS = 10
+
+_remetentes = {}   # config SMTP -> _Remetente
+_remetentes_lock = threading.Lock()
+
+# mensagens ainda não resolvidas (enviadas ou descartadas), de todas as contas
+_pendentes = 0
+_pendentes_cond = threading.Condition()
+
+logger = logging.getLogger(__name__)
 
 
 def send_email(
@@ -13,8 +53,9 @@ def send_email(
     from_name=None
 ):
     """
-    Envia e-mail usando SMTP global,
+    Enfileira e-mail usando SMTP global,
     com remetente dinâmico por empresa.
+    Retorna False se a fila estiver cheia.
     """
 
     msg = EmailMessage()
@@ -24,11 +65,12 @@ def send_email(
     # ==========================
     if from_email:
         if from_name:
-            msg["From"] = f"{from_name} <{from_email}>"
+            msg["From"] = formataddr((from_name, from_email))
         else:
             msg["From"] = from_email
     else:
-        msg["From"] = current_app.config["MAIL_DEFAULT_SENDER"]
+        remetente = current_app.config["MAIL_DEFAULT_SENDER"]
+        msg["From"] = formataddr(remetente) if isinstance(remetente, tuple) else remetente
 
     # ==========================
     # DESTINATÁRIO
@@ -38,20 +80,203 @@ def send_email(
     msg.set_content(body)
 
     # ==========================
-    # SMTP
+    # FILA
     # ==========================
-    server = smtplib.SMTP(
-        current_app.config["MAIL_SERVER"],
-        current_app.config["MAIL_PORT"]
-    )
+    return _obter_remetente(_config_smtp()).enfileirar(msg)
+
+
+def aguardar_envios(timeout=None):
+    """
+    Espera a fila esvaziar (scripts / testes). Retorna True se esvaziou.
+    """
+
+    with _pendentes_cond:
+        return _pendentes_cond.wait_for(lambda: _pendentes == 0, timeout=timeout)
+
 
-    if current_app.config.get("MAIL_USE_TLS", True):
-        server.starttls()
+def _config_smtp():
+    config = current_app.config
 
-    server.login(
-        current_app.config["MAIL_USERNAME"],
-        current_app.config["MAIL_PASSWORD"]
+    return (
+        config["MAIL_SERVER"],
+        config["MAIL_PORT"],
+        config.get("MAIL_USE_TLS", True),
+        config.get("MAIL_USERNAME"),
+        config.get("MAIL_PASSWORD")
     )
 
-    server.send_message(msg)
-    server.quit()
+
+def _obter_remetente(config):
+    with _remetentes_lock:
+        remetente = _remetentes.get(config)
+        if remetente is None:
+            remetente = _remetentes[config] = _Remetente(config)
+        return remetente
+
+
+def _resolvida():
+    global _pendentes
+
+    with _pendentes_cond:
+        _pendentes -= 1
+        _pendentes_cond.notify_all()
+
+
+class _Envio:
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.tentativas = 0
+
+
+class _Remetente:
+    """
+    Uma thread + uma conexão SMTP por conta.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.fila = queue.Queue(maxsize=FILA_MAX)
+        self.smtp = None
+
+        threading.Thread(
+            target=self._executar,
+            name=f"email-{config[0]}",
+            daemon=True
+        ).start()
+
+    def enfileirar(self, msg):
+        global _pendentes
+
+        with _pendentes_cond:
+            _pendentes += 1
+
+        try:
+            self.fila.put_nowait(_Envio(msg))
+        except queue.Full:
+            logger.error("Fila de e-mail cheia: descartado '%s' para %s", msg["Subject"], msg["To"])
+            _resolvida()
+            return False
+
+        return True
+
+    # =====================================================
+    # THREAD
+    # =====================================================
+    def _executar(self):
+        while True:
+            try:
+                envio = self.fila.get(timeout=OCIOSO_SEGUNDOS if self.smtp else None)
+            except queue.Empty:
+                self._fechar()
+                continue
+
+            lote = [envio]
+            while len(lote) < LOTE_POR_CONEXAO:
+                try:
+                    lote.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._verificar_conexao()
+
+            for envio in lote:
+                self._enviar(envio)
+
+    def _enviar(self, envio):
+        envio.tentativas += 1
+
+        try:
+            self._conectar()
+            self.smtp.send_message(envio.msg)
+
+        except smtplib.SMTPRecipientsRefused as e:
+            codigos = [codigo for codigo, _ in e.recipients.values()]
+            self._falhou(envio, e, all(400 <= c < 500 for c in codigos))
+
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code == 421:   # servidor encerrando a conexão
+                self._descartar_conexao()
+            self._falhou(envio, e, 400 <= e.smtp_code < 500)
+
+        except (smtplib.SMTPException, OSError) as e:
+            # desconectado, timeout, erro de rede
+            self._descartar_conexao()
+            self._falhou(envio, e, True)
+
+        else:
+            _resolvida()
+
+    def _falhou(self, envio, erro, temporario):
+        if temporario and envio.tentativas < TENTATIVAS_MAX:
+            espera = ESPERA_BASE_SEGUNDOS * 2 ** (envio.tentativas - 1)
+            logger.warning(
+                "Falha temporária no e-mail para %s (tentativa %s), nova tentativa em %ss: %s",
+                envio.msg["To"], envio.tentativas, espera, erro
+            )
+            temporizador = threading.Timer(espera, self.fila.put, [envio])
+            temporizador.daemon = True
+            temporizador.start()
+            return
+
+        logger.error("E-mail para %s descartado: %s", envio.msg["To"], erro)
+        _resolvida()
+
+    # =====================================================
+    # CONEXÃO
+    # =====================================================
+    def _conectar(self):
+        if self.smtp is not None:
+            return
+
+        servidor, porta, usar_tls, usuario, senha = self.config
+
+        smtp = smtplib.SMTP(servidor, porta, timeout=TIMEOUT_SEGUNDOS)
+        try:
+            if usar_tls:
+                smtp.starttls()
+            if usuario:
+                smtp.login(usuario, senha)
+        except BaseException:
+            smtp.close()
+            raise
+
+        self.smtp = smtp
+
+    def _verificar_conexao(self):
+        # conexão parada pode ter sido fechada pelo servidor: testa antes do lote
+        if self.smtp is None:
+            return
+
+        try:
+            codigo, _ = self.smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            codigo = None
+
+        if codigo != 250:
+            self._descartar_conexao()
+
+    def _fechar(self):
+        if self.smtp is None:
+            return
+
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+        self._descartar_conexao()
+
+    def _descartar_conexao(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.close()
+            except OSError:
+                pass
+        self.smtp = None
+
+
+@atexit.register
+def _esvaziar_na_saida():
+    if _pendentes:
+        aguardar_envios(SAIDA_ESPERA_SEGUNDOS)
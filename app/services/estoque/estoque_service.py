@@ -0,0 +1,207 @@
+from collections import defaultdict
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import EstoqueMovimentacao, EstoquePeca
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# SINAL DAS MOVIMENTAÇÕES
+# =====================================================
+# saida / defeito  -> gravadas POSITIVAS, diminuem o estoque
+# estorno          -> gravado NEGATIVO, diminui o estoque
+# entrada / devolucao / ajuste -> somam como gravadas
+TIPOS_SAIDA = ("saida", "defeito")
+
+
+def delta_movimentacao(tipo, quantidade):
+    """
+    Efeito da movimentação no saldo da peça.
+    """
+    return -quantidade if tipo in TIPOS_SAIDA else quantidade
+
+
+def expr_delta_movimentacao():
+    """
+    Mesmo cálculo de delta_movimentacao em SQL (para SUM no banco).
+    """
+    return case(
+        (EstoqueMovimentacao.tipo.in_(TIPOS_SAIDA), -EstoqueMovimentacao.quantidade),
+        else_=EstoqueMovimentacao.quantidade
+    )
+
+
+class MovimentoEstoque:
+    """
+    Uma movimentação a ser aplicada pelo EstoqueService.
+    """
+
+    def __init__(
+        self,
+        peca_id,
+        tipo,
+        quantidade,
+        observacao=None,
+        fornecedor_id=None,
+        compra_id=None,
+        movimentacao_origem_id=None
+    ):
+        self.peca_id = int(peca_id)
+        self.tipo = tipo
+        self.quantidade = quantidade
+        self.observacao = observacao
+        self.fornecedor_id = fornecedor_id
+        self.compra_id = compra_id
+        self.movimentacao_origem_id = movimentacao_origem_id
+
+    @property
+    def delta(self):
+        return delta_movimentacao(self.tipo, self.quantidade)
+
+
+class EstoqueService:
+    """
+    Única porta de escrita em EstoquePeca / EstoqueMovimentacao.
+
+    - trava as linhas de estoque com SELECT ... FOR UPDATE
+      em ordem de peca_id (sem deadlock entre vendas simultâneas)
+    - cria as linhas de EstoquePeca que faltam (upsert)
+    - grava as movimentações em lote
+    - atualiza quantidade = quantidade + delta em UM UPDATE
+
+    Não faz commit: roda dentro da transação de quem chamou.
+    """
+
+    def __init__(self, empresa_id):
+        self.empresa_id = empresa_id
+        self._saldos = {}   # peca_id -> quantidade (linhas já travadas nesta transação)
+
+    # =====================================================
+    # LOCK
+    # =====================================================
+    def travar(self, peca_ids):
+        """
+        Trava o estoque das peças e devolve {peca_id: quantidade}.
+        """
+
+        ids = sorted({int(i) for i in peca_ids} - set(self._saldos))
+
+        if ids:
+            self._saldos.update(self._selecionar_para_update(ids))
+
+            faltantes = [i for i in ids if i not in self._saldos]
+
+            if faltantes:
+                db.session.execute(
+                    pg_insert(EstoquePeca)
+                    .values([
+                        {
+                            "empresa_id": self.empresa_id,
+                            "peca_id": peca_id,
+                            "quantidade": 0
+                        }
+                        for peca_id in faltantes
+                    ])
+                    .on_conflict_do_nothing(index_elements=["peca_id"])
+                )
+
+                # outra transação pode ter criado a linha antes: trava do mesmo jeito
+                self._saldos.update(self._selecionar_para_update(faltantes))
+
+        return dict(self._saldos)
+
+    def _selecionar_para_update(self, ids):
+        linhas = db.session.execute(
+            select(EstoquePeca.peca_id, EstoquePeca.quantidade)
+            .where(
+                EstoquePeca.empresa_id == self.empresa_id,
+                EstoquePeca.peca_id.in_(ids)
+            )
+            .order_by(EstoquePeca.peca_id)
+            .with_for_update()
+        ).all()
+
+        return {peca_id: quantidade for peca_id, quantidade in linhas}
+
+    # =====================================================
+    # APLICAR
+    # =====================================================
+    def aplicar(self, movimentos):
+        """
+        Aplica as movimentações e devolve os saldos finais {peca_id: quantidade}.
+        """
+
+        movimentos = [m for m in movimentos if m.quantidade]
+
+        if not movimentos:
+            return {}
+
+        self.travar(m.peca_id for m in movimentos)
+
+        self._gravar_movimentacoes(movimentos)
+
+        deltas = defaultdict(int)
+        for m in movimentos:
+            deltas[m.peca_id] += m.delta
+
+        deltas = {peca_id: delta for peca_id, delta in deltas.items() if delta}
+
+        if deltas:
+            db.session.execute(
+                update(EstoquePeca)
+                .where(
+                    EstoquePeca.empresa_id == self.empresa_id,
+                    EstoquePeca.peca_id.in_(list(deltas))
+                )
+                .values(
+                    quantidade=EstoquePeca.quantidade + case(
+                        deltas,
+                        value=EstoquePeca.peca_id,
+                        else_=0
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+            for peca_id, delta in deltas.items():
+                self._saldos[peca_id] += delta
+
+        return {m.peca_id: self._saldos[m.peca_id] for m in movimentos}
+
+    def registrar_no_razao(self, movimentos):
+        """
+        Grava movimentações SEM alterar EstoquePeca.
+
+        Uso exclusivo da reconciliação: acerta o razão ao saldo
+        atual quando os dois divergem. As peças precisam estar
+        travadas (travar) na mesma transação.
+        """
+
+        movimentos = [m for m in movimentos if m.quantidade]
+
+        if movimentos:
+            self._gravar_movimentacoes(movimentos)
+
+    def _gravar_movimentacoes(self, movimentos):
+        agora = utc_now()
+
+        db.session.execute(
+            insert(EstoqueMovimentacao),
+            [
+                {
+                    "empresa_id": self.empresa_id,
+                    "peca_id": m.peca_id,
+                    "fornecedor_id": m.fornecedor_id,
+                    "compra_id": m.compra_id,
+                    "tipo": m.tipo,
+                    "quantidade": m.quantidade,
+                    "movimentacao_origem_id": m.movimentacao_origem_id,
+                    "observacao": m.observacao,
+                    "criado_em": agora
+                }
+                for m in movimentos
+            ]
+        )
@@ -0,0 +1,289 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import and_, func, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import EstoqueMovimentacao, EstoquePeca, EstoqueRazaoSaldo, EstoqueReconciliacao
+from app.services.estoque.estoque_service import (
+    EstoqueService, MovimentoEstoque, expr_delta_movimentacao
+)
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# RECONCILIAÇÃO SALDO x RAZÃO
+# =====================================================
+# EstoqueRazaoSaldo acumula a soma das movimentações por peça até
+# EstoqueReconciliacao.ultimo_movimento_id. Cada execução:
+#
+#   1) soma só as movimentações novas (id > checkpoint), em faixas de id,
+#      agregando no banco e lendo o resultado por cursor no servidor
+#   2) compara EstoquePeca com razão + movimentações após o checkpoint
+#      em UMA leitura REPEATABLE READ (mesmo snapshot dos dois lados)
+#
+# Memória no Python: proporcional ao nº de peças de uma faixa, nunca
+# ao nº de movimentações.
+LOTE_IDS = 200_000
+YIELD_PER = 5_000
+
+# movimentações mais novas que isso ainda não entram no checkpoint:
+# uma transação lenta pode gravar um id menor depois de um id maior
+MARGEM_CHECKPOINT = timedelta(minutes=1)
+
+OBSERVACAO_AJUSTE = "Ajuste automático da reconciliação de estoque"
+
+
+class Divergencia:
+
+    def __init__(self, empresa_id, peca_id, saldo, razao):
+        self.empresa_id = empresa_id
+        self.peca_id = peca_id
+        self.saldo = saldo
+        self.razao = razao
+
+    @property
+    def diferenca(self):
+        return self.saldo - self.razao
+
+
+def _checkpoint():
+    checkpoint = EstoqueReconciliacao.query.with_for_update().first()
+
+    if not checkpoint:
+        checkpoint = EstoqueReconciliacao(ultimo_movimento_id=0)
+        db.session.add(checkpoint)
+        db.session.flush()
+
+    return checkpoint
+
+
+def atualizar_razao(lote=LOTE_IDS, margem=MARGEM_CHECKPOINT):
+    """
+    Soma no razão as movimentações novas e avança o checkpoint.
+    Commit a cada faixa (uma execução interrompida continua de onde parou).
+    Retorna (checkpoint_final, movimentações_somadas).
+    """
+
+    checkpoint = _checkpoint()
+    inicio = checkpoint.ultimo_movimento_id
+
+    limite = (
+        db.session.query(func.max(EstoqueMovimentacao.id))
+        .filter(
+            EstoqueMovimentacao.id > inicio,
+            EstoqueMovimentacao.criado_em < utc_now() - margem
+        )
+        .scalar()
+    )
+
+    if not limite:
+        db.session.commit()
+        return inicio, 0
+
+    total = 0
+    atual = inicio
+
+    while atual < limite:
+        fim = min(atual + lote, limite)
+
+        somas = db.session.execute(
+            select(
+                EstoqueMovimentacao.empresa_id,
+                EstoqueMovimentacao.peca_id,
+                func.sum(expr_delta_movimentacao()),
+                func.count()
+            )
+            .where(
+                EstoqueMovimentacao.id > atual,
+                EstoqueMovimentacao.id <= fim
+            )
+            .group_by(EstoqueMovimentacao.empresa_id, EstoqueMovimentacao.peca_id),
+            execution_options={"yield_per": YIELD_PER}
+        )
+
+        linhas = []
+        for empresa_id, peca_id, delta, qtd in somas:
+            total += qtd
+            linhas.append({
+                "empresa_id": empresa_id,
+                "peca_id": peca_id,
+                "quantidade": int(delta or 0)
+            })
+
+            if len(linhas) >= YIELD_PER:
+                _somar_razao(linhas)
+                linhas = []
+
+        _somar_razao(linhas)
+
+        checkpoint.ultimo_movimento_id = fim
+        db.session.commit()
+
+        atual = fim
+        checkpoint = _checkpoint()
+
+    db.session.commit()
+    return limite, total
+
+
+def _somar_razao(linhas):
+    if not linhas:
+        return
+
+    stmt = pg_insert(EstoqueRazaoSaldo).values(linhas)
+
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["peca_id"],
+            set_={"quantidade": EstoqueRazaoSaldo.quantidade + stmt.excluded.quantidade}
+        )
+    )
+
+
+def _razao_atual(ultimo_movimento_id, empresa_id=None, peca_ids=None):
+    """
+    Subquery (empresa_id, peca_id, quantidade): razão do checkpoint
+    + movimentações posteriores a ele.
+    """
+
+    base = select(
+        EstoqueRazaoSaldo.empresa_id,
+        EstoqueRazaoSaldo.peca_id,
+        EstoqueRazaoSaldo.quantidade.label("quantidade")
+    )
+
+    cauda = (
+        select(
+            EstoqueMovimentacao.empresa_id,
+            EstoqueMovimentacao.peca_id,
+            func.sum(expr_delta_movimentacao()).label("quantidade")
+        )
+        .where(EstoqueMovimentacao.id > ultimo_movimento_id)
+        .group_by(EstoqueMovimentacao.empresa_id, EstoqueMovimentacao.peca_id)
+    )
+
+    if empresa_id:
+        base = base.where(EstoqueRazaoSaldo.empresa_id == empresa_id)
+        cauda = cauda.where(EstoqueMovimentacao.empresa_id == empresa_id)
+
+    if peca_ids is not None:
+        base = base.where(EstoqueRazaoSaldo.peca_id.in_(peca_ids))
+        cauda = cauda.where(EstoqueMovimentacao.peca_id.in_(peca_ids))
+
+    partes = union_all(base, cauda).subquery()
+
+    return (
+        select(
+            partes.c.empresa_id,
+            partes.c.peca_id,
+            func.sum(partes.c.quantidade).label("quantidade")
+        )
+        .group_by(partes.c.empresa_id, partes.c.peca_id)
+        .subquery()
+    )
+
+
+def buscar_divergencias(empresa_id=None):
+    """
+    Gera Divergencia para cada peça cujo saldo difere do razão.
+
+    Roda em REPEATABLE READ: EstoquePeca e movimentações são lidas no
+    mesmo snapshot (o EstoqueService grava os dois na mesma transação).
+    """
+
+    db.session.commit()
+    db.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    try:
+        checkpoint = EstoqueReconciliacao.query.first()
+        ultimo = checkpoint.ultimo_movimento_id if checkpoint else 0
+
+        razao = _razao_atual(ultimo, empresa_id)
+
+        saldos = select(EstoquePeca.empresa_id, EstoquePeca.peca_id, EstoquePeca.quantidade)
+        if empresa_id:
+            saldos = saldos.where(EstoquePeca.empresa_id == empresa_id)
+        saldos = saldos.subquery()
+
+        saldo = func.coalesce(saldos.c.quantidade, 0)
+        total_razao = func.coalesce(razao.c.quantidade, 0)
+
+        linhas = db.session.execute(
+            select(
+                func.coalesce(saldos.c.empresa_id, razao.c.empresa_id),
+                func.coalesce(saldos.c.peca_id, razao.c.peca_id),
+                saldo,
+                total_razao
+            )
+            .select_from(
+                saldos.outerjoin(
+                    razao,
+                    and_(
+                        razao.c.empresa_id == saldos.c.empresa_id,
+                        razao.c.peca_id == saldos.c.peca_id
+                    ),
+                    full=True
+                )
+            )
+            .where(saldo != total_razao),
+            execution_options={"yield_per": YIELD_PER}
+        )
+
+        for empresa, peca_id, qtd_saldo, qtd_razao in linhas:
+            yield Divergencia(empresa, peca_id, int(qtd_saldo), int(qtd_razao))
+
+    finally:
+        db.session.rollback()
+
+
+def corrigir_divergencias(divergencias):
+    """
+    Grava um 'ajuste' (saldo - razão) por peça divergente, sem mexer em
+    EstoquePeca: o saldo atual é mantido e o razão passa a explicá-lo.
+
+    A diferença é recalculada com as peças travadas (uma transação por
+    empresa), então vendas feitas entre a leitura e a correção não geram
+    ajuste indevido. Retorna a quantidade de ajustes gravados.
+    """
+
+    por_empresa = defaultdict(set)
+    for d in divergencias:
+        por_empresa[d.empresa_id].add(d.peca_id)
+
+    gravados = 0
+
+    for empresa_id, peca_ids in sorted(por_empresa.items()):
+        peca_ids = sorted(peca_ids)
+        servico = EstoqueService(empresa_id)
+
+        saldos = servico.travar(peca_ids)
+
+        checkpoint = EstoqueReconciliacao.query.first()
+        razao = _razao_atual(
+            checkpoint.ultimo_movimento_id if checkpoint else 0,
+            empresa_id,
+            peca_ids
+        )
+        razoes = {
+            peca_id: int(qtd or 0)
+            for _, peca_id, qtd in db.session.execute(select(razao)).all()
+        }
+
+        ajustes = [
+            MovimentoEstoque(
+                peca_id=peca_id,
+                tipo="ajuste",
+                quantidade=saldos.get(peca_id, 0) - razoes.get(peca_id, 0),
+                observacao=OBSERVACAO_AJUSTE
+            )
+            for peca_id in peca_ids
+        ]
+
+        servico.registrar_no_razao(ajustes)
+        db.session.commit()
+
+        gravados += sum(1 for m in ajustes if m.quantidade)
+
+    return gravados
@@ -0,0 +1,146 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import EstoqueMovimentacao, EstoqueSaldoDiario
+from app.services.estoque.estoque_service import expr_delta_movimentacao
+from app.utils_datetime import br_to_utc, utc_now
+
+
+# =====================================================
+# SALDO DE ESTOQUE EM UMA DATA (PONTO NO TEMPO)
+# =====================================================
+# EstoqueSaldoDiario guarda o saldo de cada peça ao FIM de um dia
+# (horário de Brasília). Saldo em D = snapshot mais próximo <= D
+# + movimentações entre o fim do snapshot e o fim de D.
+
+
+def fim_do_dia_utc(data):
+    """
+    Instante (UTC) em que termina o dia `data` no horário do Brasil.
+    """
+    return br_to_utc(datetime.combine(data + timedelta(days=1), time.min))
+
+
+def _snapshot_mais_proximo(empresa_id, data, estrito=False):
+    """
+    Último snapshot <= data (ou < data com estrito=True).
+    """
+
+    limite = (
+        EstoqueSaldoDiario.data < data
+        if estrito
+        else EstoqueSaldoDiario.data <= data
+    )
+
+    return (
+        db.session.query(func.max(EstoqueSaldoDiario.data))
+        .filter(
+            EstoqueSaldoDiario.empresa_id == empresa_id,
+            limite
+        )
+        .scalar()
+    )
+
+
+def saldo_em(empresa_id, data, peca_ids=None, estrito=False):
+    """
+    Saldo de estoque por peça ao fim do dia `data`.
+
+    estrito=True ignora o snapshot do próprio dia `data` (parte do
+    anterior e soma as movimentações do dia): é o que permite regravar
+    um snapshot errado.
+
+    Retorna {peca_id: quantidade}. Peças sem saldo ficam de fora
+    (ou com 0, quando vierem em peca_ids).
+    """
+
+    if peca_ids is not None:
+        peca_ids = list(peca_ids)
+        if not peca_ids:
+            return {}
+
+    base = _snapshot_mais_proximo(empresa_id, data, estrito)
+
+    saldos = {}
+
+    # ==========================
+    # 1) SNAPSHOT
+    # ==========================
+    if base:
+        q = (
+            db.session.query(EstoqueSaldoDiario.peca_id, EstoqueSaldoDiario.quantidade)
+            .filter(
+                EstoqueSaldoDiario.empresa_id == empresa_id,
+                EstoqueSaldoDiario.data == base
+            )
+        )
+        if peca_ids is not None:
+            q = q.filter(EstoqueSaldoDiario.peca_id.in_(peca_ids))
+
+        saldos.update(q.all())
+
+    # ==========================
+    # 2) MOVIMENTAÇÕES DEPOIS DO SNAPSHOT
+    # ==========================
+    q = (
+        db.session.query(
+            EstoqueMovimentacao.peca_id,
+            func.sum(expr_delta_movimentacao())
+        )
+        .filter(
+            EstoqueMovimentacao.empresa_id == empresa_id,
+            EstoqueMovimentacao.criado_em < fim_do_dia_utc(data)
+        )
+    )
+
+    if base:
+        q = q.filter(EstoqueMovimentacao.criado_em >= fim_do_dia_utc(base))
+
+    if peca_ids is not None:
+        q = q.filter(EstoqueMovimentacao.peca_id.in_(peca_ids))
+
+    for peca_id, delta in q.group_by(EstoqueMovimentacao.peca_id).all():
+        saldos[peca_id] = saldos.get(peca_id, 0) + int(delta or 0)
+
+    if peca_ids is not None:
+        return {peca_id: saldos.get(peca_id, 0) for peca_id in peca_ids}
+
+    return {peca_id: qtd for peca_id, qtd in saldos.items() if qtd}
+
+
+def gerar_snapshot(empresa_id, data):
+    """
+    Grava (ou regrava) o snapshot da empresa no fim do dia `data`.
+    Retorna a quantidade de peças gravadas. Não faz commit.
+    """
+
+    if fim_do_dia_utc(data) > utc_now():
+        raise ValueError("Snapshot só pode ser gerado para dias já encerrados.")
+
+    # nunca parte do snapshot que está sendo regravado
+    saldos = saldo_em(empresa_id, data, estrito=True)
+
+    db.session.query(EstoqueSaldoDiario).filter_by(
+        empresa_id=empresa_id,
+        data=data
+    ).delete(synchronize_session=False)
+
+    if saldos:
+        db.session.execute(
+            pg_insert(EstoqueSaldoDiario),
+            [
+                {
+                    "empresa_id": empresa_id,
+                    "peca_id": peca_id,
+                    "data": data,
+                    "quantidade": quantidade,
+                    "criado_em": utc_now()
+                }
+                for peca_id, quantidade in saldos.items()
+            ]
+        )
+
+    return len(saldos)
@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+from app import db
+from app.models import VendaPeca
+from app.services.bi.resumo_vendas import registrar_venda
+from app.services.estoque.estoque_service import EstoqueService, MovimentoEstoque
+from app.services.pagamento.notificacoes import notificar_venda
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# ✅ CONFIRMAÇÃO DO PAGAMENTO PIX
+# =====================================================
+# Aplica na venda o pagamento já consultado no Mercado Pago. A consulta
+# (HTTP) fica a cargo de quem chama e acontece ANTES: aqui a venda só
+# fica travada (FOR UPDATE) durante as escritas no banco.
+#
+# Resultados: "confirmado" | "nao_aprovado" | "valor_divergente" |
+#             "ja_processado" | "cancelada" | "venda_nao_encontrada"
+
+
+def confirmar_pagamento(venda_id, pagamento):
+    """
+    pagamento: resposta de MercadoPagoClient.consultar_pagamento.
+    Faz commit e avisa o long-poll. Retorna o resultado.
+    """
+
+    venda = (
+        VendaPeca.query
+        .filter_by(id=venda_id)
+        .with_for_update()
+        .first()
+    )
+
+    if not venda:
+        db.session.rollback()
+        return "venda_nao_encontrada"
+
+    # =================================================
+    # IDEMPOTÊNCIA (outro aviso pode ter chegado antes)
+    # =================================================
+    if venda.status == "FINALIZADA":
+        db.session.rollback()
+        return "ja_processado"
+
+    if venda.status == "CANCELADA":
+        db.session.rollback()
+        return "cancelada"
+
+    status_mp = pagamento.get("status")
+    valor_pago = Decimal(str(pagamento.get("transaction_amount", 0)))
+
+    # =================================================
+    # NÃO APROVADO
+    # =================================================
+    if status_mp != "approved":
+        venda.pagamento_status = status_mp
+        db.session.commit()
+        notificar_venda(venda_id)
+        return "nao_aprovado"
+
+    # =================================================
+    # CONFERE VALOR
+    # =================================================
+    if valor_pago != venda.valor_total:
+        db.session.rollback()
+        return "valor_divergente"
+
+    # =================================================
+    # CONFIRMA PAGAMENTO
+    # =================================================
+    venda.pagamento_status = status_mp
+    venda.pago_em = utc_now()
+    venda.status = "FINALIZADA"
+
+    baixar_estoque_venda(venda)
+
+    # resumo do BI
+    registrar_venda(venda)
+
+    db.session.commit()
+
+    # acorda o long-poll da tela da venda
+    notificar_venda(venda_id)
+
+    return "confirmado"
+
+
+def baixar_estoque_venda(venda):
+    """
+    Baixa de estoque após o pagamento Pix (lote único, com lock).
+    """
+
+    EstoqueService(venda.empresa_id).aplicar(
+        MovimentoEstoque(
+            peca_id=item.peca_id,
+            tipo="saida",
+            quantidade=item.quantidade,
+            observacao=f"Venda Pix #{venda.id}"
+        )
+        for item in venda.itens
+    )
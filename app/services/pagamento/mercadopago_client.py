@@ -1,6 +1,12 @@
-import requests
+import threading
+import time
 import uuid
 
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from app.models import EmpresaPagamentoConfig
 from app.services.pagamento.exceptions import (
     PagamentoConfigNotFound,
@@ -9,6 +15,124 @@ from app.services.pagamento.exceptions import (
 
 MP_BASE_URL = "https://api.mercadopago.com"
 
+# =====================================================
+# 🌐 SESSÃO HTTP COMPARTILHADA (KEEP-ALIVE)
+# =====================================================
+# Uma sessão por processo, com pool de conexões: cada chamada reaproveita
+# a conexão TLS já aberta em vez de fazer um handshake novo.
+#
+# Retentativas (urllib3): só falhas de conexão, timeouts e 429/5xx, com
+# backoff exponencial + jitter. POST também é repetido: a mesma
+# X-Idempotency-Key vai em todas as tentativas de UMA chamada lógica,
+# então o Mercado Pago não cria o pagamento duas vezes.
+TIMEOUT = (5, 20)            # (conexão, leitura) em segundos
+POOL_MAX = 20                # conexões mantidas abertas por host
+
+RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    status=3,
+    backoff_factor=0.3,
+    backoff_jitter=0.2,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+
+def obter_sessao():
+    global _sessao
+
+    with _sessao_lock:
+        if _sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=POOL_MAX,
+                max_retries=RETRY
+            )
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            _sessao = sessao
+        return _sessao
+
+
+def _base_url():
+    if has_app_context():
+        return current_app.config.get("MERCADOPAGO_BASE_URL") or MP_BASE_URL
+    return MP_BASE_URL
+
+
+# =====================================================
+# 🧠 CACHE DA CONFIGURAÇÃO POR EMPRESA
+# =====================================================
+# Evita uma consulta a EmpresaPagamentoConfig a cada cliente criado
+# (uma por webhook). configurar_pagamento invalida na hora; outros
+# processos enxergam a mudança em até CONFIG_TTL_SEGUNDOS.
+CONFIG_TTL_SEGUNDOS = 300
+
+_configs = {}   # empresa_id -> (expira_em, ConfigMercadoPago)
+_configs_lock = threading.Lock()
+
+
+class ConfigMercadoPago:
+    """
+    Cópia simples (fora da sessão do banco) da configuração ativa.
+    """
+
+    def __init__(self, access_token, public_key=None):
+        self.access_token = access_token
+        self.public_key = public_key
+
+
+def _buscar_config(empresa_id):
+    config = (
+        EmpresaPagamentoConfig.query
+        .filter_by(
+            empresa_id=empresa_id,
+            ativo=True,
+            gateway="mercadopago"
+        )
+        .first()
+    )
+
+    if not config:
+        return None
+
+    return ConfigMercadoPago(config.access_token, config.public_key)
+
+
+def carregar_config(empresa_id):
+    agora = time.monotonic()
+
+    with _configs_lock:
+        guardado = _configs.get(empresa_id)
+
+    if guardado and guardado[0] > agora:
+        return guardado[1]
+
+    config = _buscar_config(empresa_id)
+
+    if not config:
+        raise PagamentoConfigNotFound(
+            "Empresa sem configuração ativa do Mercado Pago."
+        )
+
+    with _configs_lock:
+        _configs[empresa_id] = (agora + CONFIG_TTL_SEGUNDOS, config)
+
+    return config
+
+
+def invalidar_config_pagamento(empresa_id):
+    with _configs_lock:
+        _configs.pop(empresa_id, None)
+
 
 class MercadoPagoClient:
     """
@@ -18,65 +142,63 @@ class MercadoPagoClient:
     """
 
     def __init__(self, empresa_id: int):
-        self.config = self._carregar_config(empresa_id)
+        self.config = carregar_config(empresa_id)
         self.token = self.config.access_token
 
-        self.is_teste = self.token.startswith("TEST-")
-
-    # =====================================================
-    # CONFIG
-    # =====================================================
-    def _carregar_config(self, empresa_id):
-        config = (
-            EmpresaPagamentoConfig.query
-            .filter_by(
-                empresa_id=empresa_id,
-                ativo=True,
-                gateway="mercadopago"
-            )
-            .first()
-        )
+        # lido aqui: o cliente também é usado em threads sem app_context
+        self.base_url = _base_url()
 
-        if not config:
-            raise PagamentoConfigNotFound(
-                "Empresa sem configuração ativa do Mercado Pago."
-            )
-
-        return config
+        self.is_teste = self.token.startswith("TEST-")
 
     # =====================================================
-    # HEADERS (SEMPRE NOVOS)
+    # HEADERS (UMA CHAVE DE IDEMPOTÊNCIA POR CHAMADA LÓGICA)
     # =====================================================
-    def _headers(self):
+    def _headers(self, chave_idempotencia=None):
         return {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json",
-            "X-Idempotency-Key": str(uuid.uuid4())
+            "X-Idempotency-Key": chave_idempotencia or str(uuid.uuid4())
         }
 
+    def _requisitar(self, metodo, caminho, *, json=None, chave_idempotencia=None):
+        try:
+            return obter_sessao().request(
+                metodo,
+                f"{self.base_url}{caminho}",
+                json=json,
+                headers=self._headers(chave_idempotencia),
+                timeout=TIMEOUT
+            )
+        except requests.RequestException as e:
+            # retentativas esgotadas (conexão / timeout)
+            raise PagamentoRequestError(f"Falha de comunicação com o Mercado Pago: {e}") from e
+
     # =====================================================
     # API PÚBLICA
     # =====================================================
-    def criar_pagamento(self, *, valor, descricao, email):
+    def criar_pagamento(self, *, valor, descricao, email, chave_idempotencia=None):
+        """
+        chave_idempotencia: use um valor estável (ex.: id da venda) para
+        que um reenvio da mesma venda devolva o pagamento já criado.
+        """
+
         if self.is_teste:
             return self._criar_pagamento_cartao_teste(
                 valor=valor,
                 descricao=descricao,
-                email=email
+                email=email,
+                chave_idempotencia=chave_idempotencia
             )
 
         return self._criar_pagamento_pix(
             valor=valor,
             descricao=descricao,
-            email=email
+            email=email,
+            chave_idempotencia=chave_idempotencia
         )
 
     def consultar_pagamento(self, pagamento_id):
-        response = requests.get(
-            f"{MP_BASE_URL}/v1/payments/{pagamento_id}",
-            headers=self._headers(),
-            timeout=20
-        )
+        response = self._requisitar("GET", f"/v1/payments/{pagamento_id}")
 
         if response.status_code != 200:
             raise PagamentoRequestError(
@@ -88,7 +210,7 @@ class MercadoPagoClient:
     # =====================================================
     # TESTE → CARTÃO
     # =====================================================
-    def _criar_pagamento_cartao_teste(self, *, valor, descricao, email):
+    def _criar_pagamento_cartao_teste(self, *, valor, descricao, email, chave_idempotencia=None):
 
         token_cartao = self._gerar_token_cartao_teste()
 
@@ -104,11 +226,11 @@ class MercadoPagoClient:
             "statement_descriptor": "SAASFX TESTE"
         }
 
-        response = requests.post(
-            f"{MP_BASE_URL}/v1/payments",
+        response = self._requisitar(
+            "POST",
+            "/v1/payments",
             json=payload,
-            headers=self._headers(),
-            timeout=20
+            chave_idempotencia=chave_idempotencia
         )
 
         if response.status_code not in (200, 201):
@@ -130,12 +252,7 @@ class MercadoPagoClient:
             }
         }
 
-        response = requests.post(
-            f"{MP_BASE_URL}/v1/card_tokens",
-            json=payload,
-            headers=self._headers(),
-            timeout=20
-        )
+        response = self._requisitar("POST", "/v1/card_tokens", json=payload)
 
         if response.status_code != 201:
             raise PagamentoRequestError(
@@ -147,7 +264,7 @@ class MercadoPagoClient:
     # =====================================================
     # PRODUÇÃO → PIX
     # =====================================================
-    def _criar_pagamento_pix(self, *, valor, descricao, email):
+    def _criar_pagamento_pix(self, *, valor, descricao, email, chave_idempotencia=None):
 
         payload = {
             "transaction_amount": float(valor),
@@ -160,11 +277,11 @@ class MercadoPagoClient:
             }
         }
 
-        response = requests.post(
-            f"{MP_BASE_URL}/v1/payments",
+        response = self._requisitar(
+            "POST",
+            "/v1/payments",
             json=payload,
-            headers=self._headers(),
-            timeout=20
+            chave_idempotencia=chave_idempotencia
         )
 
         if response.status_code not in (200, 201):
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+# =====================================================
+# 🔔 AVISO DE MUDANÇA NA VENDA (LONG-POLL)
+# =====================================================
+# Quem altera o status / QR Code de uma venda chama notificar_venda()
+# DEPOIS do commit; as requisições de long-poll da mesma venda, neste
+# processo, acordam na hora.
+#
+# Mudanças feitas por outro processo não chegam por aqui: quem espera
+# relê o banco a cada `verificar_a_cada` segundos, então o atraso
+# máximo nesse caso é esse intervalo.
+_cond = threading.Condition()
+_versoes = {}      # venda_id -> contador de mudanças (só enquanto há quem espere)
+_esperando = {}    # venda_id -> nº de requisições esperando
+
+_vagas = None
+_vagas_lock = threading.Lock()
+
+
+def notificar_venda(venda_id):
+    with _cond:
+        if venda_id in _esperando:
+            _versoes[venda_id] = _versoes.get(venda_id, 0) + 1
+            _cond.notify_all()
+
+
+def reservar_espera(maximo):
+    """
+    Limita quantas threads do servidor ficam presas em long-poll.
+    Retorna False se não há vaga (o cliente tenta de novo mais tarde).
+    """
+
+    global _vagas
+
+    with _vagas_lock:
+        if _vagas is None:
+            _vagas = threading.BoundedSemaphore(maximo)
+
+    return _vagas.acquire(blocking=False)
+
+
+def liberar_espera():
+    _vagas.release()
+
+
+def aguardar_venda(venda_id, segundos, mudou, verificar_a_cada=5):
+    """
+    Bloqueia até mudou() ser verdadeiro ou `segundos` passarem.
+    mudou() é chamado logo no início (já registrado: nenhum aviso se
+    perde entre a leitura e a espera), a cada aviso e a cada
+    `verificar_a_cada` segundos. Retorna True se houve mudança.
+    """
+
+    limite = time.monotonic() + segundos
+
+    with _cond:
+        _esperando[venda_id] = _esperando.get(venda_id, 0) + 1
+        versao = _versoes.get(venda_id, 0)
+
+    try:
+        while True:
+            if mudou():
+                return True
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return False
+
+            with _cond:
+                _cond.wait_for(
+                    lambda: _versoes.get(venda_id, 0) != versao,
+                    timeout=min(restante, verificar_a_cada)
+                )
+                versao = _versoes.get(venda_id, 0)
+
+    finally:
+        with _cond:
+            _esperando[venda_id] -= 1
+            if not _esperando[venda_id]:
+                del _esperando[venda_id]
+                _versoes.pop(venda_id, None)
@@ -0,0 +1,170 @@
+import logging
+from collections import Counter
+from datetime import UTC, timedelta
+
+from sqlalchemy import select
+
+from app import db
+from app.models import VendaPeca
+from app.services.pagamento.exceptions import PagamentoError
+from app.services.pagamento.mercadopago_client import MercadoPagoClient
+from app.services.pagamento.notificacoes import notificar_venda
+from app.tarefas import enviar_tarefa_pagamento
+from app.utils_datetime import utc_now, utc_now_exato
+
+
+# =====================================================
+# 💠 COBRANÇA PIX EM SEGUNDO PLANO
+# =====================================================
+# A rota grava a venda (AGUARDANDO_PAGAMENTO, pagamento_status
+# PIX_GERANDO) e faz commit ANTES de falar com o gateway. A cobrança é
+# criada no pool de pagamentos, sem transação aberta durante a chamada
+# HTTP; o QR Code é gravado quando chega e a tela da venda o busca
+# pelo endpoint de status.
+#
+# A chave de idempotência é fixa por venda: gerar de novo (retentativa
+# ou clique em "tentar novamente") devolve a mesma cobrança.
+#
+# Se o processo morrer no meio, a venda fica em PIX_GERANDO: depois de
+# PIX_GERANDO_LIMITE a tela mostra "tentar novamente" (pix_travado) e a
+# varredura (`flask pagamentos varrer-pendentes`) gera de novo.
+PIX_GERANDO = "gerando_pix"
+PIX_FALHOU = "falha_pix"
+PIX_GERANDO_LIMITE = timedelta(minutes=2)
+
+logger = logging.getLogger(__name__)
+
+
+def email_cliente(venda):
+    telefone = venda.cliente_telefone or venda.id
+    telefone = "".join(filter(str.isdigit, str(telefone)))
+
+    return f"cliente{telefone}@fitcell.com.br"
+
+
+def agendar_cobranca_pix(venda):
+    """
+    Marca a venda como gerando Pix. Chamar ANTES do commit da venda;
+    a tarefa só é enviada depois dele (enviar_cobranca_pix).
+    """
+
+    venda.pagamento_status = PIX_GERANDO
+    venda.pix_qr_code = None
+    venda.pix_qr_code_base64 = None
+
+    # conta o limite do PIX_GERANDO a partir daqui (mesmo se já estava travada)
+    venda.atualizado_em = utc_now_exato()
+
+
+def enviar_cobranca_pix(venda_id):
+    return enviar_tarefa_pagamento(gerar_cobranca_pix, venda_id)
+
+
+def pix_travado(pagamento_status, atualizado_em, limite=PIX_GERANDO_LIMITE):
+    """
+    True se a venda está "gerando Pix" há mais que o limite
+    (tarefa perdida: reinício / queda do processo).
+    """
+
+    if pagamento_status != PIX_GERANDO or not atualizado_em:
+        return False
+
+    # coluna sem fuso: o banco devolve naive (UTC)
+    if atualizado_em.tzinfo is None:
+        atualizado_em = atualizado_em.replace(tzinfo=UTC)
+
+    return utc_now() - atualizado_em >= limite
+
+
+def retomar_cobrancas_travadas(empresa_id=None, limite=PIX_GERANDO_LIMITE):
+    """
+    Gera de novo (nesta thread) as cobranças travadas em PIX_GERANDO.
+    Retorna um Counter: "pix_gerado" / "pix_falhou".
+    """
+
+    stmt = (
+        select(VendaPeca.id)
+        .where(
+            VendaPeca.status == "AGUARDANDO_PAGAMENTO",
+            VendaPeca.pagamento_status == PIX_GERANDO,
+            VendaPeca.atualizado_em <= utc_now() - limite
+        )
+        .order_by(VendaPeca.id)
+    )
+
+    if empresa_id:
+        stmt = stmt.where(VendaPeca.empresa_id == empresa_id)
+
+    vendas = db.session.scalars(stmt).all()
+    db.session.rollback()
+
+    resultados = Counter()
+    for venda_id in vendas:
+        logger.warning("Cobrança Pix da venda %s travada em %s: gerando de novo", venda_id, PIX_GERANDO)
+        gerado = gerar_cobranca_pix(venda_id)
+        resultados["pix_gerado" if gerado else "pix_falhou"] += 1
+
+    return resultados
+
+
+def gerar_cobranca_pix(venda_id):
+    """
+    Cria a cobrança no Mercado Pago e grava o QR Code na venda.
+    Roda no pool de pagamentos. Retorna True se o QR Code foi gravado.
+    """
+
+    venda = db.session.get(VendaPeca, venda_id)
+
+    if not venda or venda.status != "AGUARDANDO_PAGAMENTO" or venda.pix_qr_code:
+        db.session.rollback()
+        return False
+
+    empresa_id = venda.empresa_id
+    valor = venda.valor_total
+    descricao = f"Venda FITCELL #{venda.id}"
+    email = email_cliente(venda)
+
+    # nenhuma transação aberta enquanto espera o gateway
+    db.session.rollback()
+
+    try:
+        pagamento = MercadoPagoClient(empresa_id).criar_pagamento(
+            valor=valor,
+            descricao=descricao,
+            email=email,
+            chave_idempotencia=f"fitcell-venda-{venda_id}"
+        )
+        tx = (pagamento.get("point_of_interaction") or {}).get("transaction_data")
+    except PagamentoError:
+        logger.exception("Falha ao criar cobrança Pix da venda %s", venda_id)
+        pagamento, tx = None, None
+
+    venda = (
+        VendaPeca.query
+        .filter_by(id=venda_id)
+        .with_for_update()
+        .first()
+    )
+
+    # cancelada / paga enquanto a cobrança era criada
+    if not venda or venda.status != "AGUARDANDO_PAGAMENTO":
+        db.session.rollback()
+        return False
+
+    if not tx:
+        if pagamento:
+            logger.error("PIX não gerado para a venda %s: %s", venda_id, pagamento)
+
+        venda.pagamento_status = PIX_FALHOU
+        db.session.commit()
+        notificar_venda(venda_id)
+        return False
+
+    venda.pagamento_id = str(pagamento["id"])
+    venda.pagamento_status = pagamento["status"]
+    venda.pix_qr_code = tx.get("qr_code")
+    venda.pix_qr_code_base64 = tx.get("qr_code_base64")
+
+    db.session.commit()
+    notificar_venda(venda_id)
+    return True
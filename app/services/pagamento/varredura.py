@@ -0,0 +1,120 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import or_, select
+
+from app import db
+from app.models import VendaPeca
+from app.services.pagamento.confirmacao import confirmar_pagamento
+from app.services.pagamento.exceptions import PagamentoConfigNotFound, PagamentoError
+from app.services.pagamento.mercadopago_client import MercadoPagoClient
+from app.services.pagamento.pix import retomar_cobrancas_travadas
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# 🧹 VARREDURA DE PIX SEM CONFIRMAÇÃO
+# =====================================================
+# Rede de segurança para webhook perdido: consulta no Mercado Pago as
+# vendas AGUARDANDO_PAGAMENTO com pagamento_id e aplica o resultado pelo
+# mesmo caminho do webhook (confirmar_pagamento).
+#
+# Vendas agrupadas por empresa: um MercadoPagoClient por empresa (sessão
+# HTTP compartilhada). As consultas rodam em paralelo, até `concorrencia`
+# por vez, e só elas: nenhuma thread extra toca no banco. As escritas
+# voltam para a thread principal, uma venda por transação.
+#
+# Antes disso gera de novo as cobranças travadas em "gerando Pix"
+# (processo morreu com a tarefa na fila: ainda não há pagamento_id).
+#
+# Rodar pelo cron: `flask pagamentos varrer-pendentes`.
+IDADE_MINIMA = timedelta(minutes=5)    # deixa o webhook chegar primeiro
+IDADE_MAXIMA = timedelta(days=2)       # Pix expirado não vira aprovado
+CONCORRENCIA_PADRAO = 4
+
+# status do gateway que não viram "approved": não consulta de novo
+STATUS_FINAIS_MP = ("rejected", "cancelled", "refunded", "charged_back")
+
+logger = logging.getLogger(__name__)
+
+
+def vendas_pendentes(empresa_id=None, idade_minima=IDADE_MINIMA, idade_maxima=IDADE_MAXIMA):
+    """
+    {empresa_id: [(venda_id, pagamento_id), ...]}
+    """
+
+    agora = utc_now()
+
+    stmt = (
+        select(VendaPeca.empresa_id, VendaPeca.id, VendaPeca.pagamento_id)
+        .where(
+            VendaPeca.status == "AGUARDANDO_PAGAMENTO",
+            VendaPeca.pagamento_id.isnot(None),
+            VendaPeca.criado_em <= agora - idade_minima,
+            VendaPeca.criado_em >= agora - idade_maxima,
+            or_(
+                VendaPeca.pagamento_status.is_(None),
+                VendaPeca.pagamento_status.notin_(STATUS_FINAIS_MP)
+            )
+        )
+        .order_by(VendaPeca.empresa_id, VendaPeca.id)
+    )
+
+    if empresa_id:
+        stmt = stmt.where(VendaPeca.empresa_id == empresa_id)
+
+    pendentes = defaultdict(list)
+    for empresa, venda_id, pagamento_id in db.session.execute(stmt):
+        pendentes[empresa].append((venda_id, pagamento_id))
+
+    db.session.rollback()
+    return pendentes
+
+
+def varrer_pendentes(empresa_id=None, concorrencia=CONCORRENCIA_PADRAO,
+                     idade_minima=IDADE_MINIMA, idade_maxima=IDADE_MAXIMA):
+    """
+    Consulta e confirma os Pix pendentes. Retorna um Counter por resultado
+    (os de confirmar_pagamento + "erro_consulta" / "sem_config" e os de
+    retomar_cobrancas_travadas).
+    """
+
+    resultados = retomar_cobrancas_travadas(empresa_id)
+    pendentes = vendas_pendentes(empresa_id, idade_minima, idade_maxima)
+
+    if not pendentes:
+        return resultados
+
+    with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="varredura") as pool:
+        for empresa, vendas in pendentes.items():
+            try:
+                cliente = MercadoPagoClient(empresa)
+            except PagamentoConfigNotFound:
+                logger.warning("Empresa %s com Pix pendente e sem configuração do Mercado Pago", empresa)
+                resultados["sem_config"] += len(vendas)
+                continue
+
+            consultas = pool.map(
+                lambda venda: _consultar(cliente, venda[1]),
+                vendas
+            )
+
+            for (venda_id, pagamento_id), pagamento in zip(vendas, consultas):
+                if pagamento is None:
+                    resultados["erro_consulta"] += 1
+                    continue
+
+                resultados[confirmar_pagamento(venda_id, pagamento)] += 1
+
+    return resultados
+
+
+def _consultar(cliente, pagamento_id):
+    # roda nas threads do pool: só HTTP, sem sessão do banco
+    try:
+        return cliente.consultar_pagamento(pagamento_id)
+    except PagamentoError:
+        logger.exception("Falha ao consultar o pagamento %s na varredura", pagamento_id)
+        return None
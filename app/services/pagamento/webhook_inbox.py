@@ -0,0 +1,329 @@
+import logging
+import threading
+from datetime import UTC, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import VendaPeca, WebhookPagamento
+from app.services.pagamento.confirmacao import confirmar_pagamento
+from app.services.pagamento.mercadopago_client import MercadoPagoClient
+from app.tarefas import enviar_tarefa_pagamento
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# 📥 CAIXA DE ENTRADA DOS WEBHOOKS (MERCADO PAGO)
+# =====================================================
+# O webhook só grava o aviso (uma linha por pagamento, avisos repetidos
+# viram +1 em `recebimentos`) e responde 200 na hora. O processamento:
+#   - no pool de pagamentos do próprio processo (WEBHOOK_WORKER_EMBUTIDO), e/ou
+#   - pelo `flask pagamentos processar-webhooks` (processo separado)
+#
+# Cada lote é reservado com SKIP LOCKED e o commit da reserva acontece
+# ANTES da consulta ao gateway: nenhum lock fica aberto durante o HTTP.
+# A venda só é travada depois, em confirmar_pagamento.
+#
+# No modo embutido, falhas com nova tentativa marcada agendam um timer
+# para a próxima drenagem (não esperam outro aviso chegar). Avisos
+# travados em PROCESSANDO (processo morto no meio) voltam para a fila
+# pelo cron `flask pagamentos varrer-pendentes`.
+LOTE_PADRAO = 20
+TENTATIVAS_MAX = 5
+ESPERA_ENTRE_TENTATIVAS = timedelta(seconds=30)   # multiplicada pela tentativa
+PROCESSANDO_EXPIRA = timedelta(minutes=10)
+
+_agendado = False
+_temporizador = None   # próxima drenagem das retentativas (modo embutido)
+_agendado_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# =====================================================
+# NA REQUISIÇÃO DO WEBHOOK
+# =====================================================
+def registrar_aviso(pagamento_id):
+    """
+    Grava (ou reabre) o aviso do pagamento e faz commit.
+    Aviso durante o processamento não interrompe o worker: ele vê
+    `recebimentos` diferente no fim e devolve a linha para a fila.
+    """
+
+    agora = utc_now()
+    tabela = WebhookPagamento
+    processando = tabela.status == "PROCESSANDO"
+
+    stmt = pg_insert(tabela).values(
+        pagamento_id=str(pagamento_id),
+        status="PENDENTE",
+        recebimentos=1,
+        tentativas=0,
+        recebido_em=agora,
+        disponivel_em=agora
+    )
+
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["pagamento_id"],
+            set_={
+                "recebimentos": tabela.recebimentos + 1,
+                "recebido_em": agora,
+                "disponivel_em": agora,
+                "status": case((processando, tabela.status), else_="PENDENTE"),
+                "tentativas": case((processando, tabela.tentativas), else_=0)
+            }
+        )
+    )
+
+    db.session.commit()
+
+
+def agendar_processamento():
+    """
+    Drena a caixa de entrada no pool de pagamentos. No máximo uma drenagem
+    na fila por processo: uma rajada de avisos não enche o pool.
+    """
+
+    global _agendado
+
+    if not current_app.config.get("WEBHOOK_WORKER_EMBUTIDO", True):
+        return
+
+    with _agendado_lock:
+        if _agendado:
+            return
+        _agendado = True
+
+    enviar_tarefa_pagamento(_drenar)
+
+
+def _drenar():
+    global _agendado
+
+    # avisos gravados a partir daqui agendam outra drenagem
+    with _agendado_lock:
+        _agendado = False
+
+    processar_avisos()
+    _agendar_retentativas(current_app._get_current_object())
+
+
+def _agendar_retentativas(app):
+    """
+    Timer para quando vencer a próxima retentativa PENDENTE (se houver).
+    Um timer por processo: ao disparar, a drenagem agenda o seguinte.
+    """
+
+    global _temporizador
+
+    proxima = db.session.scalar(
+        select(func.min(WebhookPagamento.disponivel_em))
+        .where(WebhookPagamento.status == "PENDENTE")
+    )
+    db.session.rollback()
+
+    if proxima is None:
+        return
+
+    # coluna sem fuso: o banco devolve naive (UTC)
+    if proxima.tzinfo is None:
+        proxima = proxima.replace(tzinfo=UTC)
+
+    espera = max((proxima - utc_now()).total_seconds(), 0) + 1
+
+    with _agendado_lock:
+        if _temporizador is not None:
+            return
+
+        _temporizador = threading.Timer(espera, _retomar, [app])
+        _temporizador.daemon = True
+        _temporizador.start()
+
+
+def _retomar(app):
+    global _temporizador
+
+    with _agendado_lock:
+        _temporizador = None
+
+    with app.app_context():
+        agendar_processamento()
+
+
+# =====================================================
+# NO WORKER
+# =====================================================
+def processar_avisos(lote=LOTE_PADRAO):
+    """
+    Processa lotes até a fila ficar vazia. Retorna quantos avisos tratou.
+    """
+
+    total = 0
+
+    while True:
+        qtd = processar_lote(lote)
+        total += qtd
+
+        if qtd < lote:
+            return total
+
+
+def processar_lote(lote=LOTE_PADRAO):
+    avisos = _reservar(lote)
+
+    for aviso_id, pagamento_id, recebimentos, tentativas in avisos:
+        try:
+            resultado = _processar(pagamento_id)
+        except Exception as e:
+            logger.exception("Falha ao processar webhook do pagamento %s", pagamento_id)
+            db.session.rollback()
+            _falhou(aviso_id, tentativas, e)
+            continue
+
+        _concluir(aviso_id, recebimentos, resultado)
+
+    return len(avisos)
+
+
+def _reservar(lote):
+    """
+    Passa até `lote` avisos PENDENTES para PROCESSANDO (SKIP LOCKED entre
+    workers) e faz commit. Devolve (id, pagamento_id, recebimentos, tentativas).
+    """
+
+    agora = utc_now()
+
+    ids = db.session.execute(
+        select(WebhookPagamento.id)
+        .where(
+            WebhookPagamento.status == "PENDENTE",
+            WebhookPagamento.disponivel_em <= agora
+        )
+        .order_by(WebhookPagamento.id)
+        .limit(lote)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    if not ids:
+        db.session.rollback()
+        return []
+
+    avisos = db.session.execute(
+        update(WebhookPagamento)
+        .where(WebhookPagamento.id.in_(ids))
+        .values(
+            status="PROCESSANDO",
+            iniciado_em=agora,
+            tentativas=WebhookPagamento.tentativas + 1
+        )
+        .returning(
+            WebhookPagamento.id,
+            WebhookPagamento.pagamento_id,
+            WebhookPagamento.recebimentos,
+            WebhookPagamento.tentativas
+        )
+    ).all()
+
+    db.session.commit()
+
+    return sorted(avisos)
+
+
+def _processar(pagamento_id):
+    venda = (
+        VendaPeca.query
+        .filter_by(pagamento_id=pagamento_id)
+        .first()
+    )
+
+    if not venda:
+        db.session.rollback()
+        return "venda_nao_encontrada"
+
+    # aviso repetido de venda já resolvida: nem consulta o gateway
+    if venda.status == "FINALIZADA":
+        db.session.rollback()
+        return "ja_processado"
+
+    if venda.status == "CANCELADA":
+        db.session.rollback()
+        return "cancelada"
+
+    venda_id = venda.id
+    empresa_id = venda.empresa_id
+
+    # nenhuma transação aberta enquanto espera o gateway
+    db.session.rollback()
+
+    pagamento = MercadoPagoClient(empresa_id).consultar_pagamento(pagamento_id)
+
+    resultado = confirmar_pagamento(venda_id, pagamento)
+
+    if resultado == "valor_divergente":
+        logger.error(
+            "Valor divergente no pagamento %s (venda %s): %s",
+            pagamento_id, venda_id, pagamento.get("transaction_amount")
+        )
+
+    return resultado
+
+
+def _concluir(aviso_id, recebimentos, resultado):
+    # chegou outro aviso enquanto processava: volta para a fila
+    reaberto = WebhookPagamento.recebimentos != recebimentos
+    status = "ERRO" if resultado == "valor_divergente" else "PROCESSADO"
+
+    db.session.execute(
+        update(WebhookPagamento)
+        .where(WebhookPagamento.id == aviso_id)
+        .values(
+            status=case((reaberto, "PENDENTE"), else_=status),
+            resultado=resultado,
+            erro=None,
+            processado_em=utc_now()
+        )
+    )
+
+    db.session.commit()
+
+
+def _falhou(aviso_id, tentativas, erro):
+    """
+    Gateway fora / erro inesperado: tenta de novo com espera crescente,
+    até TENTATIVAS_MAX. Um aviso novo do mesmo pagamento reabre a linha.
+    """
+
+    esgotou = tentativas >= TENTATIVAS_MAX
+
+    db.session.execute(
+        update(WebhookPagamento)
+        .where(WebhookPagamento.id == aviso_id)
+        .values(
+            status="ERRO" if esgotou else "PENDENTE",
+            erro=str(erro)[:1000],
+            disponivel_em=utc_now() + ESPERA_ENTRE_TENTATIVAS * tentativas
+        )
+    )
+
+    db.session.commit()
+
+
+def liberar_travados():
+    """
+    Devolve para a fila avisos PROCESSANDO há muito tempo (worker morto no meio).
+    """
+
+    liberados = db.session.execute(
+        update(WebhookPagamento)
+        .where(
+            WebhookPagamento.status == "PROCESSANDO",
+            WebhookPagamento.iniciado_em < utc_now() - PROCESSANDO_EXPIRA
+        )
+        .values(status="PENDENTE")
+    ).rowcount
+
+    db.session.commit()
+    return liberados
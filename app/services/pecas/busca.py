@@ -0,0 +1,125 @@
+from sqlalchemy import and_, bindparam, func, literal, or_, select, text, update
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import Peca
+from app.utils_busca import escapar_like, normalizar_busca
+
+
+# =====================================================
+# 🔎 BUSCA DE PEÇAS
+# =====================================================
+# Tudo sobre Peca.busca_texto (já normalizado):
+#   PostgreSQL -> ILIKE por palavra + similaridade (pg_trgm), os dois
+#                 atendidos pelo índice GIN ix_fitcell_peca_busca_trgm,
+#                 ordenado pela similaridade com o termo
+#   outros     -> LIKE por palavra (bancos de teste / SQLite)
+LIMITE_SUGESTOES = 10
+
+
+def _postgres():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def filtrar_pecas(query, busca):
+    """
+    Aplica a busca (filtro + ordenação por relevância) numa query que já tem Peca.
+    Retorna (query, ordenada): ordenada=False quando o chamador deve definir a ordem.
+    """
+
+    termo = normalizar_busca(busca)
+
+    if not termo:
+        return query, False
+
+    palavras = [
+        Peca.busca_texto.like(f"%{escapar_like(p)}%", escape="\\")
+        for p in termo.split()
+    ]
+
+    if not _postgres():
+        return query.filter(and_(*palavras)), False
+
+    # word_similarity: o termo parecido com ALGUM trecho do texto
+    # (aceita erro de digitação: "tela samsumg" acha "Tela Samsung")
+    parecido = literal(termo).op("<%")(Peca.busca_texto)
+
+    query = (
+        query
+        .filter(or_(and_(*palavras), parecido))
+        .order_by(
+            func.word_similarity(termo, Peca.busca_texto).desc(),
+            Peca.id.desc()
+        )
+    )
+
+    return query, True
+
+
+def sugerir_pecas(empresa_id, busca, limite=LIMITE_SUGESTOES):
+    """
+    Peças mais relevantes para o typeahead.
+    """
+
+    if not normalizar_busca(busca):
+        return []
+
+    query, ordenada = filtrar_pecas(
+        Peca.query
+        .options(joinedload(Peca.tipo))
+        .filter(Peca.empresa_id == empresa_id, Peca.ativo == True),
+        busca
+    )
+
+    if not ordenada:
+        query = query.order_by(Peca.id.desc())
+
+    return query.limit(limite).all()
+
+
+def indexar_busca(lote=1000):
+    """
+    Cria pg_trgm + índice GIN (se faltarem) e recalcula busca_texto
+    de todas as peças. Não faz commit. Retorna a quantidade de peças.
+    """
+
+    from app.models import TipoPeca
+    from app.utils_busca import montar_busca_texto
+
+    if _postgres():
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_fitcell_peca_busca_trgm "
+            "ON fitcell_peca USING gin (busca_texto gin_trgm_ops)"
+        ))
+
+    tipos = dict(db.session.query(TipoPeca.id, TipoPeca.nome).all())
+
+    linhas = db.session.execute(
+        select(
+            Peca.id, Peca.codigo_interno, Peca.nome, Peca.marca_peca,
+            Peca.qualidade, Peca.tipo_peca_id
+        )
+    ).all()
+
+    valores = [
+        {
+            "b_id": l.id,
+            "b_texto": montar_busca_texto(
+                l.codigo_interno, l.nome, l.marca_peca,
+                (l.qualidade or "").replace("_", " "), tipos.get(l.tipo_peca_id)
+            )
+        }
+        for l in linhas
+    ]
+
+    stmt = (
+        update(Peca.__table__)
+        .where(Peca.__table__.c.id == bindparam("b_id"))
+        .values(busca_texto=bindparam("b_texto"))
+    )
+
+    for i in range(0, len(valores), lote):
+        db.session.execute(stmt, valores[i:i + lote])
+
+    return len(valores)
@@ -0,0 +1,139 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import select
+
+from app import db
+from app.models import CompatibilidadePeca, Empresa, Peca
+
+
+# =====================================================
+# 📱 ÍNDICE DE COMPATIBILIDADE (MODELO -> PEÇAS)
+# =====================================================
+# Uma estrutura compacta por empresa, no formato CSR:
+#   modelos  -> ids de modelo, ordenados
+#   inicios  -> modelos[i] usa pecas[inicios[i]:inicios[i + 1]]
+#   pecas    -> ids de peça, do mais novo para o mais antigo
+#
+# Montada na primeira consulta e guardada com a chave
+# (empresa_id, Empresa.compat_versao). A versão é incrementada na
+# mesma transação que altera CompatibilidadePeca, então outro
+# processo/thread nunca usa um índice antigo.
+#
+# O índice guarda peças ativas e inativas; o filtro de ativo
+# acontece ao carregar as peças (por chave primária).
+_indices = {}   # empresa_id -> (versao, IndiceCompatibilidade)
+_indices_lock = threading.Lock()
+
+
+class IndiceCompatibilidade:
+
+    def __init__(self, pares):
+        """
+        pares: (modelo_id, peca_id) ordenados por modelo e peça (desc).
+        """
+
+        self.modelos = array("l")
+        self.inicios = array("l")
+        self.pecas = array("l")
+
+        anterior = None
+        for modelo_id, peca_id in pares:
+            if modelo_id != anterior:
+                self.modelos.append(modelo_id)
+                self.inicios.append(len(self.pecas))
+                anterior = modelo_id
+            self.pecas.append(peca_id)
+
+        self.inicios.append(len(self.pecas))
+
+    def pecas_do_modelo(self, modelo_id):
+        i = bisect_left(self.modelos, modelo_id)
+
+        if i == len(self.modelos) or self.modelos[i] != modelo_id:
+            return []
+
+        return self.pecas[self.inicios[i]:self.inicios[i + 1]].tolist()
+
+
+def _montar(empresa_id):
+    pares = db.session.execute(
+        select(CompatibilidadePeca.modelo_celular_id, CompatibilidadePeca.peca_id)
+        .join(Peca, Peca.id == CompatibilidadePeca.peca_id)
+        .where(Peca.empresa_id == empresa_id)
+        .order_by(CompatibilidadePeca.modelo_celular_id, CompatibilidadePeca.peca_id.desc())
+    )
+
+    return IndiceCompatibilidade(pares)
+
+
+def _versao_atual(empresa_id):
+    from app.utils_principal import principal_atual
+
+    # a empresa do usuário já veio carregada na requisição
+    principal = principal_atual()
+    if principal and principal.empresa and principal.empresa.id == empresa_id:
+        return principal.empresa.compat_versao or 0
+
+    return db.session.query(Empresa.compat_versao).filter_by(id=empresa_id).scalar() or 0
+
+
+def indice_compatibilidade(empresa_id):
+    versao = _versao_atual(empresa_id)
+
+    with _indices_lock:
+        atual = _indices.get(empresa_id)
+
+    if atual and atual[0] == versao:
+        return atual[1]
+
+    # montagem fora do lock: duas threads podem montar a mesma versão,
+    # o resultado é idêntico
+    indice = _montar(empresa_id)
+
+    with _indices_lock:
+        guardado = _indices.get(empresa_id)
+        if not guardado or guardado[0] <= versao:
+            _indices[empresa_id] = (versao, indice)
+
+    return indice
+
+
+def ids_compativeis(empresa_id, modelo_id):
+    return indice_compatibilidade(empresa_id).pecas_do_modelo(modelo_id)
+
+
+def pecas_compativeis(empresa_id, modelo_id, somente_ativas=True):
+    """
+    Peças do modelo (mais novas primeiro), buscadas pelos ids do índice.
+    """
+
+    ids = ids_compativeis(empresa_id, modelo_id)
+
+    if not ids:
+        return []
+
+    query = Peca.query.filter(Peca.empresa_id == empresa_id, Peca.id.in_(ids))
+
+    if somente_ativas:
+        query = query.filter(Peca.ativo == True)
+
+    return query.order_by(Peca.id.desc()).all()
+
+
+def invalidar_compatibilidade(empresa_id):
+    """
+    Incrementa a versão do índice da empresa.
+
+    Chamar ANTES do commit que altera CompatibilidadePeca, para que a
+    nova versão e as novas compatibilidades fiquem visíveis juntas.
+    """
+
+    Empresa.query.filter_by(id=empresa_id).update(
+        {Empresa.compat_versao: Empresa.compat_versao + 1},
+        synchronize_session=False
+    )
+
+    with _indices_lock:
+        _indices.pop(empresa_id, None)
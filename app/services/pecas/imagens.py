@@ -0,0 +1,63 @@
+import logging
+import os
+
+from flask import current_app
+
+from app import db
+from app.models import Peca
+from app.utils_imagens import ImagemInvalida, imagem_variante
+from app.utils_uploads import gravar_imagem
+
+
+# =====================================================
+# 🖼️ CONVERSÃO DAS FOTOS ANTIGAS
+# =====================================================
+# Peças cadastradas antes do pipeline apontam para o arquivo original
+# (JPEG/PNG do celular). Grava o WebP + miniaturas como um upload novo
+# (endereçado pelo conteúdo, com referência) e troca Peca.imagem. O
+# original fica no disco: o nome não era único ("image.jpg") e outra
+# peça pode apontar para o mesmo arquivo.
+logger = logging.getLogger(__name__)
+
+
+def otimizar_imagens(lote=100):
+    """
+    Converte as imagens de todas as peças que ainda não têm variantes.
+    Retorna (convertidas, falhas).
+    """
+
+    convertidas = falhas = 0
+    ultimo_id = 0
+
+    while True:
+        pecas = (
+            Peca.query
+            .filter(Peca.id > ultimo_id, Peca.imagem.isnot(None), Peca.imagem != "")
+            .order_by(Peca.id)
+            .limit(lote)
+            .all()
+        )
+
+        if not pecas:
+            return convertidas, falhas
+
+        ultimo_id = pecas[-1].id
+
+        for peca in pecas:
+            # já é do pipeline
+            if imagem_variante(peca.imagem, "p") != peca.imagem:
+                continue
+
+            original = os.path.join(current_app.static_folder, peca.imagem)
+
+            try:
+                with open(original, "rb") as arquivo:
+                    peca.imagem = gravar_imagem(arquivo, "pecas", peca.empresa_id)
+            except (ImagemInvalida, FileNotFoundError):
+                logger.warning("Imagem da peça %s não convertida: %s", peca.id, peca.imagem)
+                falhas += 1
+                continue
+
+            convertidas += 1
+
+        db.session.commit()
@@ -0,0 +1,250 @@
+import csv
+import io
+import os
+import tempfile
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+from sqlalchemy import func, or_, select
+
+from app import db
+from app.models import (
+    CompraEstoque, CompraEstoqueItem, EstoqueMovimentacao, Fornecedor, Peca, VendaPeca, VendaPecaItem
+)
+from app.utils_datetime import utc_to_br
+
+
+# =====================================================
+# 📤 EXPORTAÇÃO CSV / XLSX EM STREAMING
+# =====================================================
+# As consultas devolvem tuplas simples lidas por cursor no servidor
+# (yield_per): nenhuma lista com o período inteiro fica em memória.
+#   - CSV: cada bloco de linhas vai direto para a resposta
+#   - XLSX: xlsxwriter em constant_memory (cada linha vai para o disco
+#     assim que a seguinte começa) grava num arquivo temporário, que é
+#     enviado em blocos e apagado no fim
+YIELD_PER = 1000
+BLOCO_BYTES = 64 * 1024
+
+FORMATOS = ("csv", "xlsx")
+
+# Texto livre (cliente, observação, nome de peça) começando com um destes
+# vira fórmula ao abrir no Excel / LibreOffice: a célula sai com ' na frente
+INICIO_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _data_hora(dt):
+    return utc_to_br(dt).strftime("%d/%m/%Y %H:%M") if dt else ""
+
+
+def _celula_csv(valor):
+    if isinstance(valor, (float, Decimal)):
+        return str(valor).replace(".", ",")
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _stream(stmt):
+    return db.session.execute(stmt, execution_options={"yield_per": YIELD_PER})
+
+
+# =====================================================
+# CONSULTAS
+# =====================================================
+def linhas_vendas(empresa_id, dt_ini=None, dt_fim=None):
+    subtotal = (
+        select(func.coalesce(func.sum(VendaPecaItem.valor_total), 0))
+        .where(VendaPecaItem.venda_id == VendaPeca.id)
+        .correlate(VendaPeca)
+        .scalar_subquery()
+    )
+
+    stmt = (
+        select(
+            VendaPeca.id,
+            VendaPeca.criado_em,
+            VendaPeca.cliente_nome,
+            VendaPeca.cliente_telefone,
+            VendaPeca.tipo_pagamento,
+            VendaPeca.status,
+            subtotal,
+            VendaPeca.desconto,
+            VendaPeca.valor_total
+        )
+        .where(VendaPeca.empresa_id == empresa_id)
+        .order_by(VendaPeca.criado_em, VendaPeca.id)
+    )
+
+    if dt_ini:
+        stmt = stmt.where(VendaPeca.criado_em >= dt_ini)
+    if dt_fim:
+        stmt = stmt.where(VendaPeca.criado_em <= dt_fim)
+
+    yield ["Venda", "Data", "Cliente", "Telefone", "Pagamento", "Status", "Subtotal", "Desconto", "Total"]
+
+    for id_, criado_em, cliente, telefone, pagamento, status, sub, desconto, total in _stream(stmt):
+        yield [
+            id_, _data_hora(criado_em), cliente or "", telefone or "", pagamento or "",
+            status or "", sub or 0, desconto or 0, total or 0
+        ]
+
+
+def linhas_compras(empresa_id, dt_ini=None, dt_fim=None, fornecedor_id=None):
+    total = (
+        select(func.coalesce(func.sum(CompraEstoqueItem.quantidade * CompraEstoqueItem.custo_unitario), 0))
+        .where(CompraEstoqueItem.compra_id == CompraEstoque.id)
+        .correlate(CompraEstoque)
+        .scalar_subquery()
+    )
+
+    stmt = (
+        select(
+            CompraEstoque.id,
+            CompraEstoque.criado_em,
+            Fornecedor.nome,
+            CompraEstoque.status,
+            total
+        )
+        .join(Fornecedor, Fornecedor.id == CompraEstoque.fornecedor_id)
+        .where(CompraEstoque.empresa_id == empresa_id)
+        .order_by(CompraEstoque.criado_em, CompraEstoque.id)
+    )
+
+    if fornecedor_id:
+        stmt = stmt.where(CompraEstoque.fornecedor_id == fornecedor_id)
+    if dt_ini:
+        stmt = stmt.where(CompraEstoque.criado_em >= dt_ini)
+    if dt_fim:
+        stmt = stmt.where(CompraEstoque.criado_em <= dt_fim)
+
+    yield ["Compra", "Data", "Fornecedor", "Status", "Total"]
+
+    for id_, criado_em, fornecedor, status, valor in _stream(stmt):
+        yield [id_, _data_hora(criado_em), fornecedor or "", status or "", valor or 0]
+
+
+def linhas_movimentacoes(empresa_id, dt_ini=None, dt_fim=None, tipo=None, busca=None):
+    stmt = (
+        select(
+            EstoqueMovimentacao.id,
+            EstoqueMovimentacao.criado_em,
+            Peca.codigo_interno,
+            Peca.nome,
+            Fornecedor.nome,
+            EstoqueMovimentacao.tipo,
+            EstoqueMovimentacao.quantidade,
+            EstoqueMovimentacao.observacao
+        )
+        .join(Peca, Peca.id == EstoqueMovimentacao.peca_id)
+        .outerjoin(Fornecedor, Fornecedor.id == EstoqueMovimentacao.fornecedor_id)
+        .where(EstoqueMovimentacao.empresa_id == empresa_id)
+        .order_by(EstoqueMovimentacao.criado_em, EstoqueMovimentacao.id)
+    )
+
+    if tipo:
+        stmt = stmt.where(EstoqueMovimentacao.tipo == tipo)
+    if busca:
+        # mesmo filtro da listagem (fitcell_listar_movimentacoes_estoque)
+        b = f"%{busca}%"
+        stmt = stmt.where(
+            or_(
+                Peca.codigo_interno.ilike(b),
+                Peca.marca_peca.ilike(b),
+                EstoqueMovimentacao.observacao.ilike(b)
+            )
+        )
+    if dt_ini:
+        stmt = stmt.where(EstoqueMovimentacao.criado_em >= dt_ini)
+    if dt_fim:
+        stmt = stmt.where(EstoqueMovimentacao.criado_em <= dt_fim)
+
+    yield ["Movimentação", "Data", "Código", "Peça", "Fornecedor", "Tipo", "Quantidade", "Observação"]
+
+    for id_, criado_em, codigo, nome, fornecedor, tipo_mov, quantidade, observacao in _stream(stmt):
+        yield [
+            id_, _data_hora(criado_em), codigo or "", nome or "", fornecedor or "",
+            tipo_mov, quantidade, observacao or ""
+        ]
+
+
+# =====================================================
+# RESPOSTAS
+# =====================================================
+def _cabecalhos(nome_arquivo):
+    return {
+        "Content-Disposition": f"attachment; filename={nome_arquivo}",
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    }
+
+
+def resposta_exportacao(formato, nome_base, linhas):
+    if formato == "xlsx":
+        return resposta_xlsx(f"{nome_base}.xlsx", linhas)
+    return resposta_csv(f"{nome_base}.csv", linhas)
+
+
+def resposta_csv(nome_arquivo, linhas, linhas_por_bloco=500):
+    """
+    CSV separado por ';' com BOM (abre certo no Excel em português).
+    """
+
+    def gerar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer, delimiter=";")
+        buffer.write("\ufeff")
+
+        for i, linha in enumerate(linhas, 1):
+            escritor.writerow([_celula_csv(v) for v in linha])
+
+            if i % linhas_por_bloco == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="text/csv; charset=utf-8",
+        headers=_cabecalhos(nome_arquivo)
+    )
+
+
+def resposta_xlsx(nome_arquivo, linhas):
+    """
+    XLSX em constant_memory (memória constante) num arquivo temporário.
+    As linhas precisam ser escritas em ordem: é o que o gerador faz.
+    """
+
+    import xlsxwriter
+
+    def gerar():
+        fd, caminho = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+
+        try:
+            # strings_to_formulas: texto com "=" no início é gravado como texto
+            wb = xlsxwriter.Workbook(caminho, {"constant_memory": True, "strings_to_formulas": False})
+            ws = wb.add_worksheet()
+
+            for i, linha in enumerate(linhas):
+                ws.write_row(i, 0, linha)
+
+            wb.close()
+
+            with open(caminho, "rb") as f:
+                while True:
+                    bloco = f.read(BLOCO_BYTES)
+                    if not bloco:
+                        break
+                    yield bloco
+        finally:
+            os.remove(caminho)
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=_cabecalhos(nome_arquivo)
+    )
@@ -0,0 +1,419 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from flask import current_app, make_response, render_template, request, send_file
+from flask_login import current_user
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import (
+    CompraEstoque, EstoqueMovimentacao, RelatorioJob, VendaPeca, VendaResumoDiario
+)
+from app.tarefas import enviar_tarefa
+from app.utils_datetime import utc_now
+
+
+# =====================================================
+# 📄 FILA DE PDF (WEASYPRINT FORA DA REQUISIÇÃO)
+# =====================================================
+# A rota monta o HTML (rápido, precisa do request) e grava um
+# RelatorioJob. O PDF é renderizado:
+#   - no pool de tarefas do próprio processo (RELATORIOS_WORKER_EMBUTIDO), ou
+#   - pelo `flask relatorios worker` (processo separado)
+#
+# O arquivo fica em UPLOAD_ROOT/empresas/<id>/relatorios/<chave>.pdf e
+# é reaproveitado enquanto a versão dos dados não mudar. Quando a versão
+# nova do mesmo pedido (grupo) fica pronta, as anteriores são apagadas;
+# o resto sai pelo `flask relatorios limpar` (jobs com mais de N dias).
+ESPERA_PADRAO_SEGUNDOS = 3
+PROCESSANDO_EXPIRA = timedelta(minutes=10)
+RETENCAO_PADRAO = timedelta(days=7)
+
+# permissão exigida para baixar / acompanhar cada relatório
+PERMISSOES_RELATORIO = {
+    "compras_estoque": ("estoque", "ver"),
+    "vendas_pecas": ("venda", "ver"),
+    "compra_venda": ("administrativo", "ver"),
+    "recibo_venda": ("venda", "ver"),
+    "recibo_orcamento": ("venda", "ver"),
+}
+
+_concluidos = {}   # job_id -> threading.Event (jobs deste processo)
+_concluidos_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# =====================================================
+# CHAVE / VERSÃO
+# =====================================================
+def versao_dados_empresa(empresa_id):
+    """
+    Muda sempre que uma venda, compra ou movimentação da empresa muda.
+    """
+
+    linha = db.session.query(
+        select(func.max(VendaPeca.atualizado_em))
+        .where(VendaPeca.empresa_id == empresa_id).scalar_subquery(),
+        select(func.max(VendaPeca.id))
+        .where(VendaPeca.empresa_id == empresa_id).scalar_subquery(),
+        select(func.max(CompraEstoque.id))
+        .where(CompraEstoque.empresa_id == empresa_id).scalar_subquery(),
+        select(func.max(EstoqueMovimentacao.id))
+        .where(EstoqueMovimentacao.empresa_id == empresa_id).scalar_subquery(),
+        select(func.max(VendaResumoDiario.atualizado_em))
+        .where(VendaResumoDiario.empresa_id == empresa_id).scalar_subquery()
+    ).one()
+
+    return "|".join(str(v) for v in linha)
+
+
+def chave_relatorio(empresa_id, relatorio, params, versao):
+    """
+    HMAC (SECRET_KEY) dos dados do pedido: também é o nome do arquivo,
+    então não pode ser adivinhado a partir dos parâmetros.
+    """
+
+    return _hmac([empresa_id, relatorio, params, versao])
+
+
+def grupo_relatorio(empresa_id, relatorio, params):
+    """
+    Como chave_relatorio, sem a versão: identifica o mesmo pedido em
+    versões diferentes dos dados.
+    """
+
+    return _hmac([empresa_id, relatorio, params])
+
+
+def _hmac(dados):
+    conteudo = json.dumps(
+        dados,
+        sort_keys=True,
+        default=str
+    )
+
+    return hmac.new(
+        current_app.config["SECRET_KEY"].encode(),
+        conteudo.encode(),
+        hashlib.sha256
+    ).hexdigest()
+
+
+def caminho_absoluto(job):
+    return os.path.join(current_app.config["UPLOAD_ROOT"], job.arquivo)
+
+
+def pdf_disponivel(job):
+    return job.status == "PRONTO" and job.arquivo and os.path.exists(caminho_absoluto(job))
+
+
+# =====================================================
+# NA REQUISIÇÃO
+# =====================================================
+def obter_pdf(relatorio, params, versao, montar_html, nome_arquivo, referencia=None):
+    """
+    Resposta para um pedido de PDF:
+      - arquivo já gerado para a mesma versão -> envia na hora
+      - senão cria/reaproveita o job, espera alguns segundos e,
+        se ainda não terminou, mostra a página de espera.
+
+    montar_html() só é chamado quando o PDF precisa ser gerado.
+    """
+
+    empresa_id = current_user.empresa_id
+    chave = chave_relatorio(empresa_id, relatorio, params, versao)
+    grupo = grupo_relatorio(empresa_id, relatorio, params)
+
+    job = RelatorioJob.query.filter_by(chave=chave).first()
+
+    if job and pdf_disponivel(job):
+        return enviar_pdf(job)
+
+    if not job or job.status in ("ERRO", "PRONTO"):
+        job = _enfileirar(job, empresa_id, relatorio, chave, grupo, nome_arquivo, montar_html(), referencia)
+
+    aguardar_job(job.id, current_app.config.get("RELATORIOS_ESPERA_SEGUNDOS", ESPERA_PADRAO_SEGUNDOS))
+
+    db.session.refresh(job)
+
+    if pdf_disponivel(job):
+        return enviar_pdf(job)
+
+    # Response (e não str): quem chama pode olhar mimetype / headers
+    return make_response(render_template("fitcell/relatorios/aguardando.html", job=job))
+
+
+def _enfileirar(job, empresa_id, relatorio, chave, grupo, nome_arquivo, html, referencia):
+    if job is None:
+        job = RelatorioJob(
+            empresa_id=empresa_id,
+            relatorio=relatorio,
+            chave=chave,
+            grupo=grupo,
+            nome_arquivo=nome_arquivo,
+            referencia=referencia
+        )
+        db.session.add(job)
+
+    # ERRO / arquivo apagado: gera de novo
+    job.html = html
+    job.base_url = request.url_root
+    job.status = "PENDENTE"
+    job.arquivo = None
+    job.erro = None
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # outro clique criou o mesmo job ao mesmo tempo
+        db.session.rollback()
+        return RelatorioJob.query.filter_by(chave=chave).one()
+
+    if current_app.config.get("RELATORIOS_WORKER_EMBUTIDO", True):
+        _evento(job.id)
+        enviar_tarefa(processar_job, job.id)
+
+    return job
+
+
+def enviar_pdf(job):
+    resposta = send_file(
+        caminho_absoluto(job),
+        mimetype="application/pdf",
+        download_name=job.nome_arquivo,
+        conditional=True,
+        max_age=0
+    )
+    resposta.headers["Cache-Control"] = "private, no-cache"
+    return resposta
+
+
+def _evento(job_id):
+    with _concluidos_lock:
+        return _concluidos.setdefault(job_id, threading.Event())
+
+
+def aguardar_job(job_id, segundos):
+    """
+    Espera o job terminar neste processo (no máximo `segundos`).
+    Jobs do worker externo não sinalizam: a página de espera faz o polling.
+    """
+
+    with _concluidos_lock:
+        evento = _concluidos.get(job_id)
+
+    if evento and segundos:
+        evento.wait(segundos)
+
+
+# =====================================================
+# NO WORKER
+# =====================================================
+def _reservar(job_id=None):
+    """
+    Passa um job PENDENTE para PROCESSANDO (atômico) e devolve o id.
+    Sem job_id: o próximo da fila (SKIP LOCKED entre workers).
+    """
+
+    if job_id is None:
+        job_id = db.session.execute(
+            select(RelatorioJob.id)
+            .where(RelatorioJob.status == "PENDENTE")
+            .order_by(RelatorioJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+    reservado = db.session.execute(
+        update(RelatorioJob)
+        .where(RelatorioJob.id == job_id, RelatorioJob.status == "PENDENTE")
+        .values(status="PROCESSANDO", iniciado_em=utc_now())
+    ).rowcount
+
+    db.session.commit()
+
+    return job_id if reservado else None
+
+
+def processar_job(job_id=None):
+    """
+    Renderiza um job (ou o próximo da fila). Retorna o id processado ou None.
+    """
+
+    from weasyprint import HTML
+
+    job_id = _reservar(job_id)
+
+    if job_id is None:
+        return None
+
+    job = db.session.get(RelatorioJob, job_id)
+
+    try:
+        pdf = HTML(string=job.html, base_url=job.base_url).write_pdf()
+
+        relativo = os.path.join("empresas", str(job.empresa_id), "relatorios", f"{job.chave}.pdf")
+        destino = os.path.join(current_app.config["UPLOAD_ROOT"], relativo)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+        # grava e renomeia: quem lê nunca vê arquivo pela metade
+        temporario = f"{destino}.{threading.get_ident()}.tmp"
+        with open(temporario, "wb") as f:
+            f.write(pdf)
+        os.replace(temporario, destino)
+
+        job.arquivo = relativo
+        job.status = "PRONTO"
+        job.html = None
+        job.concluido_em = utc_now()
+        db.session.commit()
+
+        try:
+            descartar_versoes_antigas(job)
+        except Exception:
+            # o PDF novo já está pronto: a limpeza fica para o `relatorios limpar`
+            logger.exception("Falha ao apagar versões antigas do job %s", job_id)
+            db.session.rollback()
+
+    except Exception as e:
+        logger.exception("Falha ao gerar PDF do job %s", job_id)
+        db.session.rollback()
+
+        job = db.session.get(RelatorioJob, job_id)
+        job.status = "ERRO"
+        job.erro = str(e)[:1000]
+        job.concluido_em = utc_now()
+        db.session.commit()
+
+    finally:
+        with _concluidos_lock:
+            evento = _concluidos.pop(job_id, None)
+        if evento:
+            evento.set()
+
+    return job_id
+
+
+def liberar_travados():
+    """
+    Devolve para a fila jobs PROCESSANDO há muito tempo (worker morto no meio).
+    """
+
+    liberados = db.session.execute(
+        update(RelatorioJob)
+        .where(
+            RelatorioJob.status == "PROCESSANDO",
+            RelatorioJob.iniciado_em < utc_now() - PROCESSANDO_EXPIRA
+        )
+        .values(status="PENDENTE")
+    ).rowcount
+
+    db.session.commit()
+    return liberados
+
+
+def descartar_por_referencia(empresa_id, referencia):
+    """
+    Apaga jobs e arquivos ligados a um registro (ex.: recibos de uma venda
+    cancelada). Não faz commit. Se a transação voltar atrás, o job fica
+    sem arquivo e é gerado de novo no próximo pedido.
+    """
+
+    jobs = RelatorioJob.query.filter_by(
+        empresa_id=empresa_id,
+        referencia=referencia
+    ).all()
+
+    for job in jobs:
+        _remover_arquivo(job.arquivo)
+        db.session.delete(job)
+
+    return len(jobs)
+
+
+def descartar_versoes_antigas(job):
+    """
+    Apaga (com commit) os jobs terminados do mesmo grupo anteriores a
+    este, e os arquivos deles. Retorna quantos.
+    """
+
+    if not job.grupo:
+        return 0
+
+    return _apagar_jobs(
+        RelatorioJob.empresa_id == job.empresa_id,
+        RelatorioJob.grupo == job.grupo,
+        RelatorioJob.id < job.id
+    )
+
+
+def limpar_antigos(retencao=RETENCAO_PADRAO, lote=200):
+    """
+    Apaga jobs terminados (PRONTO / ERRO) há mais que `retencao`, com
+    os arquivos. Retorna quantos.
+    """
+
+    limite = utc_now() - retencao
+    apagados = 0
+
+    while True:
+        qtd = _apagar_jobs(
+            func.coalesce(RelatorioJob.concluido_em, RelatorioJob.criado_em) < limite,
+            lote=lote
+        )
+
+        if not qtd:
+            return apagados
+
+        apagados += qtd
+
+
+def _apagar_jobs(*filtros, lote=None):
+    # só jobs terminados: PENDENTE / PROCESSANDO ainda têm alguém esperando
+    stmt = (
+        select(RelatorioJob.id, RelatorioJob.arquivo)
+        .where(RelatorioJob.status.in_(("PRONTO", "ERRO")), *filtros)
+        .order_by(RelatorioJob.id)
+        .with_for_update(skip_locked=True)
+    )
+
+    if lote:
+        stmt = stmt.limit(lote)
+
+    jobs = db.session.execute(stmt).all()
+
+    if not jobs:
+        db.session.rollback()
+        return 0
+
+    for _, arquivo in jobs:
+        _remover_arquivo(arquivo)
+
+    db.session.execute(
+        delete(RelatorioJob)
+        .where(RelatorioJob.id.in_([id_ for id_, _ in jobs]))
+    )
+    db.session.commit()
+
+    return len(jobs)
+
+
+def _remover_arquivo(relativo):
+    if not relativo:
+        return
+
+    try:
+        os.remove(os.path.join(current_app.config["UPLOAD_ROOT"], relativo))
+    except FileNotFoundError:
+        pass
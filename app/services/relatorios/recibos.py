@@ -0,0 +1,96 @@
+import hashlib
+import json
+
+from flask import make_response, render_template, request
+
+from app import db
+from app.models import Empresa
+from app.services.relatorios.pdf_jobs import descartar_por_referencia, obter_pdf
+
+
+# =====================================================
+# 🧾 RECIBOS (VENDA / ORÇAMENTO) COM CACHE IMUTÁVEL
+# =====================================================
+# O recibo é identificado pelo hash do conteúdo impresso (venda, itens,
+# cabeçalho da empresa). Mesmo hash = mesmos bytes:
+#   - o PDF gerado é reaproveitado do disco
+#   - o hash é o ETag forte: o navegador revalida e recebe 304
+#
+# Mudou algo do que sai no papel? Aumente RECIBO_LAYOUT_VERSAO.
+RECIBO_LAYOUT_VERSAO = 1
+
+
+def referencia_venda(venda_id):
+    return f"venda:{venda_id}"
+
+
+def hash_recibo(venda):
+    empresa = db.session.get(Empresa, venda.empresa_id)
+
+    conteudo = {
+        "layout": RECIBO_LAYOUT_VERSAO,
+        "empresa": [empresa.nome, empresa.cnpj] if empresa else None,
+        "venda": [
+            venda.id,
+            venda.status,
+            venda.criado_em,
+            venda.cliente_nome,
+            venda.cliente_telefone,
+            venda.tipo_pagamento,
+            venda.desconto,
+            venda.valor_total,
+        ],
+        "itens": [
+            [
+                item.peca_id,
+                item.peca.tipo.nome if item.peca and item.peca.tipo else None,
+                item.peca.qualidade if item.peca else None,
+                item.quantidade,
+                item.valor_unitario,
+            ]
+            for item in sorted(venda.itens, key=lambda i: i.id)
+        ],
+    }
+
+    return hashlib.sha256(
+        json.dumps(conteudo, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def responder_recibo(relatorio, venda, template, nome_arquivo):
+    """
+    Resposta do recibo: 304 se o navegador já tem esta versão,
+    senão o PDF do disco (ou a página de espera enquanto é gerado).
+    """
+
+    etag = hash_recibo(venda)
+
+    if etag in request.if_none_match:
+        resposta = make_response("", 304)
+    else:
+        resposta = obter_pdf(
+            relatorio,
+            {"venda_id": venda.id},
+            etag,
+            lambda: render_template(template, venda=venda),
+            nome_arquivo,
+            referencia=referencia_venda(venda.id)
+        )
+
+        # página de espera: sem cache
+        if resposta.mimetype != "application/pdf":
+            return resposta
+
+    resposta.set_etag(etag)
+    # a URL é sempre a mesma (o recibo muda ao cancelar/converter): revalida sempre,
+    # mas só baixa de novo quando o ETag mudar
+    resposta.headers["Cache-Control"] = "private, no-cache"
+
+    return resposta
+
+
+def descartar_recibos(venda):
+    """
+    Chamar ao cancelar / converter: os recibos antigos não valem mais.
+    """
+    return descartar_por_referencia(venda.empresa_id, referencia_venda(venda.id))
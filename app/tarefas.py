@@ -0,0 +1,80 @@
+# app/tarefas.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+# =====================================================
+# ⚙️ TAREFAS EM SEGUNDO PLANO (NO PRÓPRIO PROCESSO)
+# =====================================================
+# Pools do processo para trabalho que não deve segurar uma thread do
+# waitress (PDF, chamadas externas, etc.).
+# Cada tarefa roda dentro de um app_context e sempre libera a
+# sessão do banco no fim.
+#
+# Pagamentos (cobrança Pix, caixa de entrada dos webhooks) têm pool
+# próprio: uma fila de PDFs pesados não atrasa o QR Code do cliente.
+TAREFAS_MAX_THREADS = 4
+TAREFAS_PAGAMENTO_MAX_THREADS = 2
+
+# fila -> (chave da config, padrão)
+FILAS = {
+    "tarefa": ("TAREFAS_MAX_THREADS", TAREFAS_MAX_THREADS),
+    "pagamento": ("TAREFAS_PAGAMENTO_MAX_THREADS", TAREFAS_PAGAMENTO_MAX_THREADS),
+}
+
+_executores = {}
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _obter_executor(app, fila):
+    with _executor_lock:
+        executor = _executores.get(fila)
+        if executor is None:
+            chave, padrao = FILAS[fila]
+            executor = _executores[fila] = ThreadPoolExecutor(
+                max_workers=app.config.get(chave, padrao),
+                thread_name_prefix=fila
+            )
+        return executor
+
+
+def _executar(app, fn, args, kwargs):
+    from app import db
+
+    with app.app_context():
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Falha na tarefa em segundo plano %s", getattr(fn, "__name__", fn))
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def _enviar(fila, fn, args, kwargs):
+    app = current_app._get_current_object()
+    return _obter_executor(app, fila).submit(_executar, app, fn, args, kwargs)
+
+
+def enviar_tarefa(fn, *args, **kwargs):
+    """
+    Executa fn(*args, **kwargs) em segundo plano, com app_context.
+    Passe apenas ids/valores simples (nunca objetos da sessão atual).
+    Retorna o Future.
+    """
+
+    return _enviar("tarefa", fn, args, kwargs)
+
+
+def enviar_tarefa_pagamento(fn, *args, **kwargs):
+    """
+    enviar_tarefa no pool de pagamentos.
+    """
+
+    return _enviar("pagamento", fn, args, kwargs)
@@ -0,0 +1,25 @@
+# app/utils_busca.py
+import unicodedata
+
+
+def normalizar_busca(texto):
+    """
+    Minúsculas, sem acentos e com espaços simples.
+    Usada tanto no texto indexado quanto no termo pesquisado.
+    """
+
+    if not texto:
+        return ""
+
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+
+    return " ".join(texto.lower().split())
+
+
+def montar_busca_texto(*partes):
+    return normalizar_busca(" ".join(str(p) for p in partes if p))
+
+
+def escapar_like(termo):
+    return termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -9,6 +9,10 @@ def utc_now():
     """Datetime UTC (timezone-aware)"""
     return datetime.now(UTC).replace(microsecond=0)
 
+def utc_now_exato():
+    """Datetime UTC com microssegundos (para versões/carimbos de alteração)"""
+    return datetime.now(UTC)
+
 def utc_to_br(dt):
     """
     Converte datetime UTC para horário do Brasil.
@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# =====================================================
+# 🖼️ IMAGENS DAS PEÇAS (WEBP + MINIATURAS)
+# =====================================================
+# Toda foto enviada vira, na mesma pasta:
+#   <nome>.webp     até DIMENSAO_MAX px (tela de detalhe / zoom)
+#   <nome>_m.webp   até 480 px
+#   <nome>_p.webp   até 160 px (listagens, BI)
+#
+# A orientação do EXIF é aplicada nos pixels e nenhum metadado é
+# gravado (localização do celular, modelo da câmera...).
+#
+# Imagens antigas (enviadas antes disso) não têm variantes:
+# imagem_variante devolve o próprio arquivo original.
+DIMENSAO_MAX = 1600
+VARIANTES = {"m": 480, "p": 160}   # da maior para a menor (reduz em cascata)
+QUALIDADE_WEBP = 80
+
+# nome gerado pelo pipeline: sha256 do arquivo enviado (ou 32 hex, fotos
+# da primeira versão do pipeline) + .webp
+_NOME_PIPELINE = re.compile(r"^(?:[0-9a-f]{64}|[0-9a-f]{32})\.webp$")
+
+
+class ImagemInvalida(ValueError):
+    pass
+
+
+def gerar_variantes(origem, destino):
+    """
+    origem: caminho ou arquivo aberto. destino: caminho sem extensão.
+    Grava as três versões WebP; levanta ImagemInvalida se não for imagem.
+    """
+
+    try:
+        with Image.open(origem) as original:
+            # JPEG: decodifica já reduzido (escala do DCT), bem mais rápido
+            # para fotos de 12+ MP
+            original.draft("RGB", (DIMENSAO_MAX, DIMENSAO_MAX))
+            img = ImageOps.exif_transpose(original)
+            img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImagemInvalida("Arquivo de imagem inválido ou não suportado.") from e
+
+    if img.mode not in ("RGB", "RGBA"):
+        transparente = "A" in img.mode or "transparency" in img.info
+        img = img.convert("RGBA" if transparente else "RGB")
+
+    img.thumbnail((DIMENSAO_MAX, DIMENSAO_MAX), Image.LANCZOS)
+    _salvar_webp(img, f"{destino}.webp")
+
+    for sufixo, lado in VARIANTES.items():
+        img.thumbnail((lado, lado), Image.LANCZOS)
+        _salvar_webp(img, f"{destino}_{sufixo}.webp")
+
+
+def variantes_prontas(destino):
+    # a menor variante é a última gravada por gerar_variantes
+    menor = list(VARIANTES)[-1]
+    return os.path.exists(f"{destino}_{menor}.webp")
+
+
+def _salvar_webp(img, caminho):
+    # grava e renomeia: o mesmo nome pode estar sendo gerado / servido ao mesmo tempo
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    # exif vazio explícito: nada do arquivo original vai junto
+    img.save(temporario, "WEBP", quality=QUALIDADE_WEBP, method=4, exif=b"")
+    os.replace(temporario, caminho)
+
+
+def arquivos_da_imagem(caminho):
+    """
+    O arquivo e as variantes que existirem para ele (para apagar).
+    """
+
+    return [caminho] + [
+        variante
+        for variante in (imagem_variante(caminho, t) for t in VARIANTES)
+        if variante != caminho
+    ]
+
+
+def imagem_variante(caminho, tamanho="p"):
+    """
+    Filtro Jinja: caminho da variante ("p" | "m") de uma imagem salva
+    pelo pipeline; qualquer outro caminho volta sem mudança.
+
+        {{ p.imagem|imagem_variante('p')|url_upload }}
+    """
+
+    if not caminho or tamanho not in VARIANTES:
+        return caminho
+
+    pasta, nome = os.path.split(caminho)
+
+    if not _NOME_PIPELINE.match(nome):
+        return caminho
+
+    return f"{pasta}/{nome[:-5]}_{tamanho}.webp"
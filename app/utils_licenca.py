@@ -1,15 +1,100 @@
 # app/utils_licenca.py
+import threading
+from datetime import datetime, time, timedelta
 from functools import wraps
 from flask import redirect, url_for, flash
 from flask_login import current_user, logout_user
 from app.models import LicencaSistema
+from app.utils_datetime import UTC, utc_now
+
+
+# =====================================================
+# 🧠 CACHE DE LICENÇA POR EMPRESA
+# =====================================================
+# TTL máximo; nunca passa do fim da própria licença.
+# Invalidado explicitamente nas rotas que alteram LicencaSistema.
+LICENCA_CACHE_TTL = timedelta(minutes=5)
+
+_cache_licencas = {}   # empresa_id -> (LicencaVigente | None, expira_em)
+_cache_lock = threading.Lock()
+
+
+class LicencaVigente:
+    """
+    Cópia somente leitura de LicencaSistema.
+    Pode ser compartilhada entre threads (não depende da sessão do banco).
+    """
+
+    def __init__(self, licenca):
+        self.id = licenca.id
+        self.empresa_id = licenca.empresa_id
+        self.data_inicio = licenca.data_inicio
+        self.dias_acesso = licenca.dias_acesso
+        self.data_fim = licenca.data_fim
+
+    @property
+    def dias_restantes(self):
+        hoje = utc_now().date()
+        return max((self.data_fim - hoje).days, 0)
+
+    @property
+    def expirado(self):
+        return self.dias_restantes <= 0
+
+
+def _validade_cache(licenca, agora):
+    expira_em = agora + LICENCA_CACHE_TTL
+
+    if licenca:
+        # expira junto com a licença (virada do dia em UTC, igual a LicencaSistema.expirado)
+        fim_licenca = datetime.combine(licenca.data_fim, time.min, tzinfo=UTC)
+        expira_em = min(expira_em, fim_licenca)
+
+    return expira_em
+
+
+def licenca_vigente(empresa_id):
+    """
+    Licença da empresa (LicencaVigente ou None), com cache.
+    """
+
+    if not empresa_id:
+        return None
+
+    agora = utc_now()
+
+    with _cache_lock:
+        item = _cache_licencas.get(empresa_id)
+
+    if item and item[1] > agora:
+        return item[0]
+
+    licenca = LicencaSistema.query.filter_by(
+        empresa_id=empresa_id
+    ).first()
+
+    licenca = LicencaVigente(licenca) if licenca else None
+
+    with _cache_lock:
+        _cache_licencas[empresa_id] = (licenca, _validade_cache(licenca, agora))
+
+    return licenca
+
+
+def invalidar_licenca(empresa_id):
+    """
+    Remove a licença da empresa do cache.
+    Chamar DEPOIS do commit que altera LicencaSistema.
+    """
+
+    with _cache_lock:
+        _cache_licencas.pop(empresa_id, None)
+
 
 def requer_licenca_ativa(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        licenca = LicencaSistema.query.filter_by(
-            empresa_id=current_user.empresa_id
-        ).first()
+        licenca = licenca_vigente(current_user.empresa_id)
 
         if not licenca or licenca.expirado:
             logout_user()
@@ -0,0 +1,180 @@
+# app/utils_paginacao.py
+import base64
+import json
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+from sqlalchemy.engine import Row
+
+from app import db
+
+
+# =====================================================
+# 📄 PAGINAÇÃO POR CURSOR (KEYSET)
+# =====================================================
+# Ordem fixa (criado_em DESC, id DESC). Em vez de OFFSET + COUNT(*),
+# cada página pede "itens antes/depois de (criado_em, id)", o que o
+# índice (empresa_id, criado_em, id) atende em tempo constante,
+# não importa o quão funda seja a página.
+#
+# O total é opcional e ESTIMADO (plano do PostgreSQL, sem varrer).
+#
+# Linhas com data NULL ficam de fora: não cabem num cursor e a
+# comparação de tupla com NULL as perderia entre páginas.
+POR_PAGINA_PADRAO = 20
+
+
+def codificar_cursor(criado_em, id_):
+    bruto = f"{criado_em.isoformat()}|{id_}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    """
+    (criado_em, id) ou None se o cursor for inválido.
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        data, id_ = bruto.rsplit("|", 1)
+        return datetime.fromisoformat(data), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def estimar_total(query):
+    """
+    Linhas estimadas pelo planejador (EXPLAIN, sem executar a consulta).
+    None fora do PostgreSQL.
+    """
+
+    bind = db.session.get_bind()
+
+    if bind.dialect.name != "postgresql":
+        return None
+
+    compilado = query.order_by(None).statement.compile(
+        dialect=bind.dialect,
+        compile_kwargs={"render_postcompile": True}
+    )
+
+    plano = db.session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compilado}",
+        compilado.params
+    ).scalar()
+
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+
+    return int(plano[0]["Plan"]["Plan Rows"])
+
+
+class PaginaCursor:
+
+    def __init__(self, items, chave, has_prev, has_next, total_estimado=None):
+        self.items = items
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        self.total_estimado = total_estimado
+
+        self.cursor_anterior = codificar_cursor(*chave(items[0])) if self.has_prev else None
+        self.cursor_proximo = codificar_cursor(*chave(items[-1])) if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def _url(self, **cursor):
+        # mantém os filtros da tela, troca só o cursor
+        args = {
+            k: v for k, v in request.args.items()
+            if k not in ("antes", "depois", "page")
+        }
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def url_anterior(self):
+        return self._url(antes=self.cursor_anterior) if self.has_prev else None
+
+    @property
+    def url_proxima(self):
+        return self._url(depois=self.cursor_proximo) if self.has_next else None
+
+
+def _chave_padrao(coluna_data, coluna_id):
+    def chave(item):
+        # query com colunas extras (ex.: (VendaPeca, qtd_itens)): a entidade vem primeiro
+        entidade = item[0] if isinstance(item, Row) else item
+        return getattr(entidade, coluna_data.key), getattr(entidade, coluna_id.key)
+
+    return chave
+
+
+def paginar_por_cursor(
+    query,
+    coluna_data,
+    coluna_id,
+    por_pagina=POR_PAGINA_PADRAO,
+    depois=None,
+    antes=None,
+    com_total=False
+):
+    """
+    Página de `query` em ordem (coluna_data DESC, coluna_id DESC).
+
+    depois -> itens mais antigos que o cursor (próxima página)
+    antes  -> itens mais novos que o cursor (página anterior)
+    Sem cursor: primeira página. A ordem da query é substituída.
+    """
+
+    chave = _chave_padrao(coluna_data, coluna_id)
+    query = query.filter(coluna_data.isnot(None))
+    total = estimar_total(query) if com_total else None
+
+    query = query.order_by(None)
+    posicao_depois = decodificar_cursor(depois)
+    posicao_antes = None if posicao_depois else decodificar_cursor(antes)
+
+    if posicao_antes:
+        itens = (
+            query
+            .filter(tuple_(coluna_data, coluna_id) > posicao_antes)
+            .order_by(coluna_data.asc(), coluna_id.asc())
+            .limit(por_pagina + 1)
+            .all()
+        )
+        mais = len(itens) > por_pagina
+        itens = list(reversed(itens[:por_pagina]))
+
+        return PaginaCursor(itens, chave, has_prev=mais, has_next=True, total_estimado=total)
+
+    if posicao_depois:
+        query = query.filter(tuple_(coluna_data, coluna_id) < posicao_depois)
+
+    itens = (
+        query
+        .order_by(coluna_data.desc(), coluna_id.desc())
+        .limit(por_pagina + 1)
+        .all()
+    )
+    mais = len(itens) > por_pagina
+
+    return PaginaCursor(
+        itens[:por_pagina],
+        chave,
+        has_prev=bool(posicao_depois),
+        has_next=mais,
+        total_estimado=total
+    )
+
+
+def args_cursor():
+    """
+    (depois, antes) da requisição atual.
+    """
+
+    return request.args.get("depois"), request.args.get("antes")
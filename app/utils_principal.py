@@ -0,0 +1,147 @@
+# app/utils_principal.py
+import threading
+from collections import OrderedDict
+
+from flask import g
+from flask_login import current_user
+
+from app import db
+from app.models import Empresa, Permissao, Usuario
+from app.utils_licenca import licenca_vigente
+
+
+# =====================================================
+# 🧠 CACHE DE PERMISSÕES (ENTRE REQUISIÇÕES)
+# =====================================================
+# chave: (usuario_id, permissoes_versao)
+# A versão fica no próprio Usuario e é incrementada na MESMA
+# transação que altera Permissao, e é lida na mesma consulta que as
+# permissões → uma chave nunca aponta para permissões de outra versão,
+# mesmo com vários processos/threads.
+CACHE_PERMISSOES_MAX = 2048
+
+_cache_permissoes = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _permissoes_em_cache(chave):
+    with _cache_lock:
+        permissoes = _cache_permissoes.get(chave)
+        if permissoes is not None:
+            _cache_permissoes.move_to_end(chave)
+        return permissoes
+
+
+def _guardar_permissoes(chave, permissoes):
+    with _cache_lock:
+        _cache_permissoes[chave] = permissoes
+        _cache_permissoes.move_to_end(chave)
+
+        while len(_cache_permissoes) > CACHE_PERMISSOES_MAX:
+            _cache_permissoes.popitem(last=False)
+
+
+def invalidar_permissoes(usuario_id):
+    """
+    Incrementa a versão de permissões do usuário.
+
+    Chamar ANTES do commit que altera Permissao, para que a
+    nova versão e as novas permissões fiquem visíveis juntas.
+    """
+
+    Usuario.query.filter_by(id=usuario_id).update(
+        {Usuario.permissoes_versao: Usuario.permissoes_versao + 1},
+        synchronize_session=False
+    )
+
+    # limpeza local (as chaves antigas já não seriam mais usadas)
+    with _cache_lock:
+        for chave in [c for c in _cache_permissoes if c[0] == usuario_id]:
+            del _cache_permissoes[chave]
+
+
+class Principal:
+    """
+    Usuário autenticado da requisição, com empresa,
+    licença e permissões já carregadas.
+
+    Fica em g.principal e é reaproveitado pelos decorators
+    (requer_permissao, requer_licenca_ativa) e context processors.
+    """
+
+    def __init__(self, usuario, empresa, licenca, permissoes):
+        self.usuario = usuario
+        self.empresa = empresa
+        self.licenca = licenca
+        self.permissoes = permissoes
+
+    def tem_permissao(self, categoria, acao):
+        return (categoria, acao) in self.permissoes
+
+
+def carregar_principal(usuario_id):
+    """
+    Carrega usuário + empresa em uma consulta; licença e
+    permissões vêm dos caches (consulta só no miss).
+    Guarda o resultado em g.principal.
+    """
+
+    linha = (
+        db.session.query(Usuario, Empresa)
+        .outerjoin(Empresa, Empresa.id == Usuario.empresa_id)
+        .filter(Usuario.id == usuario_id)
+        .first()
+    )
+
+    if not linha:
+        return None
+
+    usuario, empresa = linha
+    licenca = licenca_vigente(usuario.empresa_id)
+
+    chave = (usuario.id, usuario.permissoes_versao or 0)
+    permissoes = _permissoes_em_cache(chave)
+
+    if permissoes is None:
+        # versão e permissões na MESMA consulta (mesmo snapshot): um commit
+        # entre duas consultas guardaria as permissões novas na versão antiga
+        linhas = (
+            db.session.query(Usuario.permissoes_versao, Permissao.categoria, Permissao.acao)
+            .outerjoin(Permissao, Permissao.usuario_id == Usuario.id)
+            .filter(Usuario.id == usuario.id)
+            .all()
+        )
+
+        permissoes = frozenset(
+            (categoria, acao)
+            for _, categoria, acao in linhas
+            if categoria is not None
+        )
+
+        if linhas:
+            _guardar_permissoes((usuario.id, linhas[0][0] or 0), permissoes)
+
+    # 🔹 Usuario.todas_permissoes / tem_permissao passam a ler daqui (sem query)
+    usuario._permissoes_cache = permissoes
+
+    principal = Principal(usuario, empresa, licenca, permissoes)
+    g.principal = principal
+
+    return principal
+
+
+def principal_atual():
+    """
+    Principal da requisição atual (None se não autenticado).
+    """
+
+    if not current_user.is_authenticated:
+        return None
+
+    principal = g.get("principal")
+
+    # login_user() na própria requisição não passa pelo user_loader
+    if principal is None or principal.usuario.id != current_user.id:
+        principal = carregar_principal(current_user.id)
+
+    return principal
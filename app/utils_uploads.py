@@ -1,7 +1,78 @@
+import hashlib
 import os
-from flask import current_app
+import re
+import tempfile
+from flask import current_app, url_for
 from werkzeug.utils import secure_filename
 from flask_login import current_user
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app import db
+from app.models import ArquivoUpload
+from app.utils_imagens import arquivos_da_imagem, gerar_variantes, variantes_prontas
+
+# =====================================================
+# 📦 UPLOADS ENDEREÇADOS PELO CONTEÚDO
+# =====================================================
+# O nome do arquivo é o sha256 do que foi enviado: dois envios iguais
+# viram um arquivo só, e nomes repetidos ("image.jpg") não se sobrescrevem.
+# Como o conteúdo de um nome nunca muda, /arquivos/... serve com cache
+# permanente (immutable).
+#
+# ArquivoUpload.referencias conta quem aponta para cada caminho:
+#   salvar_upload / salvar_imagem  -> +1 (na transação de quem chama)
+#   liberar_upload                 -> -1
+# Arquivos com 0 são apagados pelo `flask uploads limpar`.
+#
+# Limpeza concorrente: a referência é registrada (linha travada até o
+# commit) e só depois se confere se o arquivo está no disco. Imagens são
+# convertidas antes (arquivo inválido não registra nada) e conferidas
+# de novo depois do registro.
+BLOCO = 64 * 1024
+
+# relativo a UPLOAD_ROOT: empresas/<id>/<subpasta>/<sha256>[_m|_p].<ext>
+_ENDERECADO = re.compile(r"^empresas/\d+/[\w-]+/[0-9a-f]{64}(?:_[mp])?\.(?:webp|jpe?g|png|gif)$")
+
+
+def _pasta_empresa(subpasta, empresa_id=None):
+    empresa_id = empresa_id or current_user.empresa_id
+
+    # caminho: uploads/empresas/<empresa_id>/<subpasta>
+    base_path = os.path.join(
+        current_app.config["UPLOAD_ROOT"],
+        "empresas",
+        str(empresa_id),
+        subpasta
+    )
+
+    os.makedirs(base_path, exist_ok=True)
+
+    return base_path, f"uploads/empresas/{empresa_id}/{subpasta}"
+
+
+def _copiar_com_hash(origem, pasta):
+    """
+    Copia o stream para um temporário na pasta de destino (mesmo disco:
+    o os.replace depois é atômico). Retorna (temporario, sha256, tamanho).
+    """
+
+    sha = hashlib.sha256()
+    tamanho = 0
+
+    fd, temporario = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+    with os.fdopen(fd, "wb") as destino:
+        while bloco := origem.read(BLOCO):
+            sha.update(bloco)
+            destino.write(bloco)
+            tamanho += len(bloco)
+
+    return temporario, sha.hexdigest(), tamanho
+
+
+def caminho_absoluto(caminho):
+    # "uploads/empresas/..." (como gravado no banco) -> disco
+    return os.path.join(current_app.config["UPLOAD_ROOT"], caminho.removeprefix("uploads/"))
+
 
 def salvar_upload(
     arquivo,
@@ -10,6 +81,8 @@ def salvar_upload(
 ):
     """
     Salva upload isolado por empresa.
+    Sem nome_forcado o nome é o sha256 do conteúdo (+ extensão) e a
+    referência é contada (ver liberar_upload).
 
     Ex:
     salvar_upload(file, "servicos")
@@ -19,26 +92,181 @@ def salvar_upload(
     if not arquivo:
         return None
 
-    empresa_id = current_user.empresa_id
+    base_path, relativo = _pasta_empresa(subpasta)
 
-    # caminho: uploads/empresas/<empresa_id>/<subpasta>
-    base_path = os.path.join(
-        current_app.config["UPLOAD_ROOT"],
-        "empresas",
-        str(empresa_id),
-        subpasta
+    # nome fixo: substitui o anterior (sem contagem)
+    if nome_forcado:
+        filename = secure_filename(nome_forcado)
+        arquivo.save(os.path.join(base_path, filename))
+        return f"{relativo}/{filename}"
+
+    temporario, sha, tamanho = _copiar_com_hash(arquivo.stream, base_path)
+    extensao = os.path.splitext(secure_filename(arquivo.filename or ""))[1].lower()
+
+    filename = f"{sha}{extensao}"
+    caminho_final = os.path.join(base_path, filename)
+
+    # caminho relativo salvo no banco
+    caminho = f"{relativo}/{filename}"
+
+    try:
+        # registra antes: com a linha travada a limpeza não apaga o arquivo
+        registrar_referencia(caminho, sha, tamanho)
+
+        if not os.path.exists(caminho_final):
+            os.replace(temporario, caminho_final)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    return caminho
+
+
+def salvar_imagem(arquivo, subpasta: str):
+    """
+    Salva foto isolada por empresa, já convertida: WebP redimensionado,
+    sem EXIF, com miniaturas _m/_p (utils_imagens). O nome é o sha256
+    do arquivo enviado: a mesma foto não é convertida duas vezes.
+
+    Levanta ImagemInvalida se o arquivo não for imagem.
+
+    Ex:
+    salvar_imagem(file, "pecas")
+    """
+
+    if not arquivo:
+        return None
+
+    return gravar_imagem(arquivo.stream, subpasta)
+
+
+def gravar_imagem(origem, subpasta: str, empresa_id=None):
+    """
+    salvar_imagem a partir de um arquivo aberto (ex.: conversão de fotos antigas).
+    """
+
+    base_path, relativo = _pasta_empresa(subpasta, empresa_id)
+    temporario, sha, tamanho = _copiar_com_hash(origem, base_path)
+
+    destino = os.path.join(base_path, sha)
+    caminho = f"{relativo}/{sha}.webp"
+
+    try:
+        # imagem inválida levanta aqui, antes de registrar qualquer coisa
+        if not variantes_prontas(destino):
+            gerar_variantes(temporario, destino)
+
+        registrar_referencia(caminho, sha, tamanho, empresa_id)
+
+        # limpeza concorrente pode ter apagado antes do registro
+        if not variantes_prontas(destino):
+            gerar_variantes(temporario, destino)
+    finally:
+        os.remove(temporario)
+
+    return caminho
+
+
+# =====================================================
+# REFERÊNCIAS
+# =====================================================
+def registrar_referencia(caminho, sha, tamanho, empresa_id=None):
+    """
+    +1 referência (sem commit: vale junto com o registro que aponta para o arquivo).
+    """
+
+    tabela = ArquivoUpload
+    stmt = pg_insert(tabela).values(
+        empresa_id=empresa_id or current_user.empresa_id,
+        caminho=caminho,
+        hash=sha,
+        tamanho=tamanho,
+        referencias=1
     )
 
-    os.makedirs(base_path, exist_ok=True)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["caminho"],
+            set_={"referencias": tabela.referencias + 1}
+        )
+    )
+
+
+def liberar_upload(caminho):
+    """
+    -1 referência (sem commit). Caminhos antigos, sem registro, são ignorados.
+    """
+
+    if not caminho:
+        return
 
-    filename = (
-        secure_filename(nome_forcado)
-        if nome_forcado
-        else secure_filename(arquivo.filename)
+    db.session.execute(
+        update(ArquivoUpload)
+        .where(ArquivoUpload.caminho == caminho, ArquivoUpload.referencias > 0)
+        .values(referencias=ArquivoUpload.referencias - 1)
     )
 
-    caminho_final = os.path.join(base_path, filename)
-    arquivo.save(caminho_final)
 
-    # caminho relativo salvo no banco
-    return f"uploads/empresas/{empresa_id}/{subpasta}/{filename}"
+def limpar_orfaos(lote=200):
+    """
+    Apaga arquivos (e miniaturas) sem referência. Retorna quantos.
+    """
+
+    apagados = 0
+
+    while True:
+        orfaos = db.session.execute(
+            select(ArquivoUpload.id, ArquivoUpload.caminho)
+            .where(ArquivoUpload.referencias <= 0)
+            .order_by(ArquivoUpload.id)
+            .limit(lote)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        if not orfaos:
+            db.session.rollback()
+            return apagados
+
+        for _, caminho in orfaos:
+            for arquivo in arquivos_da_imagem(caminho):
+                try:
+                    os.remove(caminho_absoluto(arquivo))
+                except FileNotFoundError:
+                    pass
+
+        db.session.execute(
+            delete(ArquivoUpload)
+            .where(ArquivoUpload.id.in_([id_ for id_, _ in orfaos]))
+        )
+        db.session.commit()
+
+        apagados += len(orfaos)
+
+
+# =====================================================
+# URL
+# =====================================================
+def arquivo_enderecado(relativo):
+    """
+    relativo: caminho sob UPLOAD_ROOT. True se o nome é o hash do conteúdo.
+    """
+
+    return bool(_ENDERECADO.match(relativo))
+
+
+def url_upload(caminho):
+    """
+    Filtro Jinja: URL de um caminho gravado no banco ("uploads/...").
+    Endereçado pelo conteúdo -> /arquivos/... (cache permanente);
+    caminhos antigos -> /static/...
+    """
+
+    if not caminho:
+        return ""
+
+    relativo = caminho.removeprefix("uploads/")
+
+    if relativo != caminho and arquivo_enderecado(relativo):
+        return url_for("arquivos.servir_arquivo", caminho=relativo)
+
+    return url_for("static", filename=caminho)
@@ -0,0 +1,205 @@
+"""
+Benchmark da fila de e-mail contra um servidor SMTP falso local.
+
+Sobe um "sink" SMTP em 127.0.0.1 (aceita tudo, sem TLS/login) e compara:
+
+  - direto: uma conexão SMTP nova por mensagem, na thread de quem chama
+    (comportamento antigo do send_email)
+  - fila:   send_email enfileira; o remetente em segundo plano reaproveita
+            a conexão e manda em lote
+
+Também confere a retentativa: a primeira entrega de cada mensagem com
+assunto "falha-temporaria" recebe 451 e precisa chegar na segunda.
+
+Uso (não precisa de banco nem de rede):
+
+    python bench_email_fila.py --mensagens 500 --latencia-ms 5
+
+No Gmail real (STARTTLS + login em cada conexão) a diferença é maior.
+"""
+import argparse
+import email
+import socketserver
+import statistics
+import smtplib
+import sys
+import threading
+import time
+from collections import Counter
+from email.message import EmailMessage
+
+from flask import Flask
+
+import app.services.email_service as email_service
+
+
+# =====================================================
+# SMTP FALSO
+# =====================================================
+class EstadoSink:
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        self.conexoes = 0
+        self.entregues = Counter()   # assunto -> entregas
+        self.recusadas = Counter()   # assunto -> 451 enviados
+
+
+def criar_handler(estado):
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def _responder(self, linha):
+            self.wfile.write(linha.encode() + b"\r\n")
+
+        def handle(self):
+            with estado.lock:
+                estado.conexoes += 1
+
+            self._responder("220 sink")
+
+            while True:
+                linha = self.rfile.readline()
+                if not linha:
+                    return
+
+                comando = linha.decode(errors="replace").strip().upper()
+
+                if comando.startswith("EHLO"):
+                    self._responder("250-sink\r\n250 8BITMIME")
+                elif comando.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                    self._responder("250 OK")
+                elif comando == "DATA":
+                    self._responder("354 manda")
+                    self._receber_dados()
+                elif comando == "QUIT":
+                    self._responder("221 tchau")
+                    return
+                else:
+                    self._responder("502 não implementado")
+
+        def _receber_dados(self):
+            linhas = []
+            while True:
+                linha = self.rfile.readline()
+                if linha in (b".\r\n", b""):
+                    break
+                linhas.append(linha)
+
+            time.sleep(estado.latencia)
+            assunto = email.message_from_bytes(b"".join(linhas))["Subject"]
+
+            with estado.lock:
+                if assunto.startswith("falha-temporaria") and not estado.recusadas[assunto]:
+                    estado.recusadas[assunto] += 1
+                    self._responder("451 tente mais tarde")
+                    return
+                estado.entregues[assunto] += 1
+
+            self._responder("250 OK")
+
+    return Handler
+
+
+# =====================================================
+# MEDIÇÃO
+# =====================================================
+def percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return 0.0
+    k = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--mensagens", type=int, default=500)
+    parser.add_argument("--latencia-ms", type=float, default=5.0, help="tempo do sink para aceitar cada DATA")
+    args = parser.parse_args()
+
+    estado = EstadoSink(args.latencia_ms / 1000)
+    servidor = socketserver.ThreadingTCPServer(("127.0.0.1", 0), criar_handler(estado))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=servidor.server_address[1],
+        MAIL_USE_TLS=False,
+        MAIL_USERNAME=None,
+        MAIL_PASSWORD=None,
+        MAIL_DEFAULT_SENDER=("Bench", "bench@fitcell.com.br")
+    )
+
+    # retentativa rápida no bench
+    email_service.ESPERA_BASE_SEGUNDOS = 0.05
+
+    def direto(i):
+        msg = EmailMessage()
+        msg["From"] = "bench@fitcell.com.br"
+        msg["To"] = "destino@fitcell.com.br"
+        msg["Subject"] = f"direto-{i}"
+        msg.set_content("corpo")
+
+        smtp = smtplib.SMTP(app.config["MAIL_SERVER"], app.config["MAIL_PORT"])
+        smtp.send_message(msg)
+        smtp.quit()
+
+    def fila(i):
+        with app.app_context():
+            email_service.send_email("destino@fitcell.com.br", f"fila-{i}", "corpo")
+
+    resultados = []
+    for nome, fn in (("direto", direto), ("fila", fila)):
+        with estado.lock:
+            estado.conexoes = 0
+
+        latencias = []
+        inicio = time.perf_counter()
+        for i in range(args.mensagens):
+            t = time.perf_counter()
+            fn(i)
+            latencias.append(time.perf_counter() - t)
+        email_service.aguardar_envios(60)
+        total = time.perf_counter() - inicio
+
+        resultados.append((nome, total, latencias, estado.conexoes))
+
+    # =====================================================
+    # RELATÓRIO
+    # =====================================================
+    print(f"\n{args.mensagens} mensagens, sink com {args.latencia_ms:.1f} ms por mensagem\n")
+
+    print(f"{'modo':<8}{'total (s)':>10}{'msg/s':>10}{'quem chama p50 (ms)':>22}"
+          f"{'p99 (ms)':>10}{'conexões':>10}")
+    for nome, total, latencias, conexoes in resultados:
+        print(f"{nome:<8}{total:>10.2f}{len(latencias) / total:>10.1f}"
+              f"{statistics.median(latencias) * 1000:>22.3f}"
+              f"{percentil(latencias, 99) * 1000:>10.3f}"
+              f"{conexoes:>10}")
+
+    # =====================================================
+    # RETENTATIVA
+    # =====================================================
+    with app.app_context():
+        for i in range(3):
+            email_service.send_email("destino@fitcell.com.br", f"falha-temporaria-{i}", "corpo")
+
+    esvaziou = email_service.aguardar_envios(30)
+    servidor.shutdown()
+
+    entregues = {a: n for a, n in estado.entregues.items() if a.startswith("falha-temporaria")}
+    faltando = [f"fila-{i}" for i in range(args.mensagens) if estado.entregues[f"fila-{i}"] != 1]
+
+    if not esvaziou or faltando or entregues != {f"falha-temporaria-{i}": 1 for i in range(3)}:
+        print(f"\n❌ Entrega inesperada: {len(faltando)} da fila faltando, retentativas {entregues}")
+        sys.exit(1)
+
+    print("\n✅ Fila entregou tudo uma vez; 451 foi repetido e entregue na segunda tentativa")
+
+
+if __name__ == "__main__":
+    main()
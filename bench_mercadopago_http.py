@@ -0,0 +1,208 @@
+"""
+Benchmark do cliente HTTP do Mercado Pago contra um servidor falso local.
+
+Sobe um servidor HTTP/1.1 (keep-alive) em 127.0.0.1 que imita
+/v1/payments e mede a latência de consultar_pagamento:
+
+  - sem pool: requests.get novo a cada chamada (comportamento antigo)
+  - com pool: MercadoPagoClient (sessão compartilhada + keep-alive)
+
+Também confere a política de retentativa: o primeiro POST de cada
+X-Idempotency-Key recebe 503 e a retentativa precisa chegar com a
+MESMA chave (senão o gateway criaria dois pagamentos).
+
+Uso (não precisa de banco nem de rede):
+
+    python bench_mercadopago_http.py --chamadas 2000 --threads 8
+
+O servidor falso é HTTP puro: em produção (TLS) o ganho do pool é maior,
+porque cada conexão nova também paga o handshake TLS.
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from flask import Flask
+
+import app.services.pagamento.mercadopago_client as mp_client
+
+
+# =====================================================
+# SERVIDOR FALSO
+# =====================================================
+class EstadoServidor:
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        self.conexoes = set()
+        self.chaves_post = Counter()   # X-Idempotency-Key -> tentativas
+
+
+def criar_handler(estado):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # mantém a conexão aberta
+        disable_nagle_algorithm = True  # respostas pequenas: sem esperar o ACK atrasado do cliente
+
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, status, corpo):
+            dados = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def _registrar_conexao(self):
+            with estado.lock:
+                estado.conexoes.add(self.client_address)
+
+        def do_GET(self):
+            self._registrar_conexao()
+            time.sleep(estado.latencia)
+
+            pagamento_id = self.path.rsplit("/", 1)[-1]
+            self._responder(200, {
+                "id": pagamento_id,
+                "status": "approved",
+                "transaction_amount": 10.0
+            })
+
+        def do_POST(self):
+            self._registrar_conexao()
+            tamanho = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(tamanho)
+
+            chave = self.headers.get("X-Idempotency-Key")
+            with estado.lock:
+                estado.chaves_post[chave] += 1
+                tentativa = estado.chaves_post[chave]
+
+            # primeira tentativa de cada chave falha: força a retentativa
+            if tentativa == 1:
+                self._responder(503, {"message": "indisponível"})
+                return
+
+            self._responder(201, {
+                "id": 123,
+                "status": "pending",
+                "point_of_interaction": {
+                    "transaction_data": {"qr_code": "000201", "qr_code_base64": ""}
+                }
+            })
+
+    return Handler
+
+
+# =====================================================
+# MEDIÇÃO
+# =====================================================
+def percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return 0.0
+    k = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[k]
+
+
+def medir(fn, chamadas, threads):
+    latencias = []
+    lock = threading.Lock()
+
+    def executar(i):
+        inicio = time.perf_counter()
+        fn(i)
+        duracao = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracao)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(executar, range(chamadas)))
+
+    return time.perf_counter() - inicio, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--chamadas", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latencia-ms", type=float, default=2.0, help="tempo de resposta do servidor falso")
+    args = parser.parse_args()
+
+    estado = EstadoServidor(args.latencia_ms / 1000)
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), criar_handler(estado))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{servidor.server_port}"
+
+    app = Flask(__name__)
+    app.config["MERCADOPAGO_BASE_URL"] = base_url
+
+    # configuração da empresa sem banco
+    mp_client._buscar_config = lambda empresa_id: mp_client.ConfigMercadoPago("APP_USR-bench")
+
+    headers = {"Authorization": "Bearer APP_USR-bench"}
+
+    def sem_pool(i):
+        requests.get(f"{base_url}/v1/payments/{i}", headers=headers, timeout=mp_client.TIMEOUT)
+
+    def com_pool(i):
+        with app.app_context():
+            mp_client.MercadoPagoClient(1).consultar_pagamento(i)
+
+    resultados = []
+    for nome, fn in (("sem pool", sem_pool), ("com pool", com_pool)):
+        estado.conexoes.clear()
+        total, latencias = medir(fn, args.chamadas, args.threads)
+        resultados.append((nome, total, latencias, len(estado.conexoes)))
+
+    # =====================================================
+    # RELATÓRIO
+    # =====================================================
+    print(f"\n{args.chamadas} consultas, {args.threads} threads, "
+          f"servidor com {args.latencia_ms:.1f} ms\n")
+
+    print(f"{'modo':<10}{'req/s':>10}{'média (ms)':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'conexões':>10}")
+    for nome, total, latencias, conexoes in resultados:
+        print(f"{nome:<10}{len(latencias) / total:>10.1f}"
+              f"{statistics.mean(latencias) * 1000:>12.2f}"
+              f"{percentil(latencias, 50) * 1000:>10.2f}"
+              f"{percentil(latencias, 99) * 1000:>10.2f}"
+              f"{conexoes:>10}")
+
+    # =====================================================
+    # RETENTATIVA + IDEMPOTÊNCIA
+    # =====================================================
+    estado.chaves_post.clear()
+
+    with app.app_context():
+        pagamento = mp_client.MercadoPagoClient(1).criar_pagamento(
+            valor=10,
+            descricao="Bench",
+            email="bench@fitcell.com.br",
+            chave_idempotencia="bench-venda-1"
+        )
+
+    servidor.shutdown()
+
+    if pagamento.get("status") != "pending" or estado.chaves_post != Counter({"bench-venda-1": 2}):
+        print(f"\n❌ Retentativa inesperada: {dict(estado.chaves_post)}")
+        sys.exit(1)
+
+    print("\n✅ POST com 503 foi repetido uma vez, com a mesma X-Idempotency-Key")
+
+
+if __name__ == "__main__":
+    main()
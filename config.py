@@ -37,6 +37,35 @@ class Config:
     # garante que a pasta exista
     os.makedirs(UPLOAD_ROOT, exist_ok=True)
 
+    # ==========================
+    # 📄 RELATÓRIOS PDF (SEGUNDO PLANO)
+    # ==========================
+    # true: renderiza no próprio processo (pool de tarefas)
+    # false: só o `flask relatorios worker` renderiza
+    RELATORIOS_WORKER_EMBUTIDO = os.getenv("RELATORIOS_WORKER_EMBUTIDO", "true").lower() == "true"
+
+    # quanto a requisição espera o PDF antes de mostrar a página de espera
+    RELATORIOS_ESPERA_SEGUNDOS = float(os.getenv("RELATORIOS_ESPERA_SEGUNDOS", "3"))
+
+    # ==========================
+    # 💳 MERCADO PAGO
+    # ==========================
+    # trocar só em testes/benchmarks (servidor falso local)
+    MERCADOPAGO_BASE_URL = os.getenv("MERCADOPAGO_BASE_URL", "https://api.mercadopago.com")
+
+    # long-poll do status da venda Pix: cada espera ocupa uma thread do
+    # waitress, então o máximo deve ficar bem abaixo de --threads
+    PAGAMENTO_STATUS_ESPERA_SEGUNDOS = float(os.getenv("PAGAMENTO_STATUS_ESPERA_SEGUNDOS", "25"))
+    PAGAMENTO_STATUS_ESPERAS_MAX = int(os.getenv("PAGAMENTO_STATUS_ESPERAS_MAX", "2"))
+
+    # webhooks: true processa a caixa de entrada no próprio processo
+    # (pool de pagamentos); false só o `flask pagamentos processar-webhooks`.
+    # Em ambos, o cron `flask pagamentos varrer-pendentes` libera os travados
+    WEBHOOK_WORKER_EMBUTIDO = os.getenv("WEBHOOK_WORKER_EMBUTIDO", "true").lower() == "true"
+
+    # pool próprio dos pagamentos (cobrança Pix, webhooks), fora do dos PDFs
+    TAREFAS_PAGAMENTO_MAX_THREADS = int(os.getenv("TAREFAS_PAGAMENTO_MAX_THREADS", "2"))
+
     # ==========================
     # 🔐 SEGURANÇA
     # ==========================
@@ -2,6 +2,7 @@ from datetime import date
 
 from app import create_app, db
 from app.models import Empresa, Usuario, Permissao, LicencaSistema
+from app.utils_principal import invalidar_permissoes
 
 app = create_app()
 
@@ -75,6 +76,8 @@ with app.app_context():
         ('administracao', 'ver'), ('administracao', 'editar')
     ]
 
+    adicionadas = 0
+
     for categoria, acao in permissoes:
         existe = Permissao.query.filter_by(
             empresa_id=empresa.id,
@@ -91,6 +94,11 @@ with app.app_context():
                 acao=acao
             )
             db.session.add(p)
+            adicionadas += 1
+
+    # nova versão na mesma transação: o cache não serve as permissões antigas
+    if adicionadas:
+        invalidar_permissoes(admin.id)
 
     db.session.commit()
     print("✅ Permissões atribuídas ao usuário admin.")
@@ -0,0 +1,181 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+
+# =====================================================
+# 🧪 AMBIENTE DE TESTE (SQLITE)
+# =====================================================
+# config.py lê DATABASE_URL ao ser importado: o banco de teste precisa
+# estar no ambiente antes do `from app import ...`. Arquivo (e não
+# :memory:) para que threads diferentes vejam o mesmo banco.
+_PASTA = tempfile.mkdtemp(prefix="fitcell-testes-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_PASTA, 'testes.sqlite')}"
+
+from app import create_app, db  # noqa: E402
+from app.models import (  # noqa: E402
+    Empresa, LicencaSistema, MarcaCelular, ModeloCelular, Peca, Permissao, TipoPeca, Usuario
+)
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        SESSION_COOKIE_SECURE=False,
+        UPLOAD_ROOT=os.path.join(_PASTA, "uploads"),
+        RELATORIOS_WORKER_EMBUTIDO=False,
+        WEBHOOK_WORKER_EMBUTIDO=False
+    )
+
+    with app.app_context():
+        db.create_all()
+        _limpar_caches()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+    _limpar_caches()
+
+
+def _limpar_caches():
+    # caches do processo usam ids como chave: o banco é recriado a cada teste
+    from app.utils_licenca import _cache_licencas
+    from app.utils_principal import _cache_permissoes
+
+    _cache_licencas.clear()
+    _cache_permissoes.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def contar_consultas(app):
+    """
+    with contar_consultas() as consultas: ...  -> SQL executado no bloco
+    """
+
+    @contextmanager
+    def contar():
+        consultas = []
+
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", registrar)
+        try:
+            yield consultas
+        finally:
+            event.remove(db.engine, "before_cursor_execute", registrar)
+
+    return contar
+
+
+# =====================================================
+# DADOS
+# =====================================================
+@pytest.fixture
+def empresa(app):
+    empresa = Empresa(nome="Empresa Teste", slug="empresa-teste")
+    db.session.add(empresa)
+    db.session.flush()
+
+    db.session.add(LicencaSistema(empresa_id=empresa.id, dias_acesso=30))
+    db.session.commit()
+
+    return empresa
+
+
+@pytest.fixture
+def catalogo(empresa):
+    """
+    (modelo, peca) mínimos para vendas / movimentações.
+    """
+
+    marca = MarcaCelular(empresa_id=empresa.id, nome="Marca")
+    tipo = TipoPeca(nome="Tela")
+    db.session.add_all([marca, tipo])
+    db.session.flush()
+
+    modelo = ModeloCelular(empresa_id=empresa.id, marca_id=marca.id, nome="Modelo")
+    peca = Peca(
+        empresa_id=empresa.id,
+        tipo_peca_id=tipo.id,
+        qualidade="original",
+        nome="Tela Modelo",
+        codigo_interno="TEL-001",
+        preco_venda=50
+    )
+    db.session.add_all([modelo, peca])
+    db.session.commit()
+
+    return modelo, peca
+
+
+@pytest.fixture
+def novo_usuario(empresa):
+    """
+    novo_usuario(email, permissoes=[(categoria, acao), ...], admin=False)
+    """
+
+    return lambda email, **kwargs: _criar_usuario(empresa, email, **kwargs)
+
+
+def _criar_usuario(empresa, email, permissoes=(), admin=False):
+    usuario = Usuario(
+        empresa_id=empresa.id,
+        nome=email.split("@")[0],
+        email=email,
+        is_admin_empresa=admin,
+        termos_aceitos=True,
+        versao_termos="1.0"
+    )
+    usuario.set_password("senha")
+    db.session.add(usuario)
+    db.session.flush()
+
+    for categoria, acao in permissoes:
+        db.session.add(
+            Permissao(
+                empresa_id=empresa.id,
+                usuario_id=usuario.id,
+                categoria=categoria,
+                acao=acao
+            )
+        )
+
+    db.session.commit()
+    return usuario
+
+
+@pytest.fixture
+def admin(novo_usuario):
+    return novo_usuario(
+        "admin@teste.com",
+        permissoes=[("usuarios", "ver"), ("usuarios", "editar")],
+        admin=True
+    )
+
+
+@pytest.fixture
+def logar(client):
+    """
+    logar(usuario): sessão do Flask-Login sem passar pelo formulário.
+    """
+
+    def logar(usuario):
+        with client.session_transaction() as sessao:
+            sessao["_user_id"] = str(usuario.id)
+            sessao["_fresh"] = True
+
+    return logar
@@ -0,0 +1,24 @@
+from flask_login import login_user
+
+from app import db
+from app.routes_fitcell import _bi_etag
+
+
+def test_etag_muda_com_duas_edicoes_no_mesmo_segundo(app, catalogo, novo_usuario):
+    _, peca = catalogo
+    usuario = novo_usuario("gerente@teste.com")
+
+    def etag():
+        with app.test_request_context("/fitcell/bi/summary"):
+            login_user(usuario)
+            return _bi_etag(None, None)
+
+    vistos = [etag()]
+
+    # edições seguidas (bem menos de 1s entre elas)
+    for preco in (60, 70):
+        peca.preco_venda = preco
+        db.session.commit()
+        vistos.append(etag())
+
+    assert len(set(vistos)) == 3
@@ -0,0 +1,87 @@
+import threading
+
+from app import db
+from app.models import Permissao
+from app.utils_principal import _cache_lock, _cache_permissoes, carregar_principal, invalidar_permissoes
+
+
+def _tem_venda_ver(app, usuario_id):
+    with app.test_request_context():
+        usuario = carregar_principal(usuario_id).usuario
+        return usuario.permissoes_versao, usuario.tem_permissao("venda", "ver")
+
+
+def _em_cache(usuario_id):
+    # (versão, tem venda/ver) de cada entrada do usuário no cache
+    with _cache_lock:
+        return [
+            (versao, ("venda", "ver") in permissoes)
+            for (id_, versao), permissoes in _cache_permissoes.items()
+            if id_ == usuario_id
+        ]
+
+
+def test_cache_so_muda_com_a_versao(app, novo_usuario):
+    usuario = novo_usuario("vendedor@teste.com")
+    assert _tem_venda_ver(app, usuario.id) == (0, False)
+
+    # Permissao gravada sem bump (o que os scripts de criação faziam):
+    # a chave (usuario, versão) continua servindo o conjunto antigo
+    db.session.add(Permissao(empresa_id=usuario.empresa_id, usuario_id=usuario.id, categoria="venda", acao="ver"))
+    db.session.commit()
+    assert _tem_venda_ver(app, usuario.id) == (0, False)
+
+    invalidar_permissoes(usuario.id)
+    db.session.commit()
+    assert _tem_venda_ver(app, usuario.id) == (1, True)
+
+
+def test_leituras_concorrentes_acompanham_gerenciar_permissoes(app, client, admin, novo_usuario, logar):
+    """
+    Threads lendo tem_permissao enquanto gerenciar_permissoes marca e
+    desmarca "venda/ver": cada versão no cache tem sempre as permissões
+    gravadas junto com ela.
+    """
+
+    usuario_id = novo_usuario("vendedor@teste.com").id
+    logar(admin)
+
+    esperado = {0: False}   # versão -> tem venda/ver
+    vistos = []
+    erros = []
+    parar = threading.Event()
+
+    def ler():
+        try:
+            while not parar.is_set():
+                _tem_venda_ver(app, usuario_id)
+                vistos.extend(_em_cache(usuario_id))
+        except Exception as e:   # falha na thread vira falha do teste
+            erros.append(e)
+
+    leitores = [threading.Thread(target=ler) for _ in range(4)]
+    for t in leitores:
+        t.start()
+
+    try:
+        for versao in range(1, 21):
+            marcar = versao % 2 == 1
+            resposta = client.post(
+                f"/usuarios/permissoes/{usuario_id}",
+                data={"venda_ver": "on"} if marcar else {}
+            )
+            assert resposta.status_code == 302
+            assert resposta.headers["Location"].endswith("/usuarios")
+            esperado[versao] = marcar
+    finally:
+        parar.set()
+        for t in leitores:
+            t.join()
+
+    assert not erros
+    assert len({versao for versao, _ in vistos}) > 1
+
+    errados = [(versao, tem) for versao, tem in vistos if esperado[versao] != tem]
+    assert not errados
+
+    assert _tem_venda_ver(app, usuario_id) == (20, False)
@@ -0,0 +1,68 @@
+import csv
+import io
+import zipfile
+
+from app import db
+from app.models import EstoqueMovimentacao
+
+
+def _linhas_csv(resposta):
+    texto = resposta.get_data(as_text=True).lstrip("\ufeff")
+    return list(csv.reader(io.StringIO(texto), delimiter=";"))
+
+
+def test_exportacao_aplica_a_busca_da_listagem(app, client, empresa, catalogo, novo_usuario, logar):
+    _, peca = catalogo
+    logar(novo_usuario("estoquista@teste.com", permissoes=[("estoque", "ver")]))
+
+    for observacao in ("ajuste inventário", "compra nota 123", "compra nota 456"):
+        db.session.add(
+            EstoqueMovimentacao(
+                empresa_id=empresa.id,
+                peca_id=peca.id,
+                tipo="entrada",
+                quantidade=1,
+                observacao=observacao
+            )
+        )
+    db.session.commit()
+
+    url = "/fitcell/estoque/movimentacoes/exportar"
+
+    todas = _linhas_csv(client.get(url, query_string={"formato": "csv"}))
+    assert len(todas) == 1 + 3
+
+    filtradas = _linhas_csv(client.get(url, query_string={"formato": "csv", "busca": "nota"}))
+    assert sorted(linha[-1] for linha in filtradas[1:]) == ["compra nota 123", "compra nota 456"]
+
+    # busca também no código da peça, como na listagem
+    assert len(_linhas_csv(client.get(url, query_string={"formato": "csv", "busca": "TEL-0"}))) == 1 + 3
+
+
+def test_texto_livre_nao_vira_formula(app, client, empresa, catalogo, novo_usuario, logar):
+    _, peca = catalogo
+    logar(novo_usuario("estoquista@teste.com", permissoes=[("estoque", "ver")]))
+
+    observacoes = ["=HYPERLINK(\"http://x\")", "+1", "-2", "@SUM(A1)", "normal"]
+    for observacao in observacoes:
+        db.session.add(
+            EstoqueMovimentacao(
+                empresa_id=empresa.id,
+                peca_id=peca.id,
+                tipo="entrada",
+                quantidade=1,
+                observacao=observacao
+            )
+        )
+    db.session.commit()
+
+    url = "/fitcell/estoque/movimentacoes/exportar"
+
+    linhas = _linhas_csv(client.get(url, query_string={"formato": "csv"}))
+    assert [linha[-1] for linha in linhas[1:]] == ["'" + o for o in observacoes[:-1]] + ["normal"]
+
+    # XLSX: grava como texto (sem <f> de fórmula na planilha)
+    resposta = client.get(url, query_string={"formato": "xlsx"})
+    with zipfile.ZipFile(io.BytesIO(resposta.get_data())) as xlsx:
+        planilha = xlsx.read("xl/worksheets/sheet1.xml").decode()
+    assert "<f>" not in planilha
@@ -0,0 +1,44 @@
+import pytest
+from flask_login import login_user
+
+
+def _contexto(app, url, usuario, contar_consultas):
+    """
+    Contexto dos templates (context processors) para `url`, e o SQL executado.
+    """
+
+    with app.test_request_context(url):
+        login_user(usuario)
+
+        with contar_consultas() as consultas:
+            contexto = {}
+            app.update_template_context(contexto)
+
+    return contexto, consultas
+
+
+@pytest.mark.parametrize("url", [
+    "/fitcell/vendas/pecas/1/status",
+    "/fitcell/vendas/pecas/1/status/aguardar",
+    "/fitcell/relatorios/vendas-pecas/pdf",
+    "/fitcell/bi/kpis",
+])
+def test_json_e_pdf_nao_consultam_licenca(app, novo_usuario, contar_consultas, url):
+    usuario = novo_usuario("vendedor@teste.com")
+
+    contexto, consultas = _contexto(app, url, usuario, contar_consultas)
+
+    assert "licenca" not in contexto
+    assert consultas == []
+
+
+def test_pagina_html_usa_licenca_do_cache(app, empresa, novo_usuario, contar_consultas):
+    usuario = novo_usuario("vendedor@teste.com")
+
+    # primeira página carrega licença / permissões nos caches
+    _contexto(app, "/usuarios", usuario, contar_consultas)
+
+    contexto, consultas = _contexto(app, "/usuarios", usuario, contar_consultas)
+
+    assert contexto["licenca"].empresa_id == empresa.id
+    assert not [sql for sql in consultas if "licenca_sistema" in sql]
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app import db
+from app.models import Cliente
+from app.utils_paginacao import paginar_por_cursor
+
+
+@pytest.mark.parametrize("por_pagina", [4, 20])
+def test_percorre_todas_as_paginas_ignorando_data_nula(app, empresa, por_pagina):
+    base = datetime(2026, 1, 1)
+
+    # datas repetidas (desempate por id)
+    for i in range(26):
+        db.session.add(Cliente(empresa_id=empresa.id, nome=str(i), criado_em=base + timedelta(hours=i // 2)))
+    db.session.flush()
+
+    # 8 sem data. None no objeto dispararia o default: anula direto no banco.
+    # Com 20 por página a primeira termina numa linha sem data (cursor quebrava)
+    db.session.execute(
+        update(Cliente)
+        .where(Cliente.id % 3 == 0)
+        .values(criado_em=None)
+    )
+    db.session.commit()
+
+    query = Cliente.query.filter_by(empresa_id=empresa.id)
+    com_data = query.filter(Cliente.criado_em.isnot(None)).count()
+
+    vistos = []
+    pagina = paginar_por_cursor(query, Cliente.criado_em, Cliente.id, por_pagina=por_pagina)
+    vistos += [c.id for c in pagina]
+
+    while pagina.has_next:
+        pagina = paginar_por_cursor(
+            query, Cliente.criado_em, Cliente.id,
+            por_pagina=por_pagina, depois=pagina.cursor_proximo
+        )
+        vistos += [c.id for c in pagina]
+
+    assert len(vistos) == len(set(vistos)) == com_data
+
+    if not pagina.has_prev:
+        return
+
+    # volta uma página a partir da última
+    anterior = paginar_por_cursor(
+        query, Cliente.criado_em, Cliente.id,
+        por_pagina=por_pagina, antes=pagina.cursor_anterior
+    )
+    assert [c.id for c in anterior] == vistos[-len(pagina.items) - por_pagina:-len(pagina.items)]
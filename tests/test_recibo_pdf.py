@@ -0,0 +1,45 @@
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import VendaPeca, VendaPecaItem
+
+
+@pytest.mark.parametrize("status, url", [
+    ("FINALIZADA", "/fitcell/vendas/pecas/{id}/pdf"),
+    ("ORCAMENTO", "/fitcell/orcamentos/{id}/pdf"),
+])
+def test_pagina_de_espera_sem_etag(app, client, empresa, catalogo, novo_usuario, logar, status, url):
+    modelo, peca = catalogo
+    logar(novo_usuario("vendedor@teste.com", permissoes=[("venda", "ver")]))
+
+    venda = VendaPeca(
+        empresa_id=empresa.id,
+        modelo_celular_id=modelo.id,
+        tipo_pagamento="dinheiro",
+        status=status,
+        valor_total=Decimal("50")
+    )
+    db.session.add(venda)
+    db.session.flush()
+
+    db.session.add(
+        VendaPecaItem(
+            venda_id=venda.id,
+            peca_id=peca.id,
+            quantidade=1,
+            valor_unitario=Decimal("50"),
+            valor_total=Decimal("50")
+        )
+    )
+    db.session.commit()
+
+    # sem worker embutido (conftest) e sem espera: o PDF ainda não existe
+    app.config["RELATORIOS_ESPERA_SEGUNDOS"] = 0
+
+    resposta = client.get(url.format(id=venda.id))
+
+    assert resposta.status_code == 200
+    assert resposta.mimetype == "text/html"
+    assert "ETag" not in resposta.headers
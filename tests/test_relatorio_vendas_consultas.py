@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from flask_login import login_user
+
+from app import db
+from app.models import VendaPeca, VendaPecaItem
+from app.routes_fitcell import _html_relatorio_vendas_pecas
+
+
+def _criar_vendas(empresa, modelo, peca, qtd, itens_por_venda=3):
+    for _ in range(qtd):
+        venda = VendaPeca(
+            empresa_id=empresa.id,
+            modelo_celular_id=modelo.id,
+            tipo_pagamento="dinheiro",
+            desconto=Decimal("5"),
+            valor_total=Decimal("45") * itens_por_venda
+        )
+        db.session.add(venda)
+        db.session.flush()
+
+        for _ in range(itens_por_venda):
+            db.session.add(
+                VendaPecaItem(
+                    venda_id=venda.id,
+                    peca_id=peca.id,
+                    quantidade=1,
+                    valor_unitario=Decimal("50"),
+                    valor_total=Decimal("50")
+                )
+            )
+
+    db.session.commit()
+
+
+def _consultas_do_relatorio(app, usuario, contar_consultas):
+    with app.test_request_context("/fitcell/relatorios/vendas-pecas/pdf"):
+        login_user(usuario)
+
+        with contar_consultas() as consultas:
+            html = _html_relatorio_vendas_pecas(None, None)
+
+    return len(consultas), html
+
+
+def test_consultas_nao_crescem_com_o_numero_de_vendas(app, empresa, catalogo, novo_usuario, contar_consultas):
+    usuario = novo_usuario("vendedor@teste.com", permissoes=[("venda", "ver")])
+    modelo, peca = catalogo
+    _criar_vendas(empresa, modelo, peca, 1)
+
+    poucas, html = _consultas_do_relatorio(app, usuario, contar_consultas)
+    assert html.count("DINHEIRO") == 1
+
+    VendaPeca.query.delete()
+    VendaPecaItem.query.delete()
+    db.session.commit()
+    _criar_vendas(empresa, modelo, peca, 25)
+
+    muitas, html = _consultas_do_relatorio(app, usuario, contar_consultas)
+    assert html.count("DINHEIRO") == 25
+
+    assert muitas == poucas